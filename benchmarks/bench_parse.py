@@ -0,0 +1,63 @@
+"""
+Benchmarks parsing of the URL_BAZAR_ADDI and URL_SECTORS_LIST pages from the saved fixtures in tests/fixtures.
+
+The fixture rows are repeated to the size of the live pages. When bs4 is installed, the previous row by row
+BeautifulSoup parser is timed as well for comparison.
+
+    $ python benchmarks/bench_parse.py [--rows 1000] [--repeat 5]
+"""
+import argparse
+import os
+import re
+import sys
+import timeit
+
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir, "tests"))
+
+from tfinance.tse_scrapper import TSEScrapper  # noqa: E402
+
+from fake_tsetmc import load_fixture  # noqa: E402
+
+def legacy_parse_tickers(html):
+    from bs4 import BeautifulSoup
+    columns = ["ticker_code", "market", "sector", "sub_market", "latin_ticker", "latin_name", "ticker", "name"]
+    id_pattern = re.compile(".+code=(.+)")
+    table = BeautifulSoup(markup=html, features="lxml").select("table#tblToGrid")[0]
+    records = []
+    for tr in table.find_all(name="tr")[1:]:
+        tds = tr.find_all(name="td")
+        record = dict(zip(columns, (td.text for td in tds)))
+        record["id"] = id_pattern.search(tds[7].a["href"]).groups()[0]
+        records.append(record)
+    return pd.DataFrame(records)
+
+
+def bench(name, func, repeat):
+    best = min(timeit.repeat(func, number=1, repeat=repeat))
+    print("{:<32} {:>10.2f} ms".format(name, best * 1000))
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--rows", type=int, default=1000, help="number of rows of the tickers page")
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    scrapper = object.__new__(TSEScrapper)
+    bazar_addi = load_fixture("bazar_addi.html", args.rows)
+    sectors_list = load_fixture("sectors_list.html", 60)
+    bench("parse_tickers ({} rows)".format(args.rows), lambda: scrapper.parse_tickers(bazar_addi), args.repeat)
+    bench("parse_sectors (60 rows)", lambda: scrapper.parse_sectors(sectors_list), args.repeat)
+    try:
+        import bs4  # noqa: F401
+    except ImportError:
+        return
+    bench("legacy bs4 parse ({} rows)".format(args.rows), lambda: legacy_parse_tickers(bazar_addi), args.repeat)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,218 @@
+"""
+Benchmarks syncing and reading the local database against the fake tsetmc server of tests/fake_tsetmc.py.
+
+Scenarios:
+    cold_sync            Market construction on an empty database (tickers, sectors and full histories)
+    incremental_sync     Market.refresh() after one new session of every ticker
+    unchanged_sync       Market.refresh() when nothing changed
+    ticker               Ticker construction and its history, uncached
+    single_read          Market.fetch_history of one ticker, uncached
+    multi_read           Market.fetch_histories of every ticker, uncached
+    stream_read          Market.iter_all_histories in chunks of 50000 rows
+
+Results are saved as JSON in benchmarks/results (see --output) and can be compared with an earlier run:
+
+    $ python benchmarks/bench_sync.py [--tickers 200] [--days 500] [--latency 0.005] [--store sql|parquet|ipc]
+    $ python benchmarks/bench_sync.py --compare benchmarks/results/<earlier run>.json
+"""
+import argparse
+import datetime
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, os.pardir))
+sys.path.insert(0, os.path.join(HERE, os.pardir, "tests"))
+
+import tfinance  # noqa: E402
+from tfinance import Market, Ticker  # noqa: E402
+from tfinance.fetcher import Fetcher  # noqa: E402
+
+from fake_tsetmc import FakeTsetmc  # noqa: E402
+
+
+class Run:
+    """
+    A Market over a fresh temporary database syncing from server.
+    """
+
+    def __init__(self, server, args):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.cwd = os.getcwd()
+        os.chdir(self.tmp.name)
+        self.server = server
+        self.args = args
+        fetcher = Fetcher(max_workers=args.workers, rate_limit=None, backoff_factor=0.05)
+        self.Scrapper = lambda session, **kwargs: server.Scrapper(session, fetcher=fetcher, **kwargs)
+        self.market = None
+
+    def make_history_store(self):
+        if self.args.store == "sql":
+            return None
+        from tfinance.stores import ArrowHistoryStore
+        return ArrowHistoryStore(os.path.join(self.tmp.name, "history"), format=self.args.store)
+
+    def open(self, offline=False):
+        if self.market is not None:
+            self.market.close()
+        self.market = Market("sqlite:///{}/tse.db".format(self.tmp.name), Scrapper=self.Scrapper,
+                             history_store=self.make_history_store(), offline=offline, cache_size=0)
+        return self.market
+
+    def close(self):
+        if self.market is not None:
+            self.market.close()
+        os.chdir(self.cwd)
+        self.tmp.cleanup()
+
+
+def measure(repeat, setup, func, teardown=None):
+    """
+    Times func(state) repeat times, state coming from setup() outside of the timed section.
+    """
+    times = []
+    for _ in range(repeat):
+        state = setup()
+        try:
+            start = time.perf_counter()
+            func(state)
+            times.append(time.perf_counter() - start)
+        finally:
+            if teardown is not None:
+                teardown(state)
+    return times
+
+
+def run_benchmarks(args):
+    results = {}
+    with FakeTsetmc(tickers=args.tickers, days=args.days, latency=args.latency, rate_limit=args.rate_limit,
+                    error_rate=args.error_rate) as server:
+
+        traffic = {"requests": 0, "bytes": 0}
+
+        def counted(func):
+            """
+            Wraps func so that only the server traffic of the timed section is counted.
+            """
+            def wrapper(state):
+                before = dict(server.stats)
+                func(state)
+                for key in traffic:
+                    traffic[key] += server.stats[key] - before[key]
+            return wrapper
+
+        def record(name, times):
+            results[name] = {"best": min(times), "median": statistics.median(times), "runs": times,
+                             "requests": traffic["requests"] / len(times), "bytes": traffic["bytes"] / len(times)}
+            traffic.update(requests=0, bytes=0)
+            print("{:<20} best {:>9.1f} ms   median {:>9.1f} ms   {:>7.0f} requests   {:>9.0f} kB".format(
+                name, min(times) * 1000, statistics.median(times) * 1000, results[name]["requests"],
+                results[name]["bytes"] / 1024))
+
+        def fresh():
+            return Run(server, args)
+
+        def synced():
+            run = Run(server, args)
+            run.open()
+            return run
+
+        def refreshed():
+            # The first refresh records the validators of every history
+            run = synced()
+            run.market.refresh()
+            return run
+
+        def advanced():
+            run = synced()
+            server.advance(1)
+            return run
+
+        def offline():
+            run = Run(server, args)
+            run.open()
+            run.open(offline=True)
+            return run
+
+        def close(run):
+            run.close()
+
+        record("cold_sync", measure(args.repeat, fresh, counted(lambda run: run.open()), close))
+        record("incremental_sync", measure(args.repeat, advanced, counted(lambda run: run.market.refresh()), close))
+        record("unchanged_sync", measure(args.repeat, refreshed, counted(lambda run: run.market.refresh()), close))
+
+        run = offline()
+        try:
+            ids = list(run.market.tickers["id"])
+            reads = args.repeat * 10
+            record("ticker", measure(reads, lambda: ids[0], lambda id: Ticker(source=run.market, id=id).history))
+            record("single_read", measure(reads, lambda: ids[0], lambda id: run.market.fetch_history(id=id)))
+            record("multi_read", measure(args.repeat, lambda: ids, lambda ids: run.market.fetch_histories(ids)))
+            record("stream_read", measure(args.repeat, lambda: 50000,
+                                          lambda chunksize: sum(map(len, run.market.iter_all_histories(chunksize)))))
+        finally:
+            run.close()
+    return results
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=HERE, capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def save(results, args):
+    commit = git_commit()
+    now = datetime.datetime.now()
+    report = {"version": tfinance.__version__, "commit": commit, "date": now.isoformat(timespec="seconds"),
+              "python": sys.version.split()[0], "parameters": vars(args).copy(), "results": results}
+    report["parameters"].pop("compare")
+    os.makedirs(args.output, exist_ok=True)
+    name = "{}-{}-{}.json".format(tfinance.__version__, commit or "unknown", now.strftime("%Y%m%d%H%M%S"))
+    path = os.path.join(args.output, name)
+    with open(path, "w") as f:
+        json.dump(report, f, indent=2)
+    print("Results saved to {}".format(path))
+    return report
+
+
+def compare(report, path):
+    with open(path) as f:
+        baseline = json.load(f)
+    print("\nCompared with {} ({}):".format(baseline.get("commit") or path, baseline.get("date")))
+    if baseline["parameters"] != report["parameters"]:
+        print("Warning: parameters differ, {} vs {}".format(baseline["parameters"], report["parameters"]))
+    for name, result in report["results"].items():
+        if name in baseline["results"]:
+            ratio = result["best"] / baseline["results"][name]["best"]
+            print("{:<20} {:>7.2f}x {}".format(name, ratio, "slower" if ratio > 1 else "faster"))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--tickers", type=int, default=200, help="number of rows of the tickers page")
+    parser.add_argument("--days", type=int, default=500, help="number of sessions of every history")
+    parser.add_argument("--latency", type=float, default=0.005, help="seconds every response is delayed by")
+    parser.add_argument("--rate-limit", type=float, default=None, help="server side requests per second")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of histories answered with 503")
+    parser.add_argument("--workers", type=int, default=8, help="concurrent downloads of the fetcher")
+    parser.add_argument("--store", choices=["sql", "parquet", "ipc"], default="sql")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--output", default=os.path.join(HERE, "results"), help="directory results are saved in")
+    parser.add_argument("--compare", help="earlier results file to compare with")
+    args = parser.parse_args()
+
+    report = save(run_benchmarks(args), args)
+    if args.compare:
+        compare(report, args.compare)
+
+
+if __name__ == "__main__":
+    main()
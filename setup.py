@@ -11,8 +11,10 @@ setup(
     description='Tehran Stock Exchange OSINT Tool for Python',
     long_description=README,
     long_description_content_type='text/x-rst',
-    packages=['tfinance', 'tfinance.models', 'tfinance.meta', 'tfinance.abc'],
-    install_requires=["pandas", "requests", "bs4", "sqlalchemy", "tqdm", "lxml"],
+    packages=['tfinance', 'tfinance.models', 'tfinance.meta', 'tfinance.abc', 'tfinance.stores'],
+    install_requires=["pandas", "requests", "sqlalchemy", "tqdm", "lxml"],
+    extras_require={"arrow": ["pyarrow"]},
+    entry_points={"console_scripts": ["tfinance=tfinance.cli:main"]},
     url='https://github.com/sadeg/tfinance',
     license='GPL3',
     author='Sadiq Rahmati',
@@ -0,0 +1,185 @@
+"""
+Local HTTP stand-in for tsetmc, serving the saved pages of tests/fixtures and generated Export-txt histories, with
+optional latency, throttling and errors. Used by the tests and by the benchmarks.
+
+    with FakeTsetmc(tickers=200, days=500, latency=0.01) as server:
+        scrapper = server.Scrapper(session)
+"""
+import hashlib
+import os
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+from tfinance import TSEScrapper
+
+from offline import make_history
+
+FIXTURES = os.path.join(os.path.dirname(__file__), "fixtures")
+
+
+def load_fixture(name, rows=None):
+    """
+    Returns a saved tsetmc page, with its data rows repeated up to `rows` rows if given. Repeated rows get
+    distinct inscode ids so that they are distinct tickers.
+    """
+    with open(os.path.join(FIXTURES, name), "rb") as f:
+        html = f.read().decode("utf-8")
+    if rows is None:
+        return html.encode("utf-8")
+    head, _, rest = html.partition("</tr>")
+    data_rows = re.findall(r"<tr><td>.*?</tr>", rest, flags=re.S)
+    tail = rest[rest.rindex("</tr>") + len("</tr>"):]
+    repeated = []
+    for i in range(rows):
+        row = data_rows[i % len(data_rows)]
+        copy = i // len(data_rows)
+        if copy:
+            row = re.sub(r"inscode=(\d+)", r"inscode=\g<1>{}".format(copy), row)
+        repeated.append(row)
+    return (head + "</tr>\n" + "\n".join(repeated) + tail).encode("utf-8")
+
+
+def page_tree(url):
+    return parse_qs(urlsplit(url).query)["ParTree"][0]
+
+
+class FakeTsetmcHandler(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        server = self.server.fake
+        status, body, headers = server.respond(self.path, self.headers)
+        self.send_response(status)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class FakeTsetmc:
+    """
+    :param tickers: number of rows of the tickers page, about 5% of them are -R/-D rows filtered by the scrapper
+    :param days: number of sessions of every generated history
+    :param latency: seconds every response is delayed by
+    :param rate_limit: requests per second above which the server answers 429 with Retry-After, None for no limit
+    :param error_rate: fraction of history requests answered with 503
+    :param etag: whether pages and histories carry an ETag and conditional requests are answered with 304
+    :param seed: seed of the error draws
+    """
+
+    def __init__(self, tickers=40, days=20, latency=0.0, rate_limit=None, error_rate=0.0, etag=True, seed=0):
+        # Pages by their ParTree
+        self.pages = {page_tree(TSEScrapper.URL_BAZAR_ADDI): load_fixture("bazar_addi.html", tickers),
+                      page_tree(TSEScrapper.URL_SECTORS_LIST): load_fixture("sectors_list.html")}
+        self.days = days
+        self.latency = latency
+        self.rate_limit = rate_limit
+        self.error_rate = error_rate
+        self.etag = etag
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.histories = {}
+        self.stats = {}
+        self.reset_stats()
+        self._window = []
+        self.server = None
+        self.Scrapper = None
+
+    def start(self):
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), FakeTsetmcHandler)
+        self.server.fake = self
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        base = "http://127.0.0.1:{}".format(self.server.server_port)
+        # TSEScrapper pointed at this server, usable as Market's Scrapper
+        self.Scrapper = type("FakeTsetmcScrapper", (TSEScrapper,), {
+            name: base + urlsplit(getattr(TSEScrapper, name))._replace(scheme="", netloc="").geturl()
+            for name in ("URL_BAZAR_ADDI", "URL_SECTORS_LIST", "URL_TICKER_CSV_TEMPLATE")})
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def reset_stats(self):
+        with self.lock:
+            self.stats = {"requests": 0, "bytes": 0, "200": 0, "304": 0, "429": 0, "503": 0}
+
+    def advance(self, days=1):
+        """
+        Appends sessions to every history, like a trading day passing.
+        """
+        self.days += days
+        self.histories.clear()
+
+    def history(self, ticker_id):
+        with self.lock:
+            if ticker_id not in self.histories:
+                self.histories[ticker_id] = make_history(ticker_id, self.days)
+            return self.histories[ticker_id]
+
+    def respond(self, path, request_headers):
+        """
+        Returns the (status, body, headers) of a request of path.
+        """
+        if self.latency:
+            time.sleep(self.latency)
+        status, body, headers = self.route(path, request_headers)
+        with self.lock:
+            self.stats["requests"] += 1
+            self.stats["bytes"] += len(body)
+            self.stats[str(status)] = self.stats.get(str(status), 0) + 1
+        return status, body, headers
+
+    def route(self, path, request_headers):
+        if self.throttled():
+            return 429, b"", {"Retry-After": "1"}
+        url = urlsplit(path)
+        query = parse_qs(url.query)
+        if query.get("ParTree", [None])[0] in self.pages:
+            return self.conditional(self.pages[query["ParTree"][0]], {"Content-Type": "text/html; charset=utf-8"},
+                                    request_headers)
+        if url.path.endswith("Export-txt.aspx") and "i" in query:
+            with self.lock:
+                failed = self.random.random() < self.error_rate
+            if failed:
+                return 503, b"", {}
+            ticker_id = query["i"][0]
+            body = self.history(ticker_id)
+            headers = {"Content-Type": "text/csv",
+                       "Content-Disposition": "attachment; filename={}.csv".format(ticker_id)}
+            return self.conditional(body, headers, request_headers)
+        return 404, b"", {}
+
+    def conditional(self, body, headers, request_headers):
+        """
+        Answers body with an ETag if etag is set, or 304 if the request's If-None-Match matches it.
+        """
+        if self.etag:
+            headers["ETag"] = '"{}"'.format(hashlib.sha1(body).hexdigest())
+            if request_headers.get("If-None-Match") == headers["ETag"]:
+                return 304, b"", headers
+        return 200, body, headers
+
+    def throttled(self):
+        if not self.rate_limit:
+            return False
+        with self.lock:
+            now = time.monotonic()
+            self._window = [t for t in self._window if now - t < 1.0]
+            if len(self._window) >= self.rate_limit:
+                return True
+            self._window.append(now)
+            return False
@@ -0,0 +1,138 @@
+"""
+Offline stand-ins for the tsetmc website used by the tests.
+"""
+import os
+import tempfile
+from unittest import mock
+
+import pandas as pd
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from tfinance import Market, TSEScrapper
+from tfinance.abc.base_fetcher import BaseFetcher
+from tfinance.fetcher import FetchError, FetchResult
+
+CSV_HEADER = "<TICKER>,<DTYYYYMMDD>,<FIRST>,<HIGH>,<LOW>,<CLOSE>,<VALUE>,<VOL>,<OPENINT>,<PER>,<OPEN>,<LAST>\n"
+
+TICKERS = pd.DataFrame([
+    ["1001", "فولاد مباركه اصفهان", "فولاد", "S*Mobarakeh Steel", "FOLD1",
+     "فلزات اساسي", "N1", "تابلو اصلي", "IRO1FOLD0001"],
+    ["1002", "ملي صنايع مس ايران", "فملي", "S*I. N. C. Ind.", "MSMI1",
+     "فلزات اساسي", "N1", "تابلو اصلي", "IRO1MSMI0001"],
+    ["1003", "بيمه آسيا", "آسيا", "Asia Insurance", "ASIA1", "بيمه", "N2",
+     "تابلو اصلي", "IRO1ASIA0001"],
+], columns=["id", "name", "ticker", "latin_name", "latin_ticker", "sector", "market", "sub_market", "ticker_code"])
+
+SECTORS = pd.DataFrame([["27", "فلزات اساسي"], ["66", "بيمه"]], columns=["code", "name"])
+
+
+def make_csv(rows, ticker="S*Test"):
+    """
+    Builds an Export-txt csv from (YYYYMMDD, close) or (YYYYMMDD, close, reference price) rows, the reference price
+    (<OPEN>) defaulting to the close.
+    """
+    lines = ["{},{},{c},{c},{c},{c},1000,10,1,D,{o},{c}\n".format(ticker, row[0], c=row[1], o=row[-1]) for row in rows]
+    return (CSV_HEADER + "".join(lines)).encode()
+
+
+def make_history(ticker_id, days, start="2020-09-01"):
+    """
+    Builds a deterministic, newest-first Export-txt csv of the given number of sessions.
+    """
+    dates = pd.bdate_range(start, periods=days)
+    base = int(ticker_id) % 100
+    rows = [(int(d.strftime("%Y%m%d")), base + i, base + max(i - 1, 0)) for i, d in enumerate(dates)]
+    return make_csv(rows[::-1], ticker=ticker_id)
+
+
+def history_urls(histories):
+    """
+    Maps {ticker_id: csv} to {Export-txt url: csv}.
+    """
+    return {TSEScrapper.URL_TICKER_CSV_TEMPLATE + ticker_id: csv for ticker_id, csv in histories.items()}
+
+
+class OfflineFetcher(BaseFetcher):
+    """
+    Fetcher answering from a {url: content} mapping, unknown urls fail like a 404.
+    """
+
+    def __init__(self, contents):
+        self.contents = contents
+
+    def get(self, url, headers=None):
+        if url not in self.contents:
+            raise FetchError(url, "HTTP 404", 1)
+        return mock.Mock(content=self.contents[url], headers={}, status_code=200)
+
+    def iter_fetch(self, urls, headers=None):
+        for key, url in urls.items():
+            try:
+                yield FetchResult(key, url, self.get(url), None, 1)
+            except FetchError as e:
+                yield FetchResult(key, url, None, e, 1)
+
+
+class OfflineScrapper(TSEScrapper):
+    """
+    TSEScrapper serving the module level TICKERS, SECTORS and HISTORIES instead of tsetmc. Its fetcher answers the
+    ticker and sector pages with placeholders, that get_tickers and get_sectors ignore.
+    """
+
+    HISTORIES = {ticker_id: make_history(ticker_id, 20) for ticker_id in TICKERS["id"]}
+    PAGES = {TSEScrapper.URL_BAZAR_ADDI: b"tickers", TSEScrapper.URL_SECTORS_LIST: b"sectors"}
+
+    def __init__(self, session, fetcher=None, **kwargs):
+        fetcher = fetcher if fetcher is not None else OfflineFetcher(dict(self.PAGES, **history_urls(self.HISTORIES)))
+        super().__init__(session, fetcher, **kwargs)
+
+    def get_tickers(self, content=None):
+        self.tickers = TICKERS.copy()
+
+    def get_sectors(self, content=None):
+        self.sectors = SECTORS.copy()
+
+
+class OfflineMarketMixin:
+    """
+    TestCase mixin building a fresh Market over a temporary database with OfflineScrapper.
+    """
+
+    # Extra keyword arguments of the Market
+    MARKET_OPTIONS = {}
+
+    def setUp(self) -> None:
+        self.tmp = tempfile.TemporaryDirectory()
+        self.cwd = os.getcwd()
+        os.chdir(self.tmp.name)
+        self.market = Market("sqlite:///{}/tse.db".format(self.tmp.name), Scrapper=OfflineScrapper,
+                             history_store=self.make_history_store(), **self.MARKET_OPTIONS)
+
+    def make_history_store(self):
+        return None
+
+    def tearDown(self) -> None:
+        self.market.close()
+        os.chdir(self.cwd)
+        self.tmp.cleanup()
+
+
+class OfflineScrapperMixin:
+    """
+    TestCase mixin opening self.session on a fresh temporary database for building scrappers, the temporary directory
+    being the working directory meanwhile.
+    """
+
+    def setUp(self) -> None:
+        self.tmp = tempfile.TemporaryDirectory()
+        self.cwd = os.getcwd()
+        os.chdir(self.tmp.name)
+        engine = create_engine("sqlite:///{}/tse.db".format(self.tmp.name))
+        self.session = sessionmaker(bind=engine)()
+
+    def tearDown(self) -> None:
+        self.session.close()
+        self.session.bind.dispose()
+        os.chdir(self.cwd)
+        self.tmp.cleanup()
@@ -0,0 +1,70 @@
+import unittest
+
+import pandas as pd
+
+from tfinance.adjustment import adjust_history, cumulative_factors, detect_adjustments
+from offline import OfflineFetcher, OfflineMarketMixin, history_urls, make_csv
+
+
+def make_frame(ticker_id, rows):
+    """
+    Builds a history frame from (YYYYMMDD, close, reference price) rows.
+    """
+    return pd.DataFrame({"ticker_id": ticker_id,
+                         "<DTYYYYMMDD>": pd.to_datetime([str(r[0]) for r in rows]),
+                         "<CLOSE>": [float(r[1]) for r in rows],
+                         "<OPEN>": [float(r[2]) for r in rows]})
+
+
+class TestAdjustment(unittest.TestCase):
+
+    def setUp(self) -> None:
+        # 1001 halves its price on 20201005 (capital increase), 1002 pays a 10% dividend on 20201004
+        self.df = pd.concat([
+            make_frame("1001", [(20201003, 100, 100), (20201004, 110, 100), (20201005, 60, 55), (20201006, 66, 60)]),
+            make_frame("1002", [(20201003, 50, 50), (20201004, 45, 45), (20201005, 46, 45)]),
+        ], ignore_index=True)
+
+    def test_detects_events(self):
+        events = detect_adjustments(self.df)
+        self.assertEqual(list(events["ticker_id"]), ["1001", "1002"])
+        self.assertEqual(list(events["<DTYYYYMMDD>"].dt.strftime("%Y%m%d")), ["20201005", "20201004"])
+        self.assertEqual(list(events["factor"]), [0.5, 0.9])
+
+    def test_factors_apply_to_earlier_sessions_only(self):
+        events = detect_adjustments(self.df)
+        factors = cumulative_factors(self.df.iloc[::-1], events)
+        self.assertEqual(list(factors.sort_index()), [0.5, 0.5, 1.0, 1.0, 0.9, 1.0, 1.0])
+
+    def test_compounds_events(self):
+        events = pd.DataFrame({"ticker_id": ["1001", "1001"],
+                               "<DTYYYYMMDD>": pd.to_datetime(["20201004", "20201006"]),
+                               "factor": [0.5, 0.8]})
+        adjusted = adjust_history(self.df[self.df["ticker_id"] == "1001"], events)
+        self.assertEqual(list(adjusted["<ADJ>"]), [0.4, 0.8, 0.8, 1.0])
+        self.assertEqual(list(adjusted["<CLOSE>"]), [40.0, 88.0, 48.0, 66.0])
+
+    def test_no_events(self):
+        events = detect_adjustments(self.df.iloc[:0])
+        self.assertTrue(adjust_history(self.df, events)["<ADJ>"].eq(1.0).all())
+
+
+class TestMarketAdjustment(OfflineMarketMixin, unittest.TestCase):
+
+    def sync(self, content):
+        self.market.scrapper.fetcher = OfflineFetcher(history_urls({"1001": content}))
+        self.market.scrapper.sync_history()
+
+    def test_incremental_sync_stores_new_events(self):
+        # The offline history of 1001 closes at 20 on 20200928, without events
+        self.assertTrue(self.market.fetch_adjustments().empty)
+        self.sync(make_csv([(20201104, 11, 10), (20201103, 20, 20), (20200928, 20, 19)]))
+        events = self.market.fetch_adjustments(["فولاد"])
+        self.assertEqual(list(events["<DTYYYYMMDD>"].dt.strftime("%Y%m%d")), ["20201104"])
+        self.assertEqual(list(events["factor"]), [0.5])
+
+        history = self.market.fetch_histories(["فولاد"], adjusted=True)
+        self.assertEqual(list(history["<CLOSE>"].iloc[-3:]), [10.0, 10.0, 11.0])
+        adjusted = self.market.fetch_adjusted_history(ticker="فولاد")
+        self.assertEqual(list(adjusted["<ADJ>"].iloc[:2]), [1.0, 0.5])
+        self.assertEqual(self.market.fetch_history(ticker="فولاد")["<CLOSE>"].iloc[1], 20)
@@ -0,0 +1,156 @@
+import io
+import unittest
+from unittest import mock
+
+import pandas as pd
+
+from tfinance.aggregates import resample_bars, rolling_indicators, sector_aggregates
+from offline import OfflineFetcher, OfflineMarketMixin, history_urls, make_csv, make_history
+
+
+def make_frame(ticker_id, days):
+    df = pd.read_csv(io.BytesIO(make_history(ticker_id, days)))
+    df["<DTYYYYMMDD>"] = pd.to_datetime(df["<DTYYYYMMDD>"], format="%Y%m%d")
+    return df.assign(ticker_id=ticker_id)
+
+
+class TestAggregates(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.df = pd.concat([make_frame("1001", 30), make_frame("1002", 30)], ignore_index=True)
+
+    def test_weekly_bars(self):
+        bars = resample_bars(self.df, "W")
+        foolad = bars.loc[bars["ticker_id"] == "1001"].set_index("<DTYYYYMMDD>")
+        # Tuesday 2020-09-01 and Wednesday 2020-09-02 make the first week, Thursday 2020-09-03 starts the next one
+        self.assertEqual(list(foolad["<SESSIONS>"].iloc[:2]), [2, 5])
+        week = foolad.loc["2020-09-09"]
+        self.assertEqual((week["<FIRST>"], week["<HIGH>"], week["<LOW>"], week["<CLOSE>"]), (3, 7, 3, 7))
+        self.assertEqual(week["<VOL>"], 50)
+
+    def test_monthly_bars(self):
+        bars = resample_bars(self.df, "M")
+        self.assertEqual(len(bars), 4)
+        self.assertEqual(list(bars["<SESSIONS>"]), [22, 8, 22, 8])
+        self.assertEqual(list(bars["<DTYYYYMMDD>"].dt.strftime("%Y%m%d").unique()), ["20200930", "20201031"])
+
+    def test_rolling_indicators(self):
+        indicators = rolling_indicators(self.df.iloc[::-1]).set_index(["ticker_id", "<DTYYYYMMDD>"])
+        row = indicators.loc[("1001", pd.Timestamp("2020-09-07"))]
+        self.assertAlmostEqual(row["<RETURN>"], 5 / 4 - 1)
+        self.assertEqual(row["<SMA5>"], 3)
+        self.assertTrue(pd.isna(row["<SMA20>"]))
+        # Windows don't span tickers
+        self.assertTrue(pd.isna(indicators.loc[("1002", pd.Timestamp("2020-09-03")), "<SMA5>"]))
+
+    def test_sector_aggregates(self):
+        df = pd.DataFrame({"ticker_id": ["1001", "1002", "1003", "1001", "1004"],
+                           "<DTYYYYMMDD>": pd.to_datetime(["20201003", "20201003", "20201003", "20201004",
+                                                           "20201004"]),
+                           "<CLOSE>": [110.0, 45.0, 30.0, 100.0, 10.0], "<OPEN>": [100.0, 50.0, 30.0, 110.0, 9.0],
+                           "<VALUE>": [3000, 1000, 500, 2000, 100], "<VOL>": [30, 20, 10, 20, 10]})
+        sectors = pd.Series({"1001": "metals", "1002": "metals", "1003": "insurance"})
+        aggregates = sector_aggregates(df, sectors).set_index(["<DTYYYYMMDD>", "sector"])
+        # 1004 has no sector, insurance didn't trade on 20201004
+        self.assertEqual(len(aggregates), 3)
+        metals = aggregates.loc[(pd.Timestamp("2020-10-03"), "metals")]
+        self.assertEqual((metals["<VALUE>"], metals["<VOL>"], metals["<TICKERS>"]), (4000, 50, 2))
+        self.assertEqual((metals["<ADVANCES>"], metals["<DECLINES>"], metals["<UNCHANGED>"]), (1, 1, 0))
+        self.assertAlmostEqual(metals["<RETURN_EW>"], (0.1 - 0.1) / 2)
+        self.assertAlmostEqual(metals["<RETURN_VW>"], (0.1 * 3000 - 0.1 * 1000) / 4000)
+        self.assertEqual(aggregates.loc[(pd.Timestamp("2020-10-03"), "insurance"), "<UNCHANGED>"], 1)
+        self.assertAlmostEqual(aggregates.loc[(pd.Timestamp("2020-10-04"), "metals"), "<RETURN_EW>"], 100 / 110 - 1)
+
+
+class TestMarketAggregates(OfflineMarketMixin, unittest.TestCase):
+
+    MARKET_OPTIONS = {"materialize": True}
+
+    def test_materialized_on_update(self):
+        bars = self.market.fetch_bars(["فولاد", "آسيا"], period="M")
+        self.assertEqual(bars.index.get_level_values("ticker_id").unique().tolist(), ["1001", "1003"])
+        self.assertEqual(bars.loc[("2020-09-30", "1001"), "<CLOSE>"], 20)
+        indicators = self.market.fetch_indicators(["فولاد"], start="2020-09-28", columns=["<SMA5>"])
+        self.assertEqual(list(indicators.columns), ["<SMA5>"])
+        self.assertEqual(indicators["<SMA5>"].tolist(), [18])
+
+    def test_incremental_tail_matches_rebuild(self):
+        scrapper = self.market.scrapper
+        # 1001 gets a session of 30/09 (same week and month as stored ones) and one in a new month
+        scrapper.fetcher = OfflineFetcher(history_urls({"1001": make_csv([(20201001, 22, 21), (20200929, 21, 20)])}))
+        with mock.patch.object(scrapper.store, "read", wraps=scrapper.store.read) as read:
+            scrapper.sync_history()
+        self.assertIsNotNone(read.call_args_list[0].kwargs["start"])
+        incremental = (self.market.fetch_bars(["فولاد"], "W"), self.market.fetch_bars(["فولاد"], "M"),
+                       self.market.fetch_indicators(["فولاد"]))
+        self.assertEqual(incremental[1]["<CLOSE>"].tolist(), [21, 22])
+        scrapper.rebuild_aggregates()
+        rebuilt = (self.market.fetch_bars(["فولاد"], "W"), self.market.fetch_bars(["فولاد"], "M"),
+                   self.market.fetch_indicators(["فولاد"]))
+        for a, b in zip(incremental, rebuilt):
+            pd.testing.assert_frame_equal(a, b)
+
+    def test_tails_are_read_per_ticker(self):
+        scrapper = self.market.scrapper
+        scrapper.fetcher = OfflineFetcher(history_urls({"1001": make_history("1001", 200)}))
+        scrapper.sync_history()
+        last_date = self.market.fetch_history(ticker="فولاد")["<DTYYYYMMDD>"].max()
+        rows = {}
+
+        def read(*args, **kwargs):
+            history = store_read(*args, **kwargs)
+            for ticker_id, count in history["ticker_id"].value_counts().items():
+                rows[ticker_id] = rows.get(ticker_id, 0) + count
+            return history
+
+        # A batch rewriting the last session of 1001 along the whole history of 1003, as for a new ticker
+        store_read = scrapper.store.read
+        first_dates = pd.Series({"1001": last_date, "1003": pd.Timestamp("2020-09-01")})
+        with mock.patch.object(scrapper.store, "read", side_effect=read):
+            scrapper.materialize_aggregates(first_dates)
+        self.assertEqual(rows["1003"], 20)
+        # About 2 * INDICATOR_LOOKBACK days back from the last session, not the 200 stored ones
+        self.assertLess(rows["1001"], 100)
+
+    def test_sector_aggregates(self):
+        aggregates = self.market.fetch_sector_aggregates(start="2020-09-28")
+        self.assertEqual(aggregates.index.get_level_values("sector").unique().tolist(), ["بيمه", "فلزات اساسي"])
+        metals = aggregates.loc[("2020-09-28", "فلزات اساسي")]
+        self.assertEqual((metals["<TICKERS>"], metals["<ADVANCES>"], metals["<VALUE>"]), (2, 2, 2000))
+        self.assertAlmostEqual(metals["<RETURN_EW>"], (20 / 19 + 21 / 20) / 2 - 1)
+        returns = self.market.fetch_sector_aggregates(["بيمه"], columns=["<RETURN_VW>"])
+        self.assertEqual(list(returns.columns), ["<RETURN_VW>"])
+        self.assertEqual(len(returns), 20)
+
+    def test_sector_aggregates_follow_syncs(self):
+        scrapper = self.market.scrapper
+        self.market.fetch_sector_aggregates()
+        # Only 1002 trades on 20200929
+        scrapper.fetcher = OfflineFetcher(history_urls({"1002": make_csv([(20200929, 20, 21)])}))
+        with mock.patch.object(scrapper.store, "read", wraps=scrapper.store.read) as read:
+            scrapper.sync_history()
+        self.assertEqual(read.call_args_list[-1].kwargs["start"], pd.Timestamp("2020-09-29"))
+        incremental = self.market.fetch_sector_aggregates()
+        metals = incremental.loc[("2020-09-29", "فلزات اساسي")]
+        self.assertEqual((metals["<TICKERS>"], metals["<DECLINES>"]), (1, 1))
+        scrapper.rebuild_aggregates()
+        pd.testing.assert_frame_equal(incremental, self.market.fetch_sector_aggregates())
+
+    def test_rebuild_streams_the_store(self):
+        scrapper = self.market.scrapper
+        expected = (self.market.fetch_bars(["فولاد", "فملي", "آسيا"], "W"),
+                    self.market.fetch_indicators(["فولاد", "فملي", "آسيا"]), self.market.fetch_sector_aggregates())
+        # Chunks of a single ticker, the sector sums of 1001 and 1002 are accumulated
+        scrapper.batch_size = 20
+        with mock.patch.object(scrapper.store, "read", side_effect=AssertionError("whole store read")), \
+                mock.patch.object(scrapper.store, "iter_read", wraps=scrapper.store.iter_read) as iter_read:
+            scrapper.rebuild_aggregates()
+        self.assertEqual(iter_read.call_args.kwargs["chunksize"], 20)
+        rebuilt = (self.market.fetch_bars(["فولاد", "فملي", "آسيا"], "W"),
+                   self.market.fetch_indicators(["فولاد", "فملي", "آسيا"]), self.market.fetch_sector_aggregates())
+        for a, b in zip(expected, rebuilt):
+            pd.testing.assert_frame_equal(a, b)
+
+    def test_unknown_period(self):
+        with self.assertRaises(ValueError):
+            self.market.fetch_bars(["فولاد"], period="Q")
@@ -0,0 +1,43 @@
+import unittest
+
+import pandas as pd
+
+from tfinance.cache import LRUCache
+
+
+class TestLRUCache(unittest.TestCase):
+
+    def test_evicts_least_recently_used(self):
+        cache = LRUCache(maxsize=2)
+        cache.put("a", 1)
+        cache.put("b", 2)
+        cache.get("a")
+        cache.put("c", 3)
+        self.assertIn("a", cache)
+        self.assertNotIn("b", cache)
+        self.assertEqual(cache.stats.evictions, 1)
+
+    def test_bounded_by_bytes(self):
+        df = pd.DataFrame({"x": range(1000)})
+        nbytes = int(df.memory_usage(deep=True).sum())
+        cache = LRUCache(maxsize=10, maxbytes=int(nbytes * 2.5))
+        for key in "abc":
+            cache.put(key, df)
+        self.assertEqual(len(cache), 2)
+        self.assertLessEqual(cache.stats.bytes, cache.maxbytes)
+        cache.put("huge", pd.concat([df] * 3))
+        self.assertNotIn("huge", cache)
+
+    def test_stats_and_invalidation(self):
+        cache = LRUCache()
+        cache.put(("history", ("1",)), 1)
+        cache.put(("history", ("2",)), 2)
+        self.assertEqual(cache.get(("history", ("1",))), 1)
+        self.assertIsNone(cache.get("missing"))
+        cache.invalidate(lambda key: "1" in key[1])
+        stats = cache.stats
+        self.assertEqual((stats.hits, stats.misses, stats.invalidations, stats.size), (1, 1, 1, 1))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,63 @@
+import signal
+import threading
+import unittest
+from unittest import mock
+
+import pandas as pd
+
+import tfinance as tfin
+from tfinance import cli
+from tfinance.client import MarketClient
+from tfinance.server import MarketServer
+from offline import OfflineFetcher, OfflineMarketMixin, OfflineScrapper, history_urls, make_history
+
+
+class TestCli(OfflineMarketMixin, unittest.TestCase):
+
+    def setUp(self) -> None:
+        super().setUp()
+        # Markets are kept one per url, so the commands get self.market and its OfflineScrapper
+        self.url = "sqlite:///{}/tse.db".format(self.tmp.name)
+        self.sigterm = signal.getsignal(signal.SIGTERM)
+
+    def tearDown(self) -> None:
+        signal.signal(signal.SIGTERM, self.sigterm)
+        super().tearDown()
+
+    def test_refresh(self):
+        histories = {ticker_id: make_history(ticker_id, 25) for ticker_id in OfflineScrapper.HISTORIES}
+        self.market.scrapper.fetcher = OfflineFetcher(dict(OfflineScrapper.PAGES, **history_urls(histories)))
+        self.assertEqual(cli.main(["--log-level", "WARNING", "refresh", "--db", self.url]), 0)
+        self.assertNotIn(self.url, tfin.Market.instances())
+        market = tfin.Market(self.url, Scrapper=OfflineScrapper, offline=True)
+        try:
+            self.assertEqual(len(market.fetch_history(ticker="فولاد")), 25)
+            self.assertEqual(set(market.snapshot()["<DTYYYYMMDD>"]), {pd.Timestamp("2020-10-05")})
+        finally:
+            market.close()
+
+    def test_serve(self):
+        expected = self.market.fetch_histories(["فولاد"], columns=["<CLOSE>"])
+        responses = []
+        serve_forever = MarketServer.serve_forever
+
+        def serve_once(server, *args, **kwargs):
+            def request():
+                client = MarketClient(server.url, format="csv")
+                try:
+                    responses.append(client.fetch_histories(["فولاد"], columns=["<CLOSE>"]))
+                finally:
+                    client.close()
+                    server.shutdown()
+            threading.Thread(target=request, daemon=True).start()
+            serve_forever(server, *args, **kwargs)
+
+        with mock.patch.object(MarketServer, "serve_forever", serve_once):
+            self.assertEqual(cli.main(["--log-level", "WARNING", "serve", "--db", self.url, "--port", "0"]), 0)
+        self.assertEqual(len(responses), 1)
+        pd.testing.assert_frame_equal(responses[0], expected, check_dtype=False)
+        self.assertNotIn(self.url, tfin.Market.instances())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,50 @@
+import unittest
+
+import numpy as np
+import pandas as pd
+
+from tfinance.dtypes import compact_history
+
+
+def make_history(rows=5000, tickers=10):
+    rng = np.random.default_rng(0)
+    prices = rng.integers(1000, 100000, rows).astype("float64")
+    return pd.DataFrame({"ticker_id": np.repeat([str(10 ** 16 + i) for i in range(tickers)], rows // tickers),
+                         "<TICKER>": np.repeat(["S*Ticker.{}".format(i) for i in range(tickers)], rows // tickers),
+                         "<DTYYYYMMDD>": pd.Timestamp("2010-01-01") + pd.to_timedelta(np.arange(rows), "D"),
+                         "<FIRST>": prices, "<HIGH>": prices, "<LOW>": prices, "<CLOSE>": prices,
+                         "<VALUE>": rng.integers(0, 10 ** 12, rows), "<VOL>": rng.integers(0, 10 ** 7, rows),
+                         "<OPENINT>": 1, "<PER>": "D", "<OPEN>": prices, "<LAST>": prices})
+
+
+class TestCompactHistory(unittest.TestCase):
+
+    def test_shrinks_memory(self):
+        df = make_history()
+        compact = compact_history(df)
+        self.assertLess(compact.memory_usage(deep=True).sum(), df.memory_usage(deep=True).sum() / 2)
+        self.assertNotIn("<PER>", compact.columns)
+        self.assertEqual(compact["<CLOSE>"].dtype, np.float32)
+        self.assertEqual(compact["<VOL>"].dtype, np.int64)
+        self.assertIsInstance(compact["<TICKER>"].dtype, pd.CategoricalDtype)
+        np.testing.assert_array_equal(compact["<CLOSE>"].to_numpy(), df["<CLOSE>"].to_numpy())
+
+    def test_integer_prices_and_missing_values(self):
+        df = make_history(rows=10, tickers=1)
+        df.loc[0, "<LAST>"] = np.nan
+        df.loc[1, "<VOL>"] = np.nan
+        df.loc[2, "<PER>"] = "W"
+        compact = compact_history(df, price_dtype="int32")
+        self.assertEqual(compact["<CLOSE>"].dtype, np.int32)
+        self.assertEqual(compact["<LAST>"].dtype, np.float32)
+        self.assertEqual(str(compact["<VOL>"].dtype), "Int64")
+        self.assertIn("<PER>", compact.columns)
+
+    def test_parses_dates_once(self):
+        df = make_history(rows=10, tickers=1)
+        df["<DTYYYYMMDD>"] = df["<DTYYYYMMDD>"].dt.strftime("%Y-%m-%d")
+        self.assertTrue(pd.api.types.is_datetime64_any_dtype(compact_history(df)["<DTYYYYMMDD>"]))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,88 @@
+import threading
+import time
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from tfinance.fetcher import Fetcher, FetchError, RateLimiter
+
+
+class FlakyHandler(BaseHTTPRequestHandler):
+    """
+    /ok answers 200, /flaky answers 503 twice before succeeding and /broken always answers 500.
+    """
+
+    hits = {}
+    lock = threading.Lock()
+
+    def do_GET(self):
+        with self.lock:
+            self.hits[self.path] = self.hits.get(self.path, 0) + 1
+            hits = self.hits[self.path]
+        if self.path == "/broken" or (self.path == "/flaky" and hits <= 2):
+            self.send_response(500 if self.path == "/broken" else 503)
+            self.end_headers()
+            return
+        if self.path == "/missing":
+            self.send_response(404)
+            self.end_headers()
+            return
+        body = self.path.encode()
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class TestFetcher(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls) -> None:
+        cls.server = ThreadingHTTPServer(("127.0.0.1", 0), FlakyHandler)
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+        cls.base = "http://127.0.0.1:{}".format(cls.server.server_port)
+
+    @classmethod
+    def tearDownClass(cls) -> None:
+        cls.server.shutdown()
+        cls.server.server_close()
+
+    def setUp(self) -> None:
+        FlakyHandler.hits.clear()
+        self.fetcher = Fetcher(max_workers=4, rate_limit=None, retries=3, backoff_factor=0.01)
+
+    def test_retries_server_errors(self):
+        response = self.fetcher.get(self.base + "/flaky")
+        self.assertEqual(response.content, b"/flaky")
+        self.assertEqual(FlakyHandler.hits["/flaky"], 3)
+
+    def test_gives_up_after_retries(self):
+        with self.assertRaises(FetchError) as cm:
+            self.fetcher.get(self.base + "/broken")
+        self.assertEqual(cm.exception.attempts, 4)
+
+    def test_client_errors_are_not_retried(self):
+        with self.assertRaises(FetchError):
+            self.fetcher.get(self.base + "/missing")
+        self.assertEqual(FlakyHandler.hits["/missing"], 1)
+
+    def test_iter_fetch_reports_partial_failures(self):
+        urls = {i: "{}/ok{}".format(self.base, i) for i in range(10)}
+        urls["broken"] = self.base + "/broken"
+        results = {r.key: r for r in self.fetcher.iter_fetch(urls)}
+        self.assertEqual(set(results), set(urls))
+        self.assertIsInstance(results["broken"].error, FetchError)
+        self.assertEqual(results[3].response.content, b"/ok3")
+
+    def test_rate_limiter_spaces_requests(self):
+        limiter = RateLimiter(rate=50)
+        start = time.monotonic()
+        for _ in range(6):
+            limiter.wait("host")
+        self.assertGreaterEqual(time.monotonic() - start, 0.09)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,8 +1,25 @@
+import io
+import subprocess
+import sys
+import tempfile
+import threading
+import glob
 import unittest
-from unittest import TestCase
+from unittest import TestCase, mock
 
 import tfinance as tfin
 import pandas as pd
+from sqlalchemy import create_engine
+
+from tfinance.abc.base_scrapper import BaseScrapper
+from tfinance.models import legacy_history_tables
+from tfinance.stores import ArrowHistoryStore
+from offline import OfflineFetcher, OfflineMarketMixin, OfflineScrapper, SECTORS, TICKERS, history_urls, make_history
+
+try:
+    import pyarrow
+except ImportError:
+    pyarrow = None
 
 
 class TestMarket(unittest.TestCase):
@@ -26,5 +43,364 @@ class TestMarket(unittest.TestCase):
         self.assertIsInstance(history, pd.DataFrame)
 
 
+class TestMarketOffline(OfflineMarketMixin, unittest.TestCase):
+
+    def test_fetch_histories(self):
+        histories = self.market.fetch_histories(["1001", "فملي"], start="2020-09-10", end="2020-09-20",
+                                                 columns=["<CLOSE>", "<VOL>"])
+        self.assertEqual(list(histories.columns), ["<CLOSE>", "<VOL>"])
+        self.assertEqual(histories.index.names, ["<DTYYYYMMDD>", "ticker_id"])
+        self.assertEqual(set(histories.index.get_level_values("ticker_id")), {"1001", "1002"})
+        dates = histories.index.get_level_values("<DTYYYYMMDD>")
+        self.assertEqual((dates.min(), dates.max()), (pd.Timestamp("2020-09-10"), pd.Timestamp("2020-09-18")))
+
+    def test_snapshot_latest(self):
+        snapshot = self.market.snapshot(columns=["<CLOSE>"])
+        self.assertEqual(list(snapshot.index), ["1001", "1002", "1003"])
+        self.assertEqual(list(snapshot.columns), ["<DTYYYYMMDD>", "<CLOSE>"])
+        self.assertEqual(list(snapshot["<CLOSE>"]), [20, 21, 22])
+        self.assertTrue((snapshot["<DTYYYYMMDD>"] == pd.Timestamp("2020-09-28")).all())
+        sectors = snapshot.join(self.market.tickers.set_index("id"))["sector"]
+        self.assertEqual(sectors["1003"], "بيمه")
+
+    def test_snapshot_on_date(self):
+        snapshot = self.market.snapshot("2020-09-10", columns=["<CLOSE>", "<VOL>"])
+        self.assertEqual(list(snapshot["<CLOSE>"]), [8, 9, 10])
+        self.assertEqual(len(self.market.snapshot("2020-09-12")), 0)
+
+    def test_snapshot_follows_writes(self):
+        self.market.snapshot()
+        self.market.scrapper.fetcher = OfflineFetcher(history_urls({"1002": make_history("1002", 21)}))
+        self.market.scrapper.sync_history()
+        snapshot = self.market.snapshot()
+        self.assertEqual(snapshot.loc["1002", "<DTYYYYMMDD>"], pd.Timestamp("2020-09-29"))
+        self.assertEqual(snapshot.loc["1001", "<DTYYYYMMDD>"], pd.Timestamp("2020-09-28"))
+        # Rewriting older sessions leaves the latest bar alone
+        older = self.market.fetch_history(id="1002").iloc[5:]
+        self.market.scrapper.upsert_ticker_history("1002", older)
+        self.assertEqual(self.market.snapshot().loc["1002", "<CLOSE>"], 22)
+
+    def test_fetch_histories_wide(self):
+        closes = self.market.fetch_histories(["1001", "1003"], columns=["<CLOSE>"], wide=True)["<CLOSE>"]
+        self.assertEqual(list(closes.columns), ["1001", "1003"])
+        self.assertEqual(len(closes), 20)
+        history = self.market.fetch_history(id="1003")
+        self.assertEqual(closes["1003"].iloc[-1], history["<CLOSE>"].iloc[0])
+
+    def test_offline_market_is_lazy(self):
+        tfin.Market.forget(self.market)
+        market = tfin.Market(str(self.market.engine.url), Scrapper=NoNetworkScrapper, offline=True,
+                             history_store=self.market.history_store)
+        self.assertIsNone(market._Market__tickers)
+        self.assertEqual(len(market.tickers), 3)
+        self.assertEqual(len(market.sectors), 2)
+        self.assertEqual(len(market.fetch_history(ticker="فولاد")), 20)
+        market.close()
+
+    def test_cache_hits_and_invalidation(self):
+        first = self.market.fetch_history(ticker="فولاد")
+        first["<CLOSE>"] = 0
+        second = self.market.fetch_history(ticker="فولاد")
+        self.assertNotEqual(second["<CLOSE>"].iloc[0], 0)
+        self.assertEqual(self.market.cache_stats.hits, 1)
+        self.market.fetch_histories(["1001", "1003"], columns=["<CLOSE>"])
+        self.market.scrapper.fetcher = OfflineFetcher(history_urls({"1001": make_history("1001", 21)}))
+        self.market.scrapper.update_history(incremental=True)
+        self.assertEqual(self.market.cache_stats.size, 0)
+        self.assertEqual(len(self.market.fetch_history(ticker="فولاد")), 21)
+
+    def test_iter_history(self):
+        chunks = list(self.market.iter_history(["فولاد", "1003"], chunksize=15, columns=["<CLOSE>"]))
+        self.assertEqual([len(chunk) for chunk in chunks], [15, 15, 10])
+        streamed = pd.concat(chunks).set_index(["<DTYYYYMMDD>", "ticker_id"]).sort_index()
+        fetched = self.market.fetch_histories(["1001", "1003"], columns=["<CLOSE>"])
+        pd.testing.assert_frame_equal(streamed, fetched, check_dtype=False)
+        everything = pd.concat(self.market.iter_all_histories(chunksize=7, adjusted=True))
+        self.assertEqual(len(everything), 60)
+        self.assertTrue(everything["<ADJ>"].eq(1.0).all())
+        with self.assertRaises(ValueError):
+            self.market.iter_history(["1001"], columns=["<NOPE>"])
+
+    def test_compact_histories(self):
+        self.market.compact = True
+        history = self.market.fetch_history(ticker="فولاد")
+        self.assertNotIn("<PER>", history.columns)
+        self.assertEqual(str(history["<CLOSE>"].dtype), "float32")
+        histories = self.market.fetch_histories(["1001", "1002"], columns=["<CLOSE>", "<VOL>"])
+        self.assertEqual([str(t) for t in histories.dtypes], ["float32", "int64"])
+
+    def test_materialize_backfills_stored_histories(self):
+        self.market.scrapper.materialize = True
+        self.market.scrapper.fetcher = OfflineFetcher(history_urls({"1001": make_history("1001", 21)}))
+        self.market.refresh()
+        self.assertEqual(len(self.market.fetch_indicators(["1001", "1002"])), 41)
+        self.assertEqual(len(self.market.fetch_bars(["1001"], "W")), 5)
+        # Only the steel sector traded on the 21st session
+        self.assertEqual(len(self.market.fetch_sector_aggregates()), 20 * 2 + 1)
+
+    def test_fetch_histories_unknown(self):
+        with self.assertRaises(KeyError):
+            self.market.fetch_histories(["nope"])
+        with self.assertRaises(ValueError):
+            self.market.fetch_histories(["1001"], columns=["<NOPE>"])
+
+
+class NoNetworkScrapper:
+    def __init__(self, *args, **kwargs):
+        raise AssertionError("An offline Market must not create its scrapper")
+
+
+class MinimalScrapper(BaseScrapper):
+    """
+    Scrapper implementing nothing but the BaseScrapper interface.
+    """
+
+    updates = []
+
+    def update(self, incremental=False, streaming=False, atomic=False):
+        self.updates.append((incremental, atomic))
+
+    def update_tickers(self):
+        pass
+
+    def update_history(self):
+        pass
+
+    def update_sectors(self):
+        pass
+
+
+class TestLegacyDatabase(unittest.TestCase):
+    """
+    Databases written before the ticker_history table, with a history table per ticker.
+    """
+
+    def setUp(self) -> None:
+        self.tmp = tempfile.TemporaryDirectory()
+        self.url = "sqlite:///{}/tse.db".format(self.tmp.name)
+        engine = create_engine(self.url)
+        TICKERS.to_sql(name="tickers", con=engine, index=False)
+        SECTORS.to_sql(name="sectors", con=engine, index=False)
+        for ticker_id in TICKERS["id"]:
+            history = pd.read_csv(io.BytesIO(make_history(ticker_id, 20)))
+            history["<DTYYYYMMDD>"] = pd.to_datetime(history["<DTYYYYMMDD>"], format="%Y%m%d")
+            history.to_sql(name=ticker_id, con=engine, index=False)
+        engine.dispose()
+
+    def tearDown(self) -> None:
+        self.tmp.cleanup()
+
+    def test_offline_market_migrates_legacy_tables(self):
+        market = tfin.Market(self.url, Scrapper=OfflineScrapper, offline=True)
+        try:
+            self.assertEqual(len(market.fetch_history(ticker="فولاد")), 20)
+            self.assertEqual(len(market.snapshot()), 3)
+            self.assertEqual(legacy_history_tables(market.engine), [])
+        finally:
+            market.close()
+
+    def test_legacy_tables_without_migration_raise(self):
+        with self.assertRaises(RuntimeError):
+            tfin.Market(self.url, Scrapper=MinimalScrapper, offline=True)
+
+
+class TestMarketInstances(OfflineMarketMixin, unittest.TestCase):
+
+    MARKET_OPTIONS = {"cache_size": 0}
+
+    def test_one_instance_per_connection_string(self):
+        url = str(self.market.engine.url)
+        self.assertIs(tfin.Market(url), self.market)
+        self.assertIs(tfin.Market(connection_arguments=url, offline=True), self.market)
+        other = tfin.Market("sqlite://", Scrapper=NoNetworkScrapper, offline=True)
+        try:
+            self.assertIsNot(other, self.market)
+            self.assertEqual(set(tfin.Market.instances()), {url, "sqlite://"})
+        finally:
+            other.close()
+        self.assertNotIn("sqlite://", tfin.Market.instances())
+
+    def test_custom_scrapper(self):
+        market = tfin.Market("sqlite://", Scrapper=MinimalScrapper, offline=True)
+        try:
+            market.refresh()
+            self.assertEqual(MinimalScrapper.updates, [(True, True)])
+            self.assertFalse(market.scrapper.materialize)
+        finally:
+            market.close()
+
+    def test_concurrent_reads_during_sync(self):
+        errors = []
+        done = threading.Event()
+
+        def read():
+            try:
+                while not done.is_set():
+                    self.market.fetch_histories(["1001", "1002", "1003"], columns=["<CLOSE>"])
+                    tfin.Ticker(source=self.market, ticker="آسيا").history
+            except Exception as e:
+                errors.append(e)
+
+        readers = [threading.Thread(target=read) for _ in range(4)]
+        for reader in readers:
+            reader.start()
+        try:
+            histories = {ticker_id: make_history(ticker_id, 40) for ticker_id in ("1001", "1002", "1003")}
+            self.market.scrapper.fetcher = OfflineFetcher(history_urls(histories))
+            self.market.refresh()
+        finally:
+            done.set()
+            for reader in readers:
+                reader.join()
+        self.assertEqual(errors, [])
+        self.assertEqual(len(self.market.fetch_history(ticker="آسيا")), 40)
+        self.assertEqual(self.market.engine.pool.checkedout(), 0)
+
+
+class TestMarketRefresh(OfflineMarketMixin, unittest.TestCase):
+
+    MARKET_OPTIONS = {"materialize": True, "cache_size": 0}
+
+    def setUp(self) -> None:
+        super().setUp()
+        histories = {ticker_id: make_history(ticker_id, 25) for ticker_id in ("1001", "1002", "1003")}
+        self.market.scrapper.fetcher = OfflineFetcher(history_urls(histories))
+        # One batch per ticker
+        self.market.scrapper.batch_size = 1
+
+    def read_in_thread(self):
+        """
+        Returns what a reader thread sees: history lengths, latest dates and sector aggregate dates.
+        """
+        seen = {}
+
+        def read():
+            histories = self.market.fetch_histories(["1001", "1002", "1003"], columns=["<CLOSE>"])
+            seen["lengths"] = histories.groupby("ticker_id").size().tolist()
+            seen["latest"] = sorted(set(self.market.snapshot()["<DTYYYYMMDD>"]))
+            seen["sector_dates"] = len(self.market.fetch_sector_aggregates().index.levels[0])
+
+        reader = threading.Thread(target=read)
+        reader.start()
+        reader.join()
+        return seen
+
+    def test_readers_see_previous_generation_during_refresh(self):
+        before = self.read_in_thread()
+        self.assertEqual(before["lengths"], [20, 20, 20])
+        seen = []
+        write_history_batch = self.market.scrapper.write_history_batch
+
+        def write_and_read(*args, **kwargs):
+            write_history_batch(*args, **kwargs)
+            seen.append(self.read_in_thread())
+
+        generation = self.market.generation
+        with mock.patch.object(self.market.scrapper, "write_history_batch", write_and_read):
+            self.market.refresh()
+        self.assertGreaterEqual(len(seen), 3)
+        for during in seen:
+            self.assertEqual(during, before)
+        after = self.read_in_thread()
+        self.assertEqual(after["lengths"], [25, 25, 25])
+        self.assertEqual(after["latest"], [pd.Timestamp("2020-10-05")])
+        self.assertEqual(after["sector_dates"], 25)
+        self.assertGreater(self.market.generation, generation)
+        self.assertIsNotNone(self.market.last_refresh)
+
+    def test_failed_refresh_publishes_nothing(self):
+        before = self.read_in_thread()
+        scrapper = self.market.scrapper
+        with mock.patch.object(scrapper, "materialize_sector_aggregates", side_effect=RuntimeError("boom")):
+            with self.assertRaises(RuntimeError):
+                self.market.refresh()
+        self.assertEqual(self.read_in_thread(), before)
+        self.assertEqual(glob.glob(self.tmp.name + "/**/*.tmp", recursive=True), [])
+        self.market.refresh()
+        self.assertEqual(self.read_in_thread()["lengths"], [25, 25, 25])
+
+    def test_readers_in_other_processes_see_refreshes(self):
+        # A Market of the same database under another url stands for one of another process
+        url = "sqlite:///{}/./tse.db".format(self.tmp.name)
+        reader = tfin.Market(url, Scrapper=NoNetworkScrapper, history_store=self.make_history_store(), offline=True,
+                             check_interval=0)
+        stale = tfin.Market(url.replace("/./", "/././"), Scrapper=NoNetworkScrapper,
+                            history_store=self.make_history_store(), offline=True, check_interval=3600)
+        try:
+            for market in (reader, stale):
+                self.assertEqual(len(market.fetch_history(ticker="فولاد")), 20)
+                self.assertEqual(len(market.snapshot()), 3)
+            self.market.refresh()
+            self.assertEqual(len(reader.fetch_history(ticker="فولاد")), 25)
+            self.assertEqual(set(reader.snapshot()["<DTYYYYMMDD>"]), {pd.Timestamp("2020-10-05")})
+            self.assertEqual(len(reader.fetch_histories(["1001"])), 25)
+            # Until its next check, a Market serves the frames it cached
+            self.assertEqual(len(stale.fetch_history(ticker="فولاد")), 20)
+            stale._generation_checked -= 3600
+            self.assertEqual(len(stale.fetch_history(ticker="فولاد")), 25)
+        finally:
+            reader.close()
+            stale.close()
+
+    def test_own_writes_keep_the_published_generation(self):
+        self.market.refresh()
+        self.assertEqual(self.market.published_generation, self.market.fetch_generation())
+        self.market.scrapper.fetcher = OfflineFetcher(history_urls({"1001": make_history("1001", 26)}))
+        self.market.scrapper.sync_history()
+        self.assertEqual(self.market.published_generation, self.market.fetch_generation())
+
+    def test_auto_refresh(self):
+        refreshed = threading.Event()
+        self.market.scrapper.add_write_listener(lambda kind, ticker_ids: refreshed.set())
+        self.market.start_auto_refresh(0.01)
+        try:
+            self.assertTrue(refreshed.wait(10))
+            with self.assertRaises(RuntimeError):
+                self.market.start_auto_refresh(1)
+        finally:
+            self.market.stop_auto_refresh()
+        self.assertEqual(self.read_in_thread()["lengths"], [25, 25, 25])
+
+    def test_auto_refresh_failures(self):
+        errors = []
+        failed = threading.Event()
+
+        def on_error(error):
+            errors.append(error)
+            failed.set()
+
+        with mock.patch.object(self.market.scrapper, "update", side_effect=RuntimeError("tsetmc is down")):
+            self.market.start_auto_refresh(0.01, on_error=on_error)
+            try:
+                self.assertTrue(failed.wait(10))
+            finally:
+                self.market.stop_auto_refresh()
+        self.assertIsInstance(errors[0], RuntimeError)
+        self.assertGreaterEqual(self.market.metrics.counter("refresh_failures_total"), 1)
+        self.assertEqual(self.read_in_thread()["lengths"], [20, 20, 20])
+
+
+class TestImport(unittest.TestCase):
+
+    def test_import_is_lazy(self):
+        code = "import sys, tfinance; print(sorted({'pandas', 'sqlalchemy', 'bs4'} & set(sys.modules)))"
+        output = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True).stdout
+        self.assertEqual(output.strip(), "[]")
+
+
+@unittest.skipIf(pyarrow is None, "pyarrow is not installed")
+class TestMarketArrowStore(TestMarketOffline):
+
+    def make_history_store(self):
+        return ArrowHistoryStore(self.tmp.name + "/history", format="ipc")
+
+
+@unittest.skipIf(pyarrow is None, "pyarrow is not installed")
+class TestMarketRefreshArrowStore(TestMarketRefresh):
+
+    def make_history_store(self):
+        return ArrowHistoryStore(self.tmp.name + "/history", format="parquet")
+
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,79 @@
+import io
+import unittest
+from contextlib import redirect_stderr
+
+from tfinance.fetcher import Fetcher
+from tfinance.metrics import Metrics
+from fake_tsetmc import FakeTsetmc
+from offline import OfflineMarketMixin
+
+
+class TestMetrics(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.metrics = Metrics(buckets=(0.1, 1.0))
+
+    def test_counters_and_histograms(self):
+        self.metrics.inc("rows_written_total", 10)
+        self.metrics.inc("rows_written_total", 5)
+        for value in (0.05, 0.5, 5):
+            self.metrics.observe("phase_seconds", value, phase="write")
+        self.assertEqual(self.metrics.counter("rows_written_total"), 15)
+        histogram = self.metrics.histogram("phase_seconds", phase="write")
+        self.assertEqual(histogram["count"], 3)
+        self.assertEqual(histogram["buckets"], {0.1: 1, 1.0: 2, float("inf"): 3})
+        self.assertIsNone(self.metrics.histogram("phase_seconds", phase="read"))
+
+    def test_hooks(self):
+        records = []
+        self.metrics.add_hook(lambda *record: records.append(record))
+        self.metrics.inc("cache_hits_total")
+        with self.metrics.phase("read"):
+            pass
+        self.assertEqual(records[0], ("counter", "cache_hits_total", 1, {}))
+        self.assertEqual(records[1][:2], ("histogram", "phase_seconds"))
+        self.assertEqual(records[1][3], {"phase": "read"})
+
+    def test_expose(self):
+        self.metrics.inc("fetch_bytes_total", 100)
+        self.metrics.observe("phase_seconds", 0.5, phase="parse")
+        text = self.metrics.expose()
+        self.assertIn("tfinance_fetch_bytes_total 100\n", text)
+        self.assertIn('tfinance_phase_seconds_bucket{phase="parse",le="1.0"} 1\n', text)
+        self.assertIn('tfinance_phase_seconds_bucket{phase="parse",le="+Inf"} 1\n', text)
+        self.assertIn('tfinance_phase_seconds_count{phase="parse"} 1\n', text)
+
+
+class TestSyncMetrics(OfflineMarketMixin, unittest.TestCase):
+
+    def test_sync_phases_and_rows(self):
+        metrics = self.market.metrics
+        for phase in ("tickers", "sectors", "history", "fetch", "write", "adjustments"):
+            self.assertIsNotNone(metrics.histogram("phase_seconds", phase=phase), phase)
+        self.assertEqual(metrics.histogram("phase_seconds", phase="parse")["count"], 3)
+        self.assertEqual(metrics.counter("rows_written_total"), 60)
+
+    def test_cache_hit_rate(self):
+        self.market.fetch_history(ticker="فولاد")
+        self.market.fetch_history(ticker="فولاد")
+        self.assertEqual(self.market.metrics.counter("cache_hits_total"), 1)
+        self.assertEqual(self.market.metrics.counter("cache_misses_total"), 1)
+        self.assertEqual(self.market.metrics.histogram("phase_seconds", phase="read")["count"], 1)
+
+
+class TestFetchMetrics(unittest.TestCase):
+
+    def test_fetch_latency_bytes_and_retries(self):
+        metrics = Metrics()
+        with FakeTsetmc(tickers=40, days=10, error_rate=0.3) as server:
+            scrapper = server.Scrapper(None, store=object(), parse_workers=0, metrics=metrics, progress=True,
+                                       fetcher=Fetcher(rate_limit=None, backoff_factor=0.01, metrics=metrics))
+            ids = [str(i) for i in range(1001, 1011)]
+            with redirect_stderr(io.StringIO()) as stderr:
+                files = list(scrapper.iter_ticker_histories(ids))
+        self.assertIn("Downloading histories", stderr.getvalue())
+        self.assertEqual(len(files), 10)
+        self.assertEqual(metrics.histogram("fetch_seconds")["count"], 10)
+        self.assertEqual(metrics.counter("fetch_bytes_total"), sum(len(f.response.content) for f in files))
+        self.assertEqual(metrics.counter("fetch_requests_total"), 10 + metrics.counter("fetch_retries_total"))
+        self.assertGreater(metrics.counter("fetch_retries_total"), 0)
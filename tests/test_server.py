@@ -0,0 +1,118 @@
+import threading
+import unittest
+
+import pandas as pd
+import requests
+
+import tfinance as tfin
+from tfinance.client import MarketClient
+from tfinance.server import MarketServer
+from offline import OfflineFetcher, OfflineMarketMixin, OfflineScrapper, history_urls, make_history
+
+try:
+    import pyarrow
+except ImportError:
+    pyarrow = None
+
+
+class TestMarketServer(OfflineMarketMixin, unittest.TestCase):
+
+    FORMAT = "csv"
+    MARKET_OPTIONS = {"check_interval": 0}
+
+    def setUp(self) -> None:
+        super().setUp()
+        self.server = MarketServer(self.market, ("127.0.0.1", 0))
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.client = MarketClient(self.server.url, format=self.FORMAT)
+
+    def tearDown(self) -> None:
+        self.client.close()
+        self.server.shutdown()
+        self.server.server_close()
+        super().tearDown()
+
+    def test_tickers_and_sectors(self):
+        pd.testing.assert_frame_equal(self.client.tickers, self.market.tickers, check_dtype=False)
+        self.assertEqual(list(self.client.sectors["name"]), list(self.market.sectors["name"]))
+
+    def test_histories(self):
+        histories = self.client.fetch_histories(["فولاد", "1003"], start="2020-09-10", columns=["<CLOSE>"])
+        expected = self.market.fetch_histories(["فولاد", "1003"], start="2020-09-10", columns=["<CLOSE>"])
+        pd.testing.assert_frame_equal(histories, expected, check_dtype=False)
+        wide = self.client.fetch_histories(["1001", "1002"], columns=["<CLOSE>"], wide=True)
+        self.assertEqual(list(wide["<CLOSE>"].columns), ["1001", "1002"])
+
+    def test_ticker(self):
+        ticker = tfin.Ticker(source=self.client, ticker="فولاد")
+        self.assertEqual(ticker.sector, "فلزات اساسي")
+        expected = self.market.fetch_history(ticker="فولاد")
+        pd.testing.assert_frame_equal(ticker.history, expected, check_dtype=False)
+        self.assertTrue(ticker.adjusted_history["<ADJ>"].eq(1.0).all())
+
+    def test_snapshot(self):
+        snapshot = self.client.snapshot(columns=["<CLOSE>"])
+        pd.testing.assert_frame_equal(snapshot, self.market.snapshot(columns=["<CLOSE>"]), check_dtype=False)
+        self.assertEqual(list(self.client.snapshot("2020-09-10")["<CLOSE>"]), [8, 9, 10])
+
+    def test_errors(self):
+        with self.assertRaises(KeyError):
+            self.client.fetch_histories(["nope"])
+        with self.assertRaises(ValueError):
+            self.client.fetch_histories(["1001"], columns=["<NOPE>"])
+        with self.assertRaises(ValueError):
+            self.client.get("/history")
+        self.assertEqual(requests.get(self.server.url + "/nope").status_code, 404)
+
+    def test_cache_and_revalidation(self):
+        url = self.server.url + "/history"
+        params = {"tickers": "1001", "format": self.FORMAT}
+        first = requests.get(url, params=params)
+        second = requests.get(url, params=params, headers={"If-None-Match": first.headers["ETag"]})
+        self.assertEqual(second.status_code, 304)
+        requests.get(url, params=params)
+        self.assertEqual(self.server.cache.stats.hits, 1)
+        # Writes start a new generation, with new ETags and contents
+        self.market.scrapper.fetcher = OfflineFetcher(history_urls({"1001": make_history("1001", 21)}))
+        self.market.scrapper.sync_history()
+        third = requests.get(url, params=params, headers={"If-None-Match": first.headers["ETag"]})
+        self.assertEqual(third.status_code, 200)
+        self.assertEqual(len(self.client.fetch_histories(["1001"])), 21)
+        self.assertEqual(self.market.metrics.counter("server_requests_total", route="/history", status=304), 1)
+
+    def test_writes_of_other_processes(self):
+        url = self.server.url + "/history"
+        params = {"tickers": "1001", "format": self.FORMAT}
+        first = requests.get(url, params=params)
+        # A Market of the same database under another url stands for one of another process
+        writer = tfin.Market("sqlite:///{}/./tse.db".format(self.tmp.name), Scrapper=OfflineScrapper,
+                             history_store=self.make_history_store(), offline=True)
+        try:
+            writer.scrapper.fetcher = OfflineFetcher(dict(OfflineScrapper.PAGES,
+                                                          **history_urls({"1001": make_history("1001", 21)})))
+            writer.refresh()
+        finally:
+            writer.close()
+        second = requests.get(url, params=params, headers={"If-None-Match": first.headers["ETag"]})
+        self.assertEqual(second.status_code, 200)
+        self.assertEqual(len(self.client.fetch_histories(["1001"])), 21)
+        self.assertEqual(self.client.info()["generation"], self.market.generation)
+
+    def test_info(self):
+        self.assertEqual(self.client.info()["generation"], self.market.generation)
+
+
+@unittest.skipIf(pyarrow is None, "pyarrow is not installed")
+class TestMarketServerArrow(TestMarketServer):
+
+    FORMAT = "arrow"
+
+
+@unittest.skipIf(pyarrow is None, "pyarrow is not installed")
+class TestMarketServerParquet(TestMarketServer):
+
+    FORMAT = "parquet"
+
+
+if __name__ == '__main__':
+    unittest.main()
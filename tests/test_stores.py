@@ -0,0 +1,104 @@
+import tempfile
+import unittest
+
+import pandas as pd
+from sqlalchemy import create_engine
+
+from tfinance.abc.base_history_store import BaseHistoryStore
+from tfinance.stores import SQLHistoryStore, ArrowHistoryStore
+
+try:
+    import pyarrow
+except ImportError:
+    pyarrow = None
+
+
+def make_frame(ticker_id, dates, close):
+    dates = pd.to_datetime(dates)
+    return pd.DataFrame({"ticker_id": ticker_id, "<TICKER>": "T" + ticker_id, "<DTYYYYMMDD>": dates,
+                         "<FIRST>": close, "<HIGH>": close, "<LOW>": close, "<CLOSE>": close, "<VALUE>": 1000,
+                         "<VOL>": 10, "<OPENINT>": 1, "<PER>": "D", "<OPEN>": close, "<LAST>": close})
+
+
+class HistoryStoreContract:
+    """
+    Behaviour every BaseHistoryStore must have, mixed into a TestCase defining make_store().
+    """
+
+    def setUp(self) -> None:
+        self.tmp = tempfile.TemporaryDirectory()
+        self.store = self.make_store()
+        self.store.write(pd.concat([make_frame("1001", ["2020-10-03", "2020-10-04"], 100.0),
+                                    make_frame("1002", ["2020-10-04", "2020-10-05"], 200.0)]))
+
+    def tearDown(self) -> None:
+        self.tmp.cleanup()
+
+    def test_read_all(self):
+        df = self.store.read()
+        self.assertEqual(list(df.columns), ["ticker_id", "<DTYYYYMMDD>"] + self.store.COLUMNS)
+        self.assertEqual(list(df["ticker_id"]), ["1001", "1001", "1002", "1002"])
+
+    def test_read_prunes_columns_and_dates(self):
+        df = self.store.read(["1002"], start="2020-10-05", columns=["<CLOSE>"])
+        self.assertEqual(list(df.columns), ["ticker_id", "<DTYYYYMMDD>", "<CLOSE>"])
+        self.assertEqual(df["<DTYYYYMMDD>"].tolist(), [pd.Timestamp("2020-10-05")])
+        df = self.store.read(["1001", "1002"], end="2020-10-03")
+        self.assertEqual(df["ticker_id"].tolist(), ["1001"])
+
+    def test_write_upserts(self):
+        self.store.write(make_frame("1001", ["2020-10-04", "2020-10-06"], 150.0))
+        df = self.store.read(["1001"], columns=["<CLOSE>"])
+        self.assertEqual(df["<CLOSE>"].tolist(), [100.0, 150.0, 150.0])
+
+    def test_last_dates(self):
+        last_dates = {k: pd.Timestamp(v) for k, v in self.store.last_dates().items()}
+        self.assertEqual(last_dates, {"1001": pd.Timestamp("2020-10-04"), "1002": pd.Timestamp("2020-10-05")})
+
+    def test_iter_read(self):
+        self.store.write(make_frame("1003", ["2020-10-05"], None))
+        chunks = list(self.store.iter_read(chunksize=2, columns=["<CLOSE>", "<VOL>"]))
+        self.assertEqual([len(chunk) for chunk in chunks], [2, 2, 1])
+        for chunk in chunks:
+            self.assertEqual([str(t) for t in chunk.dtypes[2:]], ["float64", "Int64"])
+        df = pd.concat(chunks, ignore_index=True)
+        self.assertEqual(list(df["ticker_id"]), ["1001", "1001", "1002", "1002", "1003"])
+        self.assertEqual(len(list(self.store.iter_read(["1002"], start="2020-10-05"))), 1)
+
+    def test_read_latest(self):
+        self.store.write(make_frame("1001", ["2020-10-06"], 150.0))
+        latest = self.store.read_latest(columns=["<CLOSE>"])
+        self.assertEqual(list(latest["ticker_id"]), ["1001", "1002"])
+        self.assertEqual(list(latest["<DTYYYYMMDD>"]), [pd.Timestamp("2020-10-06"), pd.Timestamp("2020-10-05")])
+        self.assertEqual(list(latest["<CLOSE>"]), [150.0, 200.0])
+        # Same rows as the streamed default
+        pd.testing.assert_frame_equal(latest, BaseHistoryStore.read_latest(self.store, columns=["<CLOSE>"]),
+                                      check_dtype=False)
+
+    def test_unknown_columns(self):
+        with self.assertRaises(ValueError):
+            self.store.read(columns=["<NOPE>"])
+
+
+class TestSQLHistoryStore(HistoryStoreContract, unittest.TestCase):
+
+    def make_store(self):
+        return SQLHistoryStore(create_engine("sqlite:///{}/tse.db".format(self.tmp.name)))
+
+
+@unittest.skipIf(pyarrow is None, "pyarrow is not installed")
+class TestParquetHistoryStore(HistoryStoreContract, unittest.TestCase):
+
+    def make_store(self):
+        return ArrowHistoryStore(self.tmp.name, format="parquet")
+
+
+@unittest.skipIf(pyarrow is None, "pyarrow is not installed")
+class TestIPCHistoryStore(HistoryStoreContract, unittest.TestCase):
+
+    def make_store(self):
+        return ArrowHistoryStore(self.tmp.name, format="ipc")
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,8 +1,12 @@
 import unittest
 from unittest import TestCase
+from unittest import mock
+
 import tfinance as tfin
 import pandas as pd
 
+from offline import OfflineMarketMixin
+
 class TestTicker(unittest.TestCase):
     def setUp(self) -> None:
         self.foolad = tfin.Ticker(ticker="فولاد")
@@ -35,6 +39,28 @@ class TestTicker(unittest.TestCase):
         self.assertIsInstance(self.foolad.history, pd.DataFrame)
 
 
+class TestTickerOffline(OfflineMarketMixin, unittest.TestCase):
+
+    def test_metadata_doesnt_load_history(self):
+        with mock.patch.object(self.market, "fetch_history", wraps=self.market.fetch_history) as fetch_history:
+            foolad = tfin.Ticker(source=self.market, ticker="فولاد")
+            self.assertEqual((foolad.id, foolad.latin_ticker, foolad.sector), ("1001", "FOLD1", "فلزات اساسي"))
+            fetch_history.assert_not_called()
+            self.assertEqual(len(foolad.history), 20)
+            self.assertIs(foolad.history, foolad.history)
+            fetch_history.assert_called_once_with(id="1001")
+
+    def test_lookup_keys(self):
+        for kwargs in ({"id": "1002"}, {"latin_ticker": "MSMI1"}, {"ticker_code": "IRO1MSMI0001"},
+                       {"name": "ملي صنايع مس ايران"}, {"ticker": "فملي", "market": "N1"}):
+            self.assertEqual(tfin.Ticker(source=self.market, **kwargs).ticker, "فملي")
+        with self.assertRaises(KeyError):
+            tfin.Ticker(source=self.market, ticker="فملي", market="N2")
+
+    def test_sector_ids(self):
+        self.assertEqual(self.market.symbol_index.ids_in_sector("فلزات اساسي"), ["1001", "1002"])
+
+
 if __name__ == '__main__':
     unittest.main()
 
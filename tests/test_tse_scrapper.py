@@ -1,9 +1,305 @@
+import concurrent.futures
+import hashlib
+import os
 import unittest
+from unittest import mock
 
+import pandas as pd
+from sqlalchemy import inspect, text
 
-class TestTSEScrapper(unittest.TestCase):
-    def test_something(self):
-        self.assertEqual(True, False)
+from tfinance import TSEScrapper
+from tfinance.tse_scrapper import parse_history
+from tfinance.fetcher import Fetcher
+
+from fake_tsetmc import FakeTsetmc, load_fixture, page_tree
+from offline import OfflineFetcher, OfflineScrapperMixin, history_urls, make_csv, make_history
+
+
+class TestTSEScrapper(OfflineScrapperMixin, unittest.TestCase):
+
+    def stored(self):
+        with self.session.bind.connect() as connection:
+            return connection.execute(text("SELECT COUNT(DISTINCT ticker_id), COUNT(*) FROM ticker_history")).one()
+
+    def test_update(self):
+        with FakeTsetmc(tickers=40, days=15, error_rate=0.1, rate_limit=200) as server:
+            scrapper = server.Scrapper(self.session, fetcher=Fetcher(rate_limit=None, backoff_factor=0.01),
+                                       parse_workers=0)
+            scrapper.update()
+            self.assertEqual(len(scrapper.tickers), 37)
+            self.assertEqual(len(scrapper.sectors), 8)
+            self.assertEqual(tuple(self.stored()), (37, 37 * 15))
+            self.assertGreater(server.stats["503"], 0)
+
+            server.advance(2)
+            server.reset_stats()
+            scrapper.update(incremental=True)
+            self.assertEqual(tuple(self.stored()), (37, 37 * 17))
+            # The ticker and sector pages didn't change
+            self.assertEqual(server.stats["304"], 2)
+
+    def test_pages_are_fetched_conditionally(self):
+        with FakeTsetmc(tickers=10, days=5) as server:
+            scrapper = server.Scrapper(self.session, fetcher=Fetcher(rate_limit=None), parse_workers=0)
+            scrapper.update(incremental=True)
+            write_listener = mock.Mock()
+            scrapper.add_write_listener(write_listener)
+            server.reset_stats()
+            scrapper.update(incremental=True)
+            self.assertEqual(server.stats["304"], server.stats["requests"])
+            write_listener.assert_not_called()
+            # New listings get their history
+            server.pages[page_tree(TSEScrapper.URL_BAZAR_ADDI)] = load_fixture("bazar_addi.html", 20)
+            scrapper.update(incremental=True)
+            self.assertEqual(tuple(self.stored()), (len(scrapper.tickers), len(scrapper.tickers) * 5))
+            self.assertGreater(len(scrapper.tickers), 10)
+
+
+FIXTURES = os.path.join(os.path.dirname(__file__), "fixtures")
+
+
+def read_fixture(name):
+    with open(os.path.join(FIXTURES, name), "rb") as f:
+        return f.read()
+
+
+class TestParsing(OfflineScrapperMixin, unittest.TestCase):
+
+    def setUp(self) -> None:
+        super().setUp()
+        fetcher = OfflineFetcher({TSEScrapper.URL_BAZAR_ADDI: read_fixture("bazar_addi.html"),
+                                  TSEScrapper.URL_SECTORS_LIST: read_fixture("sectors_list.html")})
+        self.scrapper = TSEScrapper(self.session, fetcher=fetcher)
+
+    def test_get_tickers(self):
+        self.scrapper.get_tickers()
+        tickers = self.scrapper.tickers
+        self.assertEqual(len(tickers), 37)
+        self.assertEqual((len(self.scrapper.r), len(self.scrapper.d)), (2, 1))
+        self.assertEqual(list(tickers.columns), ["id", "name", "ticker", "latin_name", "latin_ticker", "sector",
+                                                 "market", "sub_market", "ticker_code"])
+        foolad = tickers.iloc[0].to_dict()
+        self.assertEqual(foolad, {"id": "57900062392749367", "name": "فولاد مباركه اصفهان", "ticker": "فولاد",
+                                  "latin_name": "S*Mobarakeh Steel", "latin_ticker": "FOLD1",
+                                  "sector": "فلزات اساسي", "market": "N1", "sub_market": "تابلو اصلي",
+                                  "ticker_code": "IRO1FOLD0001"})
+        self.assertTrue(tickers["id"].str.isdigit().all())
+
+    def test_get_sectors(self):
+        self.scrapper.get_sectors()
+        self.assertEqual(len(self.scrapper.sectors), 8)
+        self.assertEqual(self.scrapper.sectors.iloc[1].to_dict(), {"code": "27", "name": "فلزات اساسي"})
+
+    def test_empty_grid(self):
+        html = b'<table id="tblToGrid"><tr><th>a</th></tr></table>'
+        tickers = self.scrapper.parse_tickers(html)
+        self.assertTrue(tickers.empty)
+        self.assertEqual(list(tickers.columns), ["id", "name", "ticker", "latin_name", "latin_ticker", "sector",
+                                                 "market", "sub_market", "ticker_code"])
+        sectors = self.scrapper.parse_sectors(html)
+        self.assertTrue(sectors.empty)
+        self.assertEqual(list(sectors.columns), ["code", "name"])
+
+    def test_short_rows(self):
+        html = '<table id="tblToGrid"><tr><th>a</th></tr><tr><td>IRO1FOLD0001</td><td>N1</td></tr>' \
+               '<tr><td>27</td></tr></table>'.encode()
+        tickers = self.scrapper.parse_tickers(html)
+        self.assertEqual(list(tickers["ticker_code"]), ["IRO1FOLD0001", "27"])
+        self.assertEqual(list(tickers["market"].isna()), [False, True])
+        self.assertTrue(tickers["id"].isna().all())
+        sectors = self.scrapper.parse_sectors(html)
+        self.assertEqual(list(sectors["code"]), ["IRO1FOLD0001", "27"])
+        self.assertEqual(list(sectors["name"].isna()), [False, True])
+
+
+class TestIncrementalSync(OfflineScrapperMixin, unittest.TestCase):
+
+    def setUp(self) -> None:
+        super().setUp()
+        self.scrapper = TSEScrapper(self.session)
+        self.scrapper.tickers = pd.DataFrame({"id": ["1001"]})
+
+    def sync(self, content):
+        self.scrapper.fetcher = OfflineFetcher(history_urls({"1001": content}))
+        self.scrapper.update_history(incremental=True)
+
+    def stored(self):
+        with self.session.bind.connect() as connection:
+            rows = connection.execute(text('SELECT "<DTYYYYMMDD>", "<CLOSE>" FROM ticker_history '
+                                           'WHERE ticker_id = \'1001\' ORDER BY 1')).all()
+        return [(r[0][:10], r[1]) for r in rows]
+
+    def test_appends_only_new_sessions(self):
+        self.sync(make_csv([(20201004, 100), (20201003, 90)]))
+        self.assertEqual(self.scrapper.fetch_last_dates()["1001"].strftime("%Y%m%d"), "20201004")
+        with mock.patch.object(self.scrapper, "write_history_batch",
+                               wraps=self.scrapper.write_history_batch) as write:
+            self.sync(make_csv([(20201005, 110), (20201004, 100), (20201003, 90)]))
+        self.assertEqual(sum(len(df) for df in write.call_args.args[0]), 1)
+        self.assertEqual(self.stored(), [("2020-10-03", 90), ("2020-10-04", 100), ("2020-10-05", 110)])
+
+    def test_upsert_replaces_existing_dates(self):
+        self.sync(make_csv([(20201004, 100)]))
+        _, df, _ = parse_history("1001", make_csv([(20201004, 105)]))
+        self.scrapper.upsert_ticker_history("1001", df)
+        self.assertEqual(self.stored(), [("2020-10-04", 105)])
+
+    def test_migrates_legacy_tables(self):
+        _, df, _ = parse_history("1001", make_csv([(20201004, 100), (20201003, 90)]))
+        df.drop(columns="ticker_id").to_sql(name="1001", con=self.session.bind, index=False)
+        self.scrapper.migrate_history()
+        self.assertFalse(inspect(self.session.bind).has_table("1001"))
+        self.assertEqual(self.stored(), [("2020-10-03", 90), ("2020-10-04", 100)])
+
+    def test_partial_failures_are_recorded(self):
+        self.scrapper.tickers = pd.DataFrame({"id": ["1001", "1002", "1003"]})
+        self.scrapper.fetcher = OfflineFetcher(history_urls({"1001": make_csv([(20201004, 100)]),
+                                                             "1003": b"garbage"}))
+        self.scrapper.update_history(incremental=True)
+        self.assertEqual(set(self.scrapper.failures), {"1002", "1003"})
+        self.assertEqual(self.stored(), [("2020-10-04", 100)])
+
+    def test_not_modified_without_stored_validators(self):
+        self.sync(make_csv([(20201004, 100)]))
+        # A proxy answering 304 to everything, though nothing of 1002 was ever downloaded
+        self.scrapper.tickers = pd.DataFrame({"id": ["1001", "1002"]})
+        not_modified = mock.Mock(content=b"", headers={}, status_code=304)
+        with mock.patch.object(self.scrapper.fetcher, "get", return_value=not_modified):
+            self.scrapper.update_history(incremental=True)
+        self.assertEqual(self.scrapper.unchanged, {"1001"})
+        self.assertEqual(set(self.scrapper.failures), {"1002"})
+        self.assertNotIn(self.scrapper.URL_TICKER_CSV_TEMPLATE + "1002", self.scrapper.load_fetch_meta())
+        self.assertEqual(self.stored(), [("2020-10-04", 100)])
+
+
+class TestStreamingSync(OfflineScrapperMixin, unittest.TestCase):
+
+    def setUp(self) -> None:
+        super().setUp()
+        histories = {str(i): make_history(str(i), 10) for i in range(1001, 1006)}
+        self.archive_dir = os.path.join(self.tmp.name, "archive")
+        self.scrapper = TSEScrapper(self.session, fetcher=OfflineFetcher(history_urls(histories)),
+                                    archive_dir=self.archive_dir, batch_size=25)
+        self.scrapper.tickers = pd.DataFrame({"id": list(histories)})
+
+    def test_writes_in_bounded_batches(self):
+        with mock.patch.object(self.scrapper, "write_history_batch",
+                               wraps=self.scrapper.write_history_batch) as write:
+            self.scrapper.update_history(streaming=True)
+        batch_rows = [sum(len(df) for df in call.args[0]) for call in write.call_args_list]
+        self.assertEqual(batch_rows, [30, 20])
+        with self.session.bind.connect() as connection:
+            self.assertEqual(connection.execute(text("SELECT COUNT(*) FROM ticker_history")).scalar(), 50)
+        self.assertEqual(len(os.listdir(self.archive_dir)), 5)
+        self.assertFalse(os.path.exists(TSEScrapper.TEMP_DIR))
+
+    def test_stored_histories_are_streamed_by_whole_tickers(self):
+        self.scrapper.update_history(streaming=True)
+        frames = list(self.scrapper.iter_stored_histories(columns=["<CLOSE>"]))
+        self.assertGreater(len(frames), 1)
+        counts = pd.concat([frame["ticker_id"].value_counts() for frame in frames])
+        self.assertEqual(counts.to_dict(), {str(i): 10 for i in range(1001, 1006)})
+
+
+class TestParseWorkers(OfflineScrapperMixin, unittest.TestCase):
+
+    def setUp(self) -> None:
+        super().setUp()
+        self.histories = {str(i): make_history(str(i), 10) for i in range(1001, 1006)}
+        self.histories["1003"] = b"garbage"
+
+    def make_scrapper(self, parse_workers):
+        scrapper = TSEScrapper(self.session, fetcher=OfflineFetcher(history_urls(self.histories)),
+                               parse_workers=parse_workers)
+        scrapper.tickers = pd.DataFrame({"id": list(self.histories)})
+        return scrapper
+
+    def stored_ids(self):
+        with self.session.bind.connect() as connection:
+            rows = connection.execute(text("SELECT ticker_id, COUNT(*) FROM ticker_history GROUP BY 1")).all()
+        return dict(rows)
+
+    def test_staged_files_are_parsed_in_processes(self):
+        scrapper = self.make_scrapper(parse_workers=2)
+        with mock.patch.object(scrapper, "write_history_batch", wraps=scrapper.write_history_batch) as write:
+            scrapper.update_history()
+        self.assertEqual(write.call_count, 1)
+        self.assertEqual(self.stored_ids(), {"1001": 10, "1002": 10, "1004": 10, "1005": 10})
+        self.assertEqual(set(scrapper.failures), {"1003"})
+
+    def test_streaming_sync_in_processes_matches_inline(self):
+        self.make_scrapper(parse_workers=2).sync_history()
+        in_processes = self.stored_ids()
+        with self.session.bind.begin() as connection:
+            connection.execute(text("DELETE FROM ticker_history"))
+        scrapper = self.make_scrapper(parse_workers=0)
+        scrapper.sync_history()
+        self.assertEqual(self.stored_ids(), in_processes)
+        self.assertEqual(set(scrapper.failures), {"1003"})
+
+    def test_workers_are_not_forked(self):
+        scrapper = self.make_scrapper(parse_workers=2)
+        with mock.patch("concurrent.futures.ProcessPoolExecutor",
+                        wraps=concurrent.futures.ProcessPoolExecutor) as executor:
+            scrapper.sync_history()
+        self.assertIn(executor.call_args.kwargs["mp_context"].get_start_method(), ("forkserver", "spawn"))
+        # Incremental syncs of the populated store parse inline
+        self.histories["1001"] = make_history("1001", 11)
+        scrapper.fetcher = OfflineFetcher(history_urls(self.histories))
+        with mock.patch("concurrent.futures.ProcessPoolExecutor") as executor:
+            scrapper.sync_history()
+        executor.assert_not_called()
+        self.assertEqual(self.stored_ids()["1001"], 11)
+
+    def test_sqlite_uses_wal(self):
+        self.make_scrapper(parse_workers=0)
+        with self.session.bind.connect() as connection:
+            self.assertEqual(connection.execute(text("PRAGMA journal_mode")).scalar(), "wal")
+
+
+class TestConditionalSync(OfflineScrapperMixin, unittest.TestCase):
+
+    def setUp(self) -> None:
+        super().setUp()
+        self.server = FakeTsetmc(days=10).start()
+        self.scrapper = self.server.Scrapper(self.session, fetcher=Fetcher(rate_limit=None), parse_workers=0)
+        self.scrapper.tickers = pd.DataFrame({"id": [str(i) for i in range(1001, 1011)]})
+        self.scrapper.sync_history()
+        self.server.reset_stats()
+        # Two tickers trade one more session, the eight others are halted
+        for ticker_id in ("1001", "1002"):
+            self.server.histories[ticker_id] = make_history(ticker_id, 11)
+
+    def tearDown(self) -> None:
+        self.server.stop()
+        super().tearDown()
+
+    def sync(self):
+        with mock.patch.object(self.scrapper.store, "write", wraps=self.scrapper.store.write) as write:
+            self.scrapper.sync_history()
+        return [sorted(set(call.args[0]["ticker_id"])) for call in write.call_args_list]
+
+    def test_halted_tickers_answer_not_modified(self):
+        self.assertEqual(self.sync(), [["1001", "1002"]])
+        self.assertEqual((self.server.stats["200"], self.server.stats["304"]), (2, 8))
+        self.assertEqual(len(self.scrapper.unchanged), 8)
+        self.assertEqual(len(self.scrapper.load_fetch_meta()), 10)
+        # A second sync finds every ticker unchanged and writes nothing
+        self.server.reset_stats()
+        self.assertEqual(self.sync(), [])
+        self.assertEqual((self.server.stats["requests"], self.server.stats["304"]), (10, 10))
+
+    def test_unchanged_content_hash_is_skipped(self):
+        self.server.etag = False
+        self.assertEqual(self.sync(), [["1001", "1002"]])
+        self.assertEqual(self.scrapper.unchanged, {str(i) for i in range(1003, 1011)})
+
+    def test_failed_parse_is_refetched(self):
+        self.server.histories["1003"] = b"garbage"
+        self.sync()
+        self.assertIn("1003", self.scrapper.failures)
+        meta = self.scrapper.load_fetch_meta()[self.scrapper.URL_TICKER_CSV_TEMPLATE + "1003"]
+        self.assertEqual(meta["content_hash"], hashlib.sha256(make_history("1003", 10)).hexdigest())
 
 
 if __name__ == '__main__':
@@ -3,8 +3,26 @@ __author__ = "Sadiq Rahmati"
 
 import logging
 
-from .ticker import Ticker
-from .market import Market
-from .tse_scrapper import TSEScrapper
-
 logging.getLogger("tfinance").addHandler(logging.NullHandler())
+
+# Ticker, Market and TSEScrapper pull in pandas, sqlalchemy and bs4, so they are only imported on first access
+_LAZY_ATTRIBUTES = {
+    "Ticker": ".ticker",
+    "Market": ".market",
+    "TSEScrapper": ".tse_scrapper",
+    "MarketClient": ".client",
+    "MarketServer": ".server",
+}
+
+
+def __getattr__(name):
+    if name in _LAZY_ATTRIBUTES:
+        import importlib
+        value = getattr(importlib.import_module(_LAZY_ATTRIBUTES[name], __name__), name)
+        globals()[name] = value
+        return value
+    raise AttributeError("module {!r} has no attribute {!r}".format(__name__, name))
+
+
+def __dir__():
+    return sorted(list(globals()) + list(_LAZY_ATTRIBUTES))
@@ -0,0 +1,19 @@
+from abc import ABC, abstractmethod
+
+
+class BaseFetcher(ABC):
+
+    @abstractmethod
+    def get(self, url, headers=None):
+        """
+        Returns the response of url requested with the extra headers, raising on failure.
+        """
+        pass
+
+    @abstractmethod
+    def iter_fetch(self, urls, headers=None):
+        """
+        Fetches a {key: url} mapping, yielding a FetchResult per url as soon as it completes. headers optionally
+        maps keys to extra request headers. A conditional request answered with 304 yields its response as is.
+        """
+        pass
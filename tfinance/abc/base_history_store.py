@@ -0,0 +1,77 @@
+import contextlib
+from abc import ABC, abstractmethod
+
+import pandas as pd
+
+from ..dtypes import typed_history
+
+
+class BaseHistoryStore(ABC):
+    """
+    Storage of ticker histories. Frames going in and out have a ticker_id column next to the history columns.
+    """
+
+    COLUMNS = ["<TICKER>", "<FIRST>", "<HIGH>", "<LOW>", "<CLOSE>", "<VALUE>", "<VOL>", "<OPENINT>", "<PER>",
+               "<OPEN>", "<LAST>"]
+
+    @abstractmethod
+    def write(self, df):
+        """
+        Upserts df, replacing the stored rows that share its (ticker_id, <DTYYYYMMDD>) pairs.
+        """
+        pass
+
+    @abstractmethod
+    def read(self, ids=None, start=None, end=None, columns=None):
+        """
+        Returns the ticker_id, <DTYYYYMMDD> and columns of the rows of ids (all tickers if None) between start and
+        end (both inclusive), ordered by ticker_id and <DTYYYYMMDD>.
+        """
+        pass
+
+    def iter_read(self, ids=None, start=None, end=None, columns=None, chunksize=100000):
+        """
+        Same as read() but yields the rows in frames of at most chunksize rows, typed by dtypes.typed_history so that
+        every chunk has the same dtypes. Stores override it to stream from storage, this default reads all at once.
+        """
+        df = self.read(ids, start, end, columns)
+        for offset in range(0, len(df), chunksize):
+            yield typed_history(df.iloc[offset:offset + chunksize].reset_index(drop=True))
+
+    def read_latest(self, columns=None):
+        """
+        Returns the ticker_id, <DTYYYYMMDD> and columns of the last stored row of every ticker, ordered by
+        ticker_id. Stores override it to read those rows only, this default streams the rows with iter_read.
+        """
+        columns = self.check_columns(columns)
+        latest = [chunk.groupby("ticker_id", sort=False).tail(1) for chunk in self.iter_read(columns=columns)]
+        if not latest:
+            return typed_history(pd.DataFrame(columns=["ticker_id", "<DTYYYYMMDD>"] + columns))
+        # A ticker spanning two chunks has a row in both, the later one is kept
+        return pd.concat(latest, ignore_index=True).groupby("ticker_id", sort=False).tail(1).reset_index(drop=True)
+
+    @abstractmethod
+    def last_dates(self):
+        """
+        Returns the last stored <DTYYYYMMDD> of every stored ticker as a {ticker_id: datetime} dict.
+        """
+        pass
+
+    @contextlib.contextmanager
+    def transaction(self, connection=None):
+        """
+        Context manager holding the writes made by the current thread in its block back from readers until it
+        exits, when they're published at once, and discarding them if it raises. Reads of the current thread see
+        them meanwhile. Stores that can't stage writes publish each one as it's made.
+
+        :param connection: SQLAlchemy connection of a transaction to join, stores of the same database write
+            through it so that their writes commit along with the other tables
+        """
+        yield
+
+    def check_columns(self, columns):
+        columns = self.COLUMNS if columns is None else list(columns)
+        unknown = set(columns) - set(self.COLUMNS)
+        if unknown:
+            raise ValueError("Unknown history columns: {}".format(sorted(unknown)))
+        return columns
@@ -1,9 +1,42 @@
+import datetime
 from abc import ABC, abstractmethod
 
+from ..models import bump_generation
+
 class BaseScrapper(ABC):
+    """
+    Fills the database of a Market, which creates its scrapper as
+    Scrapper(session, store=, materialize=, metrics=, progress=) and calls update(), or
+    update(incremental=True, atomic=True) on refresh().
+    """
+
+    # Callables notified after the scrapper writes to the database
+    write_listeners = ()
+    # Generation of the database after the scrapper's last published write, see models.GenerationModel
+    generation = None
+
+    def __init__(self, session, store=None, materialize=False, metrics=None, progress=False):
+        """
+        :param session: SQLAlchemy session of the local database
+        :param store: BaseHistoryStore histories are written to
+        :param materialize: if True, aggregates are kept up to date along the histories
+        :param metrics: metrics.Metrics recording the scrapper's timings and counters
+        :param progress: if True, updates show progress bars
+        """
+        self.session = session
+        self.store = store
+        self.materialize = materialize
+        self.metrics = metrics
+        self.progress = progress
 
     @abstractmethod
-    def update(self):
+    def update(self, incremental=False, streaming=False, atomic=False):
+        """
+        :param incremental: only write the sessions newer than the stored ones
+        :param streaming: write histories as they're downloaded instead of staging them
+        :param atomic: if True, readers see the whole update at once when it's finished, or nothing if it fails.
+            Scrappers that can't stage their writes may publish them as they're made.
+        """
         pass
 
     @abstractmethod
@@ -18,3 +51,25 @@ class BaseScrapper(ABC):
     def update_sectors(self):
         pass
 
+    def add_write_listener(self, listener):
+        """
+        Registers listener(kind, ticker_ids), called after "tickers", "sectors" or "history" rows are written.
+        For "history", ticker_ids is the set of tickers whose rows changed.
+        """
+        self.write_listeners = list(self.write_listeners) + [listener]
+
+    def notify_write(self, kind, ticker_ids=None):
+        """
+        Publishes a write: bumps the generation of the database so that Markets of other processes notice it, then
+        calls the write listeners.
+        """
+        self.publish_generation()
+        self.call_write_listeners(kind, ticker_ids)
+
+    def publish_generation(self):
+        with self.session.bind.begin() as connection:
+            self.generation = bump_generation(connection, datetime.datetime.now())
+
+    def call_write_listeners(self, kind, ticker_ids=None):
+        for listener in self.write_listeners:
+            listener(kind, ticker_ids)
@@ -0,0 +1,64 @@
+"""
+Corporate action (dividend, capital increase, split) adjustment of price histories.
+
+An adjustment event is a session whose reference price (<OPEN> in tsetmc's Export-txt csv) differs from the previous
+session's close, its factor being reference / previous close. Prices before an event are multiplied by the factors of
+every later event. Events are what gets stored, so that a new event only adds a row instead of rewriting the
+cumulative factor of the whole past.
+"""
+import numpy as np
+import pandas as pd
+
+from .dtypes import PRICE_COLUMNS
+
+EVENT_COLUMNS = ["ticker_id", "<DTYYYYMMDD>", "factor"]
+
+
+def detect_adjustments(df, tolerance=0.001):
+    """
+    Finds the adjustment events of a history frame having ticker_id, <DTYYYYMMDD>, <CLOSE> and <OPEN> columns,
+    in one vectorized pass over all of its tickers.
+
+    :param tolerance: relative gap between reference price and previous close below which there's no event
+    :return: DataFrame of EVENT_COLUMNS
+    """
+    df = df.loc[:, ["ticker_id", "<DTYYYYMMDD>", "<CLOSE>", "<OPEN>"]].sort_values(["ticker_id", "<DTYYYYMMDD>"])
+    previous_close = df.groupby("ticker_id", sort=False, observed=True)["<CLOSE>"].shift(1)
+    factor = (df["<OPEN>"] / previous_close).astype("float64")
+    is_event = (factor > 0) & ((factor - 1).abs() > tolerance)
+    events = df.loc[is_event, ["ticker_id", "<DTYYYYMMDD>"]].assign(factor=factor[is_event])
+    return events.reset_index(drop=True)
+
+
+def cumulative_factors(df, events):
+    """
+    Returns, for every row of df (having ticker_id and <DTYYYYMMDD> columns), the product of the factors of the
+    events of its ticker that happen after the row's date, aligned on df's index.
+    """
+    if events.empty or df.empty:
+        return pd.Series(1.0, index=df.index)
+    events = events.astype({"ticker_id": str}).sort_values(["ticker_id", "<DTYYYYMMDD>"], ascending=[True, False])
+    events = events.assign(later=events.groupby("ticker_id", sort=False)["factor"].cumprod())
+    events = events.sort_values("<DTYYYYMMDD>")
+    rows = df.loc[:, ["ticker_id", "<DTYYYYMMDD>"]].reset_index(drop=True)
+    rows["ticker_id"] = rows["ticker_id"].astype(str)
+    rows["<DTYYYYMMDD>"] = rows["<DTYYYYMMDD>"].astype(events["<DTYYYYMMDD>"].dtype)
+    order = np.argsort(rows["<DTYYYYMMDD>"].to_numpy(), kind="stable")
+    merged = pd.merge_asof(rows.iloc[order], events[["ticker_id", "<DTYYYYMMDD>", "later"]], on="<DTYYYYMMDD>",
+                           by="ticker_id", direction="forward", allow_exact_matches=False)
+    factors = np.empty(len(rows))
+    factors[order] = merged["later"].fillna(1.0).to_numpy()
+    return pd.Series(factors, index=df.index)
+
+
+def adjust_history(df, events):
+    """
+    Returns df with its price columns adjusted for events, plus an <ADJ> column holding the applied factor.
+    """
+    factors = cumulative_factors(df, events)
+    df = df.copy()
+    for column in PRICE_COLUMNS:
+        if column in df.columns:
+            df[column] = df[column] * factors
+    df["<ADJ>"] = factors
+    return df
@@ -0,0 +1,151 @@
+"""
+Resampled bars and rolling indicators of price histories, and daily sector aggregates of their tickers, computed
+for all tickers at once.
+
+They're materialized by TSEScrapper when it's created with materialize=True. After a sync only the tail touched by
+the new sessions is recomputed: the bars of the periods the new sessions fall in, the indicators of the new
+sessions, which only need the INDICATOR_LOOKBACK sessions before them, and the sector aggregates of the new dates.
+"""
+import numpy as np
+import pandas as pd
+
+# Iranian trading weeks run from Saturday to Wednesday
+PERIODS = {"W": "W-WED", "M": "M"}
+BAR_COLUMNS = ["ticker_id", "period", "<DTYYYYMMDD>", "<FIRST>", "<HIGH>", "<LOW>", "<CLOSE>", "<VALUE>", "<VOL>",
+               "<OPENINT>", "<SESSIONS>"]
+SMA_WINDOWS = (5, 20, 60)
+VOLATILITY_WINDOW = 20
+INDICATOR_COLUMNS = ["ticker_id", "<DTYYYYMMDD>", "<RETURN>"] + ["<SMA{}>".format(w) for w in SMA_WINDOWS] + \
+                    ["<VOLATILITY{}>".format(VOLATILITY_WINDOW)]
+# Sessions before a new one that its indicators depend on
+INDICATOR_LOOKBACK = max(SMA_WINDOWS + (VOLATILITY_WINDOW,)) - 1
+SECTOR_COLUMNS = ["sector", "<DTYYYYMMDD>", "<VALUE>", "<VOL>", "<TICKERS>", "<ADVANCES>", "<DECLINES>",
+                  "<UNCHANGED>", "<RETURN_EW>", "<RETURN_VW>"]
+# Additive sums of sector_sums: returns and value weighted returns of the members with a return, and their counts
+SECTOR_SUM_COLUMNS = ["<VALUE>", "<VOL>", "<TICKERS>", "<ADVANCES>", "<DECLINES>", "<UNCHANGED>", "<RETURNS>",
+                      "<VALUE_RETURNS>", "<VALID>", "<VALID_VALUE>"]
+# History columns the sector aggregates are computed from
+SECTOR_SOURCE_COLUMNS = ["<CLOSE>", "<OPEN>", "<VALUE>", "<VOL>"]
+
+
+def resample_bars(df, period):
+    """
+    Resamples a history frame having ticker_id, <DTYYYYMMDD> and price columns to one bar per ticker and period.
+
+    :param period: "W" for weeks ending on Wednesday or "M" for calendar months, bars are labeled by period end
+    :return: DataFrame of BAR_COLUMNS
+    """
+    df = df.sort_values(["ticker_id", "<DTYYYYMMDD>"])
+    period_end = df["<DTYYYYMMDD>"].dt.to_period(PERIODS[period]).dt.end_time.dt.normalize()
+    grouped = df.groupby([df["ticker_id"], period_end], sort=False, observed=True)
+    bars = grouped.agg(**{"<FIRST>": ("<FIRST>", "first"), "<HIGH>": ("<HIGH>", "max"),
+                          "<LOW>": ("<LOW>", "min"), "<CLOSE>": ("<CLOSE>", "last"),
+                          "<VALUE>": ("<VALUE>", "sum"), "<VOL>": ("<VOL>", "sum"),
+                          "<OPENINT>": ("<OPENINT>", "sum"), "<SESSIONS>": ("<CLOSE>", "size")})
+    bars = bars.reset_index()
+    bars["ticker_id"] = bars["ticker_id"].astype(str)
+    bars["period"] = period
+    return bars[BAR_COLUMNS]
+
+
+def rolling_indicators(df):
+    """
+    Computes daily return, simple moving averages of <CLOSE> and return volatility of a history frame having
+    ticker_id, <DTYYYYMMDD>, <CLOSE> and <OPEN> columns.
+
+    Returns are measured against the reference price (<OPEN>), which tsetmc already adjusts for corporate actions,
+    so they're free of the jumps an adjustment event makes in raw closes.
+
+    :return: DataFrame of INDICATOR_COLUMNS
+    """
+    df = df.sort_values(["ticker_id", "<DTYYYYMMDD>"]).reset_index(drop=True)
+    indicators = df[["ticker_id", "<DTYYYYMMDD>"]].copy()
+    indicators["ticker_id"] = indicators["ticker_id"].astype(str)
+    indicators["<RETURN>"] = (df["<CLOSE>"] / df["<OPEN>"] - 1).astype("float64")
+    by_ticker = df["ticker_id"].to_numpy()
+    for window in SMA_WINDOWS:
+        rolling = df["<CLOSE>"].astype("float64").groupby(by_ticker, sort=False).rolling(window)
+        indicators["<SMA{}>".format(window)] = rolling.mean().reset_index(level=0, drop=True)
+    rolling = indicators["<RETURN>"].groupby(by_ticker, sort=False).rolling(VOLATILITY_WINDOW)
+    indicators["<VOLATILITY{}>".format(VOLATILITY_WINDOW)] = rolling.std().reset_index(level=0, drop=True)
+    return indicators[INDICATOR_COLUMNS]
+
+
+def sector_aggregates(df, sectors):
+    """
+    Computes the daily aggregates of every sector from a history frame having ticker_id, <DTYYYYMMDD> and
+    SECTOR_SOURCE_COLUMNS columns, see sector_sums.
+
+    Returns are measured against the reference price (<OPEN>) like in rolling_indicators. The value weighted return
+    is weighted by each ticker's traded <VALUE> of the day, market capitalizations not being available.
+
+    :param sectors: Series mapping ticker ids to their sector, tickers missing from it are left out
+    :return: DataFrame of SECTOR_COLUMNS, with a row per sector and date on which at least one member traded.
+        <TICKERS> counts the members that traded, <ADVANCES>, <DECLINES> and <UNCHANGED> split them by the sign of
+        their return.
+    """
+    return aggregate_sector_sums(sector_sums(df, sectors))
+
+
+def sector_sums(df, sectors):
+    """
+    Computes the per sector and date sums the sector aggregates are derived from, in one pass over aligned date x
+    ticker matrices: a ticker x sector membership matrix turns every per ticker quantity into per sector sums with a
+    single matrix product. The sums of frames of different tickers add up to those of their union, so that
+    histories can be aggregated a few tickers at a time.
+
+    :return: DataFrame of sector, <DTYYYYMMDD> and SECTOR_SUM_COLUMNS, with a row per sector and date on which at
+        least one member traded
+    """
+    sectors = sectors.dropna()
+    sectors.index = sectors.index.astype(str)
+    df = df.loc[df["ticker_id"].astype(str).isin(sectors.index)]
+    date_codes, dates = pd.factorize(df["<DTYYYYMMDD>"], sort=True)
+    ticker_codes, tickers = pd.factorize(df["ticker_id"].astype(str))
+    sector_codes, sector_names = pd.factorize(sectors.reindex(tickers))
+    membership = np.zeros((len(tickers), len(sector_names)))
+    membership[np.arange(len(tickers)), sector_codes] = 1
+
+    def matrix(column):
+        values = np.full((len(dates), len(tickers)), np.nan)
+        values[date_codes, ticker_codes] = df[column].to_numpy(dtype="float64")
+        return values
+
+    traded = np.zeros((len(dates), len(tickers)))
+    traded[date_codes, ticker_codes] = 1
+    with np.errstate(divide="ignore", invalid="ignore"):
+        returns = matrix("<CLOSE>") / matrix("<OPEN>") - 1
+    valid = np.isfinite(returns)
+    returns = np.where(valid, returns, 0.0)
+    value = np.nan_to_num(matrix("<VALUE>"))
+    sums = {"<VALUE>": value @ membership, "<VOL>": np.nan_to_num(matrix("<VOL>")) @ membership,
+            "<TICKERS>": traded @ membership, "<ADVANCES>": (valid & (returns > 0)) @ membership,
+            "<DECLINES>": (valid & (returns < 0)) @ membership, "<UNCHANGED>": (valid & (returns == 0)) @ membership,
+            "<RETURNS>": returns @ membership, "<VALUE_RETURNS>": (returns * value) @ membership,
+            "<VALID>": valid @ membership, "<VALID_VALUE>": (valid * value) @ membership}
+    for column in ("<VALUE>", "<VOL>", "<TICKERS>", "<ADVANCES>", "<DECLINES>", "<UNCHANGED>", "<VALID>"):
+        sums[column] = sums[column].astype("int64")
+    result = pd.DataFrame({column: values.ravel() for column, values in sums.items()})
+    result.insert(0, "sector", np.tile(np.asarray(sector_names, dtype=object), len(dates)))
+    result.insert(1, "<DTYYYYMMDD>", np.repeat(dates.to_numpy(), len(sector_names)))
+    result = result.loc[result["<TICKERS>"] > 0].reset_index(drop=True)
+    return result[["sector", "<DTYYYYMMDD>"] + SECTOR_SUM_COLUMNS]
+
+
+def aggregate_sector_sums(sums):
+    """
+    Turns sector_sums into the sector aggregates, SECTOR_COLUMNS.
+    """
+    result = sums.copy()
+    with np.errstate(divide="ignore", invalid="ignore"):
+        result["<RETURN_EW>"] = result["<RETURNS>"] / result["<VALID>"]
+        result["<RETURN_VW>"] = result["<VALUE_RETURNS>"] / result["<VALID_VALUE>"]
+    result[["<RETURN_EW>", "<RETURN_VW>"]] = result[["<RETURN_EW>", "<RETURN_VW>"]].replace([np.inf, -np.inf], np.nan)
+    return result[SECTOR_COLUMNS]
+
+
+def tail_start(dates, period):
+    """
+    Returns the start of the period "W" or "M" each of dates falls in.
+    """
+    return dates.dt.to_period(PERIODS[period]).dt.start_time
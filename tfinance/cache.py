@@ -0,0 +1,82 @@
+import sys
+import threading
+from collections import OrderedDict, namedtuple
+
+CacheStats = namedtuple("CacheStats", "hits, misses, evictions, invalidations, size, bytes")
+
+
+def sizeof(value):
+    """
+    Approximate size of value in bytes, exact for DataFrames.
+    """
+    memory_usage = getattr(value, "memory_usage", None)
+    if memory_usage is not None:
+        usage = memory_usage(deep=True)
+        return int(usage.sum() if hasattr(usage, "sum") else usage)
+    return sys.getsizeof(value)
+
+
+class LRUCache:
+    """
+    Thread-safe least recently used cache bounded by number of entries and, optionally, by total bytes.
+
+    :param maxsize: maximum number of entries
+    :param maxbytes: maximum total sizeof() of the values, None for no limit
+    """
+
+    def __init__(self, maxsize=128, maxbytes=None):
+        self.maxsize = maxsize
+        self.maxbytes = maxbytes
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # key -> (value, nbytes)
+        self._bytes = 0
+        self._hits = self._misses = self._evictions = self._invalidations = 0
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self._misses += 1
+                return default
+            self._entries.move_to_end(key)
+            self._hits += 1
+            return entry[0]
+
+    def put(self, key, value):
+        nbytes = sizeof(value) if self.maxbytes is not None else 0
+        if self.maxsize <= 0 or (self.maxbytes is not None and nbytes > self.maxbytes):
+            return
+        with self._lock:
+            if key in self._entries:
+                self._bytes -= self._entries.pop(key)[1]
+            self._entries[key] = (value, nbytes)
+            self._bytes += nbytes
+            while len(self._entries) > self.maxsize or (self.maxbytes is not None and self._bytes > self.maxbytes):
+                _, (_, evicted_bytes) = self._entries.popitem(last=False)
+                self._bytes -= evicted_bytes
+                self._evictions += 1
+
+    def invalidate(self, predicate=None):
+        """
+        Removes the entries whose key satisfies predicate, or all of them if predicate is None.
+        """
+        with self._lock:
+            keys = [key for key in self._entries if predicate is None or predicate(key)]
+            for key in keys:
+                self._bytes -= self._entries.pop(key)[1]
+            self._invalidations += len(keys)
+
+    def clear(self):
+        self.invalidate()
+
+    @property
+    def stats(self):
+        with self._lock:
+            return CacheStats(self._hits, self._misses, self._evictions, self._invalidations,
+                              len(self._entries), self._bytes)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return key in self._entries
@@ -0,0 +1,102 @@
+"""
+Command line interface:
+
+    $ tfinance refresh [--db sqlite:///tse.db] [--interval 3600] [--store sql|parquet|ipc] [--materialize]
+    $ tfinance serve [--db sqlite:///tse.db] [--host 127.0.0.1] [--port 8350] [--refresh-interval 3600]
+
+refresh syncs the database once, or every --interval seconds until interrupted. Other processes can read the
+database meanwhile, each refresh is published atomically (see Market.refresh).
+
+serve answers read requests from a single Market over HTTP (see server), optionally refreshing it every
+--refresh-interval seconds.
+"""
+import argparse
+import logging
+import signal
+import threading
+
+
+def make_market(args):
+    from .market import Market
+    history_store = None
+    if args.store != "sql":
+        from .stores import ArrowHistoryStore
+        history_store = ArrowHistoryStore(args.history, format=args.store)
+    return Market(args.db, history_store=history_store, offline=True, materialize=args.materialize,
+                  progress=args.progress)
+
+
+def refresh(args):
+    market = make_market(args)
+    try:
+        market.refresh()
+        if args.interval is None:
+            return 0
+        stopped = threading.Event()
+        signal.signal(signal.SIGTERM, lambda signum, frame: stopped.set())
+        market.start_auto_refresh(args.interval)
+        try:
+            while not stopped.wait(1):
+                pass
+        except KeyboardInterrupt:
+            pass
+        return 0
+    finally:
+        market.close()
+
+
+def serve(args):
+    from .server import MarketServer
+    market = make_market(args)
+    server = MarketServer(market, (args.host, args.port), default_format=args.format)
+    try:
+        if args.refresh_interval is not None:
+            market.start_auto_refresh(args.refresh_interval)
+        logging.getLogger(__name__).info("Serving {} on {}".format(args.db, server.url))
+        signal.signal(signal.SIGTERM, lambda signum, frame: threading.Thread(target=server.shutdown).start())
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        return 0
+    finally:
+        server.server_close()
+        market.close()
+
+
+def make_parser():
+    parser = argparse.ArgumentParser(prog="tfinance", description="Tehran Stock Exchange OSINT Tool")
+    parser.add_argument("--log-level", default="INFO", help="logging level, e.g. DEBUG or WARNING")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    market_options = argparse.ArgumentParser(add_help=False)
+    market_options.add_argument("--db", default="sqlite:///tse.db", help="SQLAlchemy url of the database")
+    market_options.add_argument("--store", choices=["sql", "parquet", "ipc"], default="sql",
+                                help="where histories are kept, the database or per-ticker columnar files")
+    market_options.add_argument("--history", default="history", help="directory of the columnar history files")
+    market_options.add_argument("--materialize", action="store_true",
+                                help="keep bars, indicators and sector aggregates up to date")
+    market_options.add_argument("--progress", action="store_true", help="show progress bars")
+
+    refresh_parser = commands.add_parser("refresh", parents=[market_options],
+                                         help="sync the local database with the market")
+    refresh_parser.add_argument("--interval", type=float, default=None,
+                                help="keep running and refresh every INTERVAL seconds")
+    refresh_parser.set_defaults(run=refresh)
+
+    serve_parser = commands.add_parser("serve", parents=[market_options],
+                                       help="serve the local database over HTTP")
+    serve_parser.add_argument("--host", default="127.0.0.1", help="address to listen on")
+    serve_parser.add_argument("--port", type=int, default=8350, help="port to listen on")
+    serve_parser.add_argument("--format", choices=["arrow", "parquet", "csv"], default=None,
+                              help="format of requests not asking for one, defaults to arrow if pyarrow is installed")
+    serve_parser.add_argument("--refresh-interval", type=float, default=None,
+                              help="refresh the database every REFRESH_INTERVAL seconds while serving")
+    serve_parser.set_defaults(run=serve)
+    return parser
+
+
+def main(argv=None):
+    args = make_parser().parse_args(argv)
+    logging.basicConfig(level=args.log_level.upper(), format="%(asctime)s %(name)s %(levelname)s %(message)s")
+    return args.run(args)
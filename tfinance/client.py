@@ -0,0 +1,137 @@
+import logging
+
+import requests
+
+from .server import CONTENT_TYPES, decode_frame
+from .symbol_index import SymbolIndex
+
+
+class MarketClient:
+    """
+    Read-only Market backed by a server.MarketServer, so that many processes share one warm Market instead of
+    each opening the database and building the same frames:
+
+        market = MarketClient("http://127.0.0.1:8350")
+        market.fetch_histories(["فولاد", "فملي"], columns=["<CLOSE>"])
+        foolad = tfin.Ticker(source=market, ticker="فولاد")
+
+    Tickers, sectors and the symbol index are fetched once, reload() drops them. Histories aren't cached on this
+    side, the server caches them.
+    """
+
+    def __init__(self, url="http://127.0.0.1:8350", format=None, timeout=60):
+        """
+        :param url: base url of the server
+        :param format: "arrow", "parquet" or "csv" wire format, defaults to "arrow" if pyarrow is installed
+        :param timeout: seconds a request may take
+        """
+        self.logger = logging.getLogger(__name__)
+        self.url = url.rstrip("/")
+        if format is None:
+            try:
+                import pyarrow  # noqa: F401
+                format = "arrow"
+            except ImportError:
+                format = "csv"
+        if format not in CONTENT_TYPES:
+            raise ValueError("format must be one of {}".format(list(CONTENT_TYPES)))
+        self.format = format
+        self.timeout = timeout
+        self.session = requests.Session()
+        self.__tickers = None
+        self.__sectors = None
+        self.__symbol_index = None
+
+    def close(self):
+        self.session.close()
+
+    def reload(self):
+        """
+        Drops the fetched tickers, sectors and symbol index, e.g. after the server's Market refreshed.
+        """
+        self.__tickers = None
+        self.__sectors = None
+        self.__symbol_index = None
+
+    def get(self, path, **params):
+        """
+        Requests path with params, None values being left out and lists joined with commas, and decodes the frame
+        it answers. Raises KeyError on 404 and ValueError on 400 like the Market methods behind them.
+        """
+        query = {"format": self.format}
+        for name, value in params.items():
+            if value is None or value is False:
+                continue
+            if isinstance(value, (list, tuple)):
+                value = ",".join(str(getattr(item, "id", item)) for item in value)
+            query[name] = "1" if value is True else str(value)
+        response = self.session.get(self.url + path, params=query, timeout=self.timeout)
+        if response.status_code == 404:
+            raise KeyError(response.text)
+        if response.status_code == 400:
+            raise ValueError(response.text)
+        response.raise_for_status()
+        return decode_frame(response.content, self.format)
+
+    def info(self):
+        """
+        Returns the version, generation and last refresh of the server's Market.
+        """
+        response = self.session.get(self.url + "/info", timeout=self.timeout)
+        response.raise_for_status()
+        return response.json()
+
+    def fetch_tickers(self, **kwargs):
+        return self.get("/tickers")
+
+    def fetch_sectors(self):
+        return self.get("/sectors")
+
+    def fetch_history(self, **kwargs):
+        id = self.symbol_index.lookup(**kwargs)["id"]
+        return self.get("/ticker_history", id=id)
+
+    def fetch_adjusted_history(self, **kwargs):
+        """
+        Same as fetch_history, with prices adjusted for corporate actions and the applied factor in <ADJ>.
+        """
+        id = self.symbol_index.lookup(**kwargs)["id"]
+        return self.get("/ticker_history", id=id, adjusted=True)
+
+    def fetch_adjustments(self, tickers=None):
+        return self.get("/adjustments", tickers=None if tickers is None else list(tickers))
+
+    def fetch_histories(self, tickers, start=None, end=None, columns=None, wide=False, adjusted=False):
+        """
+        See Market.fetch_histories.
+        """
+        histories = self.get("/history", tickers=list(tickers), start=start, end=end, columns=columns,
+                             adjusted=adjusted)
+        histories = histories.set_index(["<DTYYYYMMDD>", "ticker_id"])
+        if wide:
+            histories = histories.unstack("ticker_id")
+        return histories
+
+    def snapshot(self, date=None, columns=None):
+        """
+        See Market.snapshot.
+        """
+        return self.get("/snapshot", date=date, columns=columns).set_index("ticker_id")
+
+    @property
+    def tickers(self):
+        if self.__tickers is None:
+            self.__tickers = self.fetch_tickers()
+        return self.__tickers
+
+    @property
+    def symbol_index(self):
+        if self.__symbol_index is None:
+            self.__symbol_index = SymbolIndex(self.tickers)
+        return self.__symbol_index
+
+    @property
+    def sectors(self):
+        if self.__sectors is None:
+            self.__sectors = self.fetch_sectors()
+        return self.__sectors
@@ -0,0 +1,51 @@
+import pandas as pd
+
+PRICE_COLUMNS = ["<FIRST>", "<HIGH>", "<LOW>", "<CLOSE>", "<OPEN>", "<LAST>"]
+COUNT_COLUMNS = ["<VALUE>", "<VOL>", "<OPENINT>"]
+CATEGORY_COLUMNS = ["ticker_id", "<TICKER>"]
+# Columns holding the same value on every row of an Export-txt csv
+CONSTANT_COLUMNS = ["<PER>"]
+
+
+def typed_history(df):
+    """
+    Returns df with dtypes that depend on its columns only, not on its values: float64 prices, nullable Int64 counts
+    and datetime64 dates. Chunks of a streamed read are typed alike whatever rows they hold, e.g. all missing.
+    """
+    df = df.copy(deep=False)
+    for column in df.columns:
+        if column in PRICE_COLUMNS:
+            df[column] = df[column].astype("float64")
+        elif column in COUNT_COLUMNS:
+            df[column] = df[column].astype("Int64")
+        elif column == "<DTYYYYMMDD>" and not pd.api.types.is_datetime64_any_dtype(df[column]):
+            df[column] = pd.to_datetime(df[column])
+    return df
+
+
+def compact_history(df, price_dtype="float32", drop_constant=True):
+    """
+    Returns df with a memory-lean representation of the history columns it has.
+
+    :param df: history frame, as returned by the history stores
+    :param price_dtype: dtype of the price columns, "float32" or an integer dtype such as "int32" (prices are
+        integral rials). Price columns having missing values stay float32 when an integer dtype is asked for.
+    :param drop_constant: drops CONSTANT_COLUMNS holding a single value
+    """
+    df = df.copy(deep=False)
+    integral_prices = pd.api.types.is_integer_dtype(pd.Series(dtype=price_dtype))
+    for column in df.columns:
+        values = df[column]
+        if column in CATEGORY_COLUMNS:
+            df[column] = values.astype("category")
+        elif column in PRICE_COLUMNS:
+            dtype = "float32" if integral_prices and values.isna().any() else price_dtype
+            df[column] = values.astype(dtype)
+        elif column in COUNT_COLUMNS:
+            df[column] = values.astype("Int64" if values.isna().any() else "int64")
+        elif column == "<DTYYYYMMDD>" and not pd.api.types.is_datetime64_any_dtype(values):
+            df[column] = pd.to_datetime(values)
+    if drop_constant:
+        constant = [c for c in CONSTANT_COLUMNS if c in df.columns and df[c].nunique(dropna=False) <= 1]
+        df = df.drop(columns=constant)
+    return df
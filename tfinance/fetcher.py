@@ -0,0 +1,156 @@
+import concurrent.futures
+import itertools
+import logging
+import random
+import threading
+import time
+from collections import namedtuple
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from .abc.base_fetcher import BaseFetcher
+from .metrics import Metrics
+
+FetchResult = namedtuple("FetchResult", "key, url, response, error, attempts")
+
+
+class FetchError(Exception):
+    """
+    Raised when a url can't be fetched after all retries.
+    """
+
+    def __init__(self, url, reason, attempts):
+        super().__init__("Fetching {} failed after {} attempt(s): {}".format(url, attempts, reason))
+        self.url = url
+        self.reason = reason
+        self.attempts = attempts
+
+
+class RateLimiter:
+    """
+    Spaces out requests to the same host so that at most `rate` of them start per second.
+    """
+
+    def __init__(self, rate=None):
+        self.interval = 1.0 / rate if rate else 0.0
+        self._lock = threading.Lock()
+        self._next_slot = {}
+
+    def wait(self, host):
+        if not self.interval:
+            return
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next_slot.get(host, now))
+            self._next_slot[host] = slot + self.interval
+        if slot > now:
+            time.sleep(slot - now)
+
+
+class Fetcher(BaseFetcher):
+    """
+    Pooled HTTP fetcher with bounded concurrency, per host rate limiting and exponential backoff.
+
+    :param max_workers: maximum number of concurrent requests
+    :param rate_limit: maximum number of requests started per second and per host, None disables it
+    :param retries: number of retries after the first attempt
+    :param backoff_factor: first retry waits backoff_factor seconds, doubling on every further retry
+    :param max_backoff: upper bound of a single backoff in seconds
+    :param timeout: requests' (connect, read) timeout in seconds
+    :param metrics: metrics.Metrics recording requests, retries, errors, bytes and per url latency
+    """
+
+    RETRY_STATUSES = frozenset({429, 500, 502, 503, 504})
+
+    def __init__(self, max_workers=8, rate_limit=10.0, retries=4, backoff_factor=0.5, max_backoff=30.0,
+                 timeout=(10, 60), session=None, metrics=None):
+        self.logger = logging.getLogger(__name__)
+        self.metrics = metrics if metrics is not None else Metrics()
+        self.max_workers = max_workers
+        self.retries = retries
+        self.backoff_factor = backoff_factor
+        self.max_backoff = max_backoff
+        self.timeout = timeout
+        self.rate_limiter = RateLimiter(rate_limit)
+        if session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=max_workers, pool_maxsize=max_workers)
+            session.mount("http://", adapter)
+            session.mount("https://", adapter)
+        self.session = session
+
+    def get(self, url, headers=None):
+        response, _ = self._get(url, headers)
+        return response
+
+    def iter_fetch(self, urls, headers=None):
+        """
+        Fetches a {key: url} mapping with at most max_workers requests in flight, yielding a FetchResult per url
+        as soon as it completes. Failed urls are yielded with their error instead of being raised.
+
+        :param headers: {key: headers} of extra request headers, e.g. conditional ones, for some of the keys
+        """
+        headers = headers or {}
+        items = iter(urls.items())
+        with concurrent.futures.ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            pending = set()
+
+            def submit(n):
+                for key, url in itertools.islice(items, n):
+                    pending.add(executor.submit(self._fetch_result, key, url, headers.get(key)))
+
+            submit(self.max_workers)
+            while pending:
+                done, _ = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+                pending.difference_update(done)
+                submit(len(done))
+                for future in done:
+                    yield future.result()
+
+    def _fetch_result(self, key, url, headers=None):
+        try:
+            response, attempts = self._get(url, headers)
+            return FetchResult(key, url, response, None, attempts)
+        except FetchError as e:
+            return FetchResult(key, url, None, e, e.attempts)
+
+    def _get(self, url, headers=None):
+        host = urlsplit(url).netloc
+        attempt = 0
+        start = time.perf_counter()
+        while True:
+            attempt += 1
+            self.rate_limiter.wait(host)
+            retry_after = None
+            self.metrics.inc("fetch_requests_total")
+            try:
+                response = self.session.get(url, headers=headers, timeout=self.timeout)
+            except (requests.Timeout, requests.ConnectionError) as e:
+                reason = e
+            else:
+                if response.status_code not in self.RETRY_STATUSES:
+                    try:
+                        response.raise_for_status()
+                    except requests.HTTPError as e:
+                        self.metrics.inc("fetch_errors_total")
+                        raise FetchError(url, e, attempt)
+                    self.metrics.inc("fetch_bytes_total", len(response.content))
+                    self.metrics.observe("fetch_seconds", time.perf_counter() - start)
+                    return response, attempt
+                reason = "HTTP {}".format(response.status_code)
+                retry_after = response.headers.get("Retry-After")
+            if attempt > self.retries:
+                self.metrics.inc("fetch_errors_total")
+                raise FetchError(url, reason, attempt)
+            self.metrics.inc("fetch_retries_total")
+            delay = self.backoff(attempt, retry_after)
+            self.logger.info("Retrying {} in {:.2f}s ({})...".format(url, delay, reason))
+            time.sleep(delay)
+
+    def backoff(self, attempt, retry_after=None):
+        if retry_after is not None and retry_after.isdigit():
+            return min(float(retry_after), self.max_backoff)
+        delay = self.backoff_factor * 2 ** (attempt - 1)
+        return min(delay * random.uniform(0.5, 1.0), self.max_backoff)
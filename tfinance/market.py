@@ -1,64 +1,554 @@
+import datetime
 import logging
+import threading
+import time
 
 import pandas as pd
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy import create_engine, select
+from sqlalchemy.orm import scoped_session, sessionmaker
 
-from . import models
-from .models import TickerModel, SectorModel
-from .meta.singleton_meta import SingletonMeta
+from .cache import LRUCache
+from .metrics import Metrics
+from .dtypes import compact_history
+from .adjustment import adjust_history
+from .aggregates import INDICATOR_COLUMNS, PERIODS, SECTOR_COLUMNS
+from .models import TickerModel, SectorModel, AdjustmentModel, BarModel, IndicatorModel, LatestBarModel, \
+    SectorAggregateModel, GenerationModel, legacy_history_tables, read_generation
+from .meta.multiton_meta import MultitonMeta
+from .stores import SQLHistoryStore
+from .symbol_index import SymbolIndex
 
 
-from .tse_scrapper import TSEScrapper
+class Market(metaclass=MultitonMeta):
+    """
+    Local mirror of the market. There's one Market per connection string: Market(url) returns the existing
+    instance of url if any (ignoring the other arguments), so that independent databases can be used side by side
+    while every caller of the same database shares its engine, cache and scrapper. close() releases it.
 
+    Thread safety: a Market can be shared by the threads of e.g. a web app. Reads check out a pooled connection for
+    the duration of a query and return it; scrapper writes go through their own short transactions, so reads run
+    concurrently with a sync (SQLite databases are switched to WAL). refresh() publishes atomically: it writes in a
+    single transaction, so readers keep seeing the previous complete dataset until it commits, then the tickers,
+    sectors and cached frames are swapped for the new generation's. Syncs are serialized, and lazily loaded attributes
+    are created once. `session` is a thread-local session.
 
-class Market(metaclass=SingletonMeta):
+    Markets of other processes on the same database, e.g. readers of a `tfinance refresh --interval` process, see
+    its refreshes too: published writes bump a generation stored in the database, which Markets check before
+    serving cached frames (see check_generation).
+    """
 
-    def __init__(self, connection_arguments="sqlite:///tse.db", Scrapper=TSEScrapper):
+    KEY_ARGUMENT = "connection_arguments"
+
+    def __init__(self, connection_arguments="sqlite:///tse.db", Scrapper=None, history_store=None, offline=False,
+                 cache_size=256, cache_bytes=512 * 2 ** 20, compact=False, materialize=False, metrics=None,
+                 progress=False, check_interval=1.0):
+        """
+        :param connection_arguments: SQLAlchemy url of the database holding tickers and sectors
+        :param Scrapper: BaseScrapper class filling the database, defaults to TSEScrapper
+        :param history_store: BaseHistoryStore holding ticker histories, defaults to the ticker_history table of
+            the database. Pass e.g. stores.ArrowHistoryStore("history", format="ipc") for columnar storage.
+        :param offline: if True, opens the existing database without updating it from the market. Histories of
+            databases written before the ticker_history table are still migrated to the history store.
+        :param cache_size: maximum number of ticker and history frames kept in the LRU cache, 0 disables it
+        :param cache_bytes: maximum total memory of the cached frames, None for no limit
+        :param compact: if True, histories are returned with compact dtypes (see dtypes.compact_history): categorical
+            tickers, float32 prices, int64 counts and no constant <PER> column
+        :param materialize: if True, the scrapper keeps weekly/monthly bars, rolling indicators and sector
+            aggregates up to date for fetch_bars, fetch_indicators and fetch_sector_aggregates
+        :param metrics: metrics.Metrics shared with the scrapper, recording sync and read timings and cache hits
+        :param progress: if True, updates show tqdm progress bars
+        :param check_interval: seconds between two checks of the database's generation for writes published by
+            other processes, 0 checks it before every read
+        """
         self.logger = logging.getLogger(__name__)
-        # Creating database session
+        self.connection_arguments = connection_arguments
+        # Pooled engine, and a registry of thread-local sessions on it
         self.engine = create_engine(connection_arguments)
-        Session = sessionmaker(bind=self.engine)
-        self.session = Session()
-        # Calling Scrapper
-        self.scrapper = Scrapper(self.session)
-        self.scrapper.update()
-        # Initializing instance attributes
-        self.__tickers = self.fetch_tickers()
-        self.__sectors = self.fetch_sectors()
+        self.Session = scoped_session(sessionmaker(bind=self.engine))
+        self.history_store = history_store if history_store is not None else SQLHistoryStore(self.engine)
+        self.Scrapper = Scrapper
+        self.compact = compact
+        self.materialize = materialize
+        self.metrics = metrics if metrics is not None else Metrics()
+        self.progress = progress
+        # Cache of fetched frames, invalidated when this Market's scrapper writes or another process publishes writes
+        self.cache = LRUCache(maxsize=cache_size, maxbytes=cache_bytes)
+        # Scrapper, tickers, sectors and symbol index are created on first access
+        self.__scrapper = None
+        self.__tickers = None
+        self.__sectors = None
+        self.__symbol_index = None
+        # Guards the lazy attributes, and serializes syncs
+        self._lock = threading.RLock()
+        self._sync_lock = threading.Lock()
+        # Incremented whenever the scrapper publishes writes, frames loaded from an older generation aren't cached
+        self.generation = 0
+        self.last_refresh = None
+        self._auto_refresh = None
+        # Generation of the database the cached frames are from, and when it was last checked
+        GenerationModel.__table__.create(bind=self.engine, checkfirst=True)
+        self.check_interval = check_interval
+        self.published_generation = self.fetch_generation()
+        self._generation_checked = time.monotonic()
+        if not offline:
+            with self._sync_lock:
+                self.scrapper.update()
+        elif legacy_history_tables(self.engine):
+            # Databases written before the ticker_history table, update() migrates them otherwise
+            self.migrate_history()
+
+    @property
+    def session(self):
+        return self.Session()
+
+    def close(self):
+        """
+        Stops auto-refreshing, releases the pooled connections and forgets this instance, Market(connection_arguments)
+        creates a new one.
+        """
+        self.stop_auto_refresh()
+        type(self).forget(self)
+        self.Session.remove()
+        self.engine.dispose()
+
+    def refresh(self):
+        """
+        Incrementally syncs the local database with the market in one transaction (see TSEScrapper.transaction),
+        then starts a new generation: tickers and sectors are reloaded on next access and the cache is cleared.
+        """
+        with self._sync_lock:
+            self.scrapper.update(incremental=True, atomic=True)
+            self.publish(self.fetch_generation())
+            self.last_refresh = datetime.datetime.now()
+
+    def publish(self, published_generation):
+        """
+        Starts a new generation of this Market, from the database at published_generation: tickers and sectors are
+        reloaded on next access and the cache is cleared.
+        """
+        with self._lock:
+            self.__tickers = None
+            self.__sectors = None
+            self.__symbol_index = None
+            self.generation += 1
+            self.published_generation = published_generation
+        self.cache.clear()
+
+    def fetch_generation(self):
+        """
+        Returns the generation of the database, bumped by every write published to it (see models.GenerationModel).
+        """
+        with self.engine.connect() as connection:
+            return read_generation(connection)
+
+    def check_generation(self):
+        """
+        Starts a new generation (see publish) if writes were published to the database since this Market's cached
+        frames were loaded, e.g. by the refresh of another process. Checks the database at most every
+        check_interval seconds.
+        """
+        now = time.monotonic()
+        if now - self._generation_checked < self.check_interval:
+            return
+        self._generation_checked = now
+        published_generation = self.fetch_generation()
+        if published_generation != self.published_generation:
+            self.logger.info("Database at generation {}, dropping cached frames...".format(published_generation))
+            self.publish(published_generation)
+
+    def migrate_history(self):
+        """
+        Moves the histories of the legacy one-table-per-ticker layout into the history store with the scrapper's
+        migrate_history, raising if the scrapper can't migrate them.
+        """
+        if not hasattr(self.scrapper, "migrate_history"):
+            raise RuntimeError("{} holds legacy per ticker history tables that {} can't migrate, open it with "
+                               "TSEScrapper first".format(self.connection_arguments, type(self.scrapper).__name__))
+        with self._sync_lock:
+            self.scrapper.migrate_history()
+
+    def start_auto_refresh(self, interval, on_error=None):
+        """
+        Refreshes every interval seconds in a daemon thread until stop_auto_refresh() or close(). Readers aren't
+        blocked meanwhile and see each refresh at once, when it's published.
+
+        :param interval: seconds between the starts of two refreshes, a refresh running longer delays the next one
+        :param on_error: called with the exception of a failed refresh, which is logged and retried next interval
+        """
+        with self._lock:
+            if self._auto_refresh is not None:
+                raise RuntimeError("Auto-refresh is already running")
+            stop = threading.Event()
+            thread = threading.Thread(target=self._auto_refresh_loop, args=(interval, stop, on_error),
+                                      name="tfinance-auto-refresh", daemon=True)
+            self._auto_refresh = (thread, stop)
+        thread.start()
+
+    def stop_auto_refresh(self, wait=True):
+        """
+        Stops auto-refreshing, waiting for a running refresh to finish if wait.
+        """
+        with self._lock:
+            if self._auto_refresh is None:
+                return
+            thread, stop = self._auto_refresh
+            self._auto_refresh = None
+        stop.set()
+        if wait and thread is not threading.current_thread():
+            thread.join()
+
+    def _auto_refresh_loop(self, interval, stop, on_error):
+        next_run = time.monotonic() + interval
+        while not stop.wait(max(next_run - time.monotonic(), 0)):
+            next_run = max(next_run + interval, time.monotonic())
+            self.logger.info("Auto-refreshing market...")
+            try:
+                self.refresh()
+            except Exception as e:
+                self.logger.exception("Auto-refresh failed: {}".format(e))
+                self.metrics.inc("refresh_failures_total")
+                if on_error is not None:
+                    on_error(e)
+
+    @property
+    def scrapper(self):
+        with self._lock:
+            if self.__scrapper is None:
+                if self.Scrapper is None:
+                    from .tse_scrapper import TSEScrapper
+                    self.Scrapper = TSEScrapper
+                self.__scrapper = self.Scrapper(self.session, store=self.history_store,
+                                                materialize=self.materialize, metrics=self.metrics,
+                                                progress=self.progress)
+                self.__scrapper.add_write_listener(self.on_write)
+            return self.__scrapper
+
+    def on_write(self, kind, ticker_ids=None):
+        """
+        Drops the cached frames made stale by a scrapper write.
+        """
+        published_generation = self.scrapper.generation
+        with self._lock:
+            self.generation += 1
+            # The database is at the scrapper's generation, unless another process published writes meanwhile
+            if published_generation is not None and \
+                    published_generation - self.published_generation in (0, 1):
+                self.published_generation = published_generation
+        if kind == "history":
+            # Adjustments are written with histories, so this covers adjusted frames too
+            ticker_ids = set(ticker_ids or ())
+            self.cache.invalidate(lambda key: key[0] in ("snapshot", "sector_aggregates") or
+                                  key[0] == "history" and not ticker_ids.isdisjoint(key[1]))
+        else:
+            with self._lock:
+                if kind == "tickers":
+                    self.__tickers = None
+                    self.__symbol_index = None
+                elif kind == "sectors":
+                    self.__sectors = None
+            self.cache.invalidate(lambda key: key[0] == kind)
+
+    def cached(self, key, load):
+        """
+        Returns a copy of the cached value of key, calling load() to fill the cache on a miss.
+        """
+        self.check_generation()
+        value = self.cache.get(key)
+        if value is None:
+            self.metrics.inc("cache_misses_total")
+            generation = self.generation
+            with self.metrics.phase("read"):
+                value = load()
+            # A write published during the load may have made it stale
+            if generation == self.generation:
+                self.cache.put(key, value)
+        else:
+            self.metrics.inc("cache_hits_total")
+        return value.copy()
+
+    @property
+    def cache_stats(self):
+        return self.cache.stats
+
+    def read_sql(self, sql):
+        """
+        Runs a select on a pooled connection, returned as soon as the rows are read, into a DataFrame.
+        """
+        with self.engine.connect() as connection:
+            result = connection.execute(sql)
+            return pd.DataFrame(result.all(), columns=list(result.keys()))
 
     def fetch_tickers(self, **kwargs):
         self.logger.info("Fetching df_tickers_list from database...")
-        sql = self.session.query(TickerModel).statement
-        tickers = pd.DataFrame(self.session.bind.connect().execute(sql))
+        tickers = self.read_sql(select(TickerModel.__table__))
         return tickers
 
     def fetch_tickers_filter_by(self, **kwargs):
+        key = ("tickers", tuple(sorted(kwargs.items())))
+        return self.cached(key, lambda: self._fetch_tickers_filter_by(**kwargs))
+
+    def _fetch_tickers_filter_by(self, **kwargs):
         self.logger.info("Fetching tickers from database...")
-        sql = self.session.query(TickerModel).filter_by(**kwargs).statement
-        tickers = pd.DataFrame(self.session.bind.connect().execute(sql))
+        tickers = self.read_sql(select(TickerModel.__table__).filter_by(**kwargs))
         return tickers
 
 
     def fetch_sectors(self):
         self.logger.info("Fetching df_sectors_list from database...")
-        sql = self.session.query(SectorModel).statement
-        sectors = pd.DataFrame(self.session.bind.connect().execute(sql))
+        sectors = self.read_sql(select(SectorModel.__table__))
         return sectors
 
     def fetch_history(self, **kwargs):
+        id = self.symbol_index.lookup(**kwargs)["id"]
+        return self.cached(("history", (id,)), lambda: self._fetch_history(id))
+
+    def fetch_adjusted_history(self, **kwargs):
+        """
+        Same as fetch_history, with prices adjusted for corporate actions and the applied factor in <ADJ>.
+        """
+        id = self.symbol_index.lookup(**kwargs)["id"]
+        return self.cached(("history", (id,), "adjusted"), lambda: self._fetch_history(id, adjusted=True))
+
+    def _fetch_history(self, id, adjusted=False):
         self.logger.info("Fetching ticker history from database...")
-        id = self.session.query(TickerModel).filter_by(**kwargs).first().id
-        cls = models.create_ticker_history_model(id)
-        sql = self.session.query(cls).statement
-        ticker_history = pd.DataFrame(self.session.bind.connect().execute(sql))
-        ticker_history[["<DTYYYYMMDD>"]] = ticker_history[["<DTYYYYMMDD>"]].apply(pd.to_datetime)
-        return ticker_history
+        ticker_history = self.history_store.read([id])
+        if adjusted:
+            ticker_history = adjust_history(ticker_history, self.fetch_adjustments([id]))
+        ticker_history = ticker_history.drop(columns="ticker_id")
+        if self.compact:
+            ticker_history = compact_history(ticker_history)
+        return ticker_history.iloc[::-1].reset_index(drop=True)
+
+    def fetch_adjustments(self, tickers=None):
+        """
+        Returns the stored adjustment events (ticker_id, <DTYYYYMMDD>, factor) of tickers, or of all tickers.
+        """
+        table = AdjustmentModel.__table__
+        table.create(bind=self.engine, checkfirst=True)
+        sql = select(table)
+        if tickers is not None:
+            sql = sql.where(table.c.ticker_id.in_(self.resolve_ids(tickers)))
+        events = self.read_sql(sql)
+        events["<DTYYYYMMDD>"] = pd.to_datetime(events["<DTYYYYMMDD>"])
+        return events
+
+    def fetch_histories(self, tickers, start=None, end=None, columns=None, wide=False, adjusted=False):
+        """
+        Loads the histories of many tickers in one pass over the history store.
+
+        :param tickers: ticker ids, ticker symbols or Ticker instances
+        :param start: first <DTYYYYMMDD> to load (inclusive)
+        :param end: last <DTYYYYMMDD> to load (inclusive)
+        :param columns: history columns to load, e.g. ["<CLOSE>", "<VOL>"], defaults to all of them
+        :param wide: if True, returns a date x (column, ticker_id) frame instead of a (date, ticker_id) indexed one
+        :param adjusted: if True, prices are adjusted for corporate actions and the applied factor is added as <ADJ>
+        :return: DataFrame indexed by (<DTYYYYMMDD>, ticker_id)
+        """
+        ids = tuple(self.resolve_ids(tickers))
+        start = None if start is None else pd.Timestamp(start)
+        end = None if end is None else pd.Timestamp(end)
+        key = ("history", ids, start, end, None if columns is None else tuple(columns), wide, adjusted)
+        return self.cached(key, lambda: self._fetch_histories(ids, start, end, columns, wide, adjusted))
+
+    def _fetch_histories(self, ids, start, end, columns, wide, adjusted):
+        self.logger.info("Fetching ticker histories from history store...")
+        histories = self.history_store.read(ids, start=start, end=end, columns=columns)
+        if adjusted:
+            histories = adjust_history(histories, self.fetch_adjustments(ids))
+        if self.compact:
+            histories = compact_history(histories)
+        histories = histories.set_index(["<DTYYYYMMDD>", "ticker_id"]).sort_index()
+        if wide:
+            histories = histories.unstack("ticker_id")
+        return histories
+
+    def iter_history(self, tickers=None, chunksize=100000, start=None, end=None, columns=None, adjusted=False):
+        """
+        Streams histories straight from the history store, in frames of at most chunksize rows, so that memory stays
+        flat however many tickers are read. Nothing is cached, and compact doesn't apply: chunks have the dtypes of
+        dtypes.typed_history, the same in every chunk.
+
+        :param tickers: ticker ids, ticker symbols or Ticker instances, None for every stored ticker
+        :param chunksize: maximum number of rows of a chunk
+        :param start: first <DTYYYYMMDD> to load (inclusive)
+        :param end: last <DTYYYYMMDD> to load (inclusive)
+        :param columns: history columns to load, e.g. ["<CLOSE>", "<VOL>"], defaults to all of them
+        :param adjusted: if True, prices are adjusted for corporate actions and the applied factor is added as <ADJ>
+        :return: iterator of DataFrames with ticker_id, <DTYYYYMMDD> and columns, ordered by ticker_id and
+            <DTYYYYMMDD>. A ticker's rows may span consecutive chunks.
+        """
+        ids = None if tickers is None else self.resolve_ids(tickers)
+        columns = self.history_store.check_columns(columns)
+        events = self.fetch_adjustments(ids) if adjusted else None
+        return self._iter_history(ids, chunksize, start, end, columns, events)
+
+    def _iter_history(self, ids, chunksize, start, end, columns, events):
+        self.logger.info("Streaming ticker histories from history store...")
+        for chunk in self.history_store.iter_read(ids, start=start, end=end, columns=columns, chunksize=chunksize):
+            if events is not None:
+                chunk = adjust_history(chunk, events)
+            yield chunk
+
+    def iter_all_histories(self, chunksize=100000, start=None, end=None, columns=None, adjusted=False):
+        """
+        Streams the histories of every stored ticker, see iter_history.
+        """
+        return self.iter_history(None, chunksize, start=start, end=end, columns=columns, adjusted=adjusted)
+
+    def fetch_bars(self, tickers, period="W", start=None, end=None):
+        """
+        Loads materialized weekly or monthly bars, see TSEScrapper's materialize option.
+
+        :param tickers: ticker ids, ticker symbols or Ticker instances
+        :param period: "W" for weeks ending on Wednesday or "M" for calendar months
+        :param start: first period end to load (inclusive)
+        :param end: last period end to load (inclusive)
+        :return: DataFrame indexed by (<DTYYYYMMDD>, ticker_id), <DTYYYYMMDD> being the end of the period
+        """
+        if period not in PERIODS:
+            raise ValueError("Unknown period {!r}, expected one of {}".format(period, list(PERIODS)))
+        ids = tuple(self.resolve_ids(tickers))
+        start = None if start is None else pd.Timestamp(start)
+        end = None if end is None else pd.Timestamp(end)
+        table = BarModel.__table__
+        key = ("history", ids, "bars", period, start, end)
+        return self.cached(key, lambda: self._fetch_aggregates(table, ids, start, end, table.c.period == period)
+                           .drop(columns="period"))
+
+    def fetch_indicators(self, tickers, start=None, end=None, columns=None):
+        """
+        Loads materialized daily returns, moving averages and volatility, see aggregates.rolling_indicators.
+
+        :param tickers: ticker ids, ticker symbols or Ticker instances
+        :param columns: indicator columns to load, e.g. ["<SMA20>"], defaults to all of them
+        :return: DataFrame indexed by (<DTYYYYMMDD>, ticker_id)
+        """
+        ids = tuple(self.resolve_ids(tickers))
+        start = None if start is None else pd.Timestamp(start)
+        end = None if end is None else pd.Timestamp(end)
+        table = IndicatorModel.__table__
+        if columns is not None:
+            unknown = set(columns) - set(INDICATOR_COLUMNS[2:])
+            if unknown:
+                raise ValueError("Unknown indicator columns: {}".format(sorted(unknown)))
+            columns = tuple(columns)
+        key = ("history", ids, "indicators", start, end, columns)
+        return self.cached(key, lambda: self._fetch_aggregates(table, ids, start, end, columns=columns))
+
+    def fetch_sector_aggregates(self, sectors=None, start=None, end=None, columns=None):
+        """
+        Loads materialized daily sector aggregates: traded value and volume, equal and value weighted returns and
+        advance/decline counts of the sectors' tickers, see aggregates.sector_aggregates.
+
+        :param sectors: sector names as in the sector column of tickers, defaults to all of them
+        :param start: first <DTYYYYMMDD> to load (inclusive)
+        :param end: last <DTYYYYMMDD> to load (inclusive)
+        :param columns: aggregate columns to load, e.g. ["<RETURN_VW>"], defaults to all of them
+        :return: DataFrame indexed by (<DTYYYYMMDD>, sector)
+        """
+        sectors = None if sectors is None else tuple(sectors)
+        start = None if start is None else pd.Timestamp(start)
+        end = None if end is None else pd.Timestamp(end)
+        if columns is not None:
+            unknown = set(columns) - set(SECTOR_COLUMNS[2:])
+            if unknown:
+                raise ValueError("Unknown sector aggregate columns: {}".format(sorted(unknown)))
+            columns = tuple(columns)
+        key = ("sector_aggregates", sectors, start, end, columns)
+        return self.cached(key, lambda: self._fetch_sector_aggregates(sectors, start, end, columns))
+
+    def _fetch_sector_aggregates(self, sectors, start, end, columns):
+        self.logger.info("Fetching sector aggregates from database...")
+        table = SectorAggregateModel.__table__
+        table.create(bind=self.engine, checkfirst=True)
+        date = table.c["<DTYYYYMMDD>"]
+        sql = select(*[c for c in table.c if columns is None or c.primary_key or c.name in columns])
+        if sectors is not None:
+            sql = sql.where(table.c.sector.in_(sectors))
+        if start is not None:
+            sql = sql.where(date >= start.to_pydatetime())
+        if end is not None:
+            sql = sql.where(date <= end.to_pydatetime())
+        df = self.read_sql(sql)
+        df["<DTYYYYMMDD>"] = pd.to_datetime(df["<DTYYYYMMDD>"])
+        return df.set_index(["<DTYYYYMMDD>", "sector"]).sort_index()
+
+    def _fetch_aggregates(self, table, ids, start, end, *where, columns=None):
+        self.logger.info("Fetching {} from database...".format(table.name))
+        table.create(bind=self.engine, checkfirst=True)
+        date = table.c["<DTYYYYMMDD>"]
+        selected = [c for c in table.c if columns is None or c.primary_key or c.name in columns]
+        sql = select(*selected).where(table.c.ticker_id.in_(ids), *where)
+        if start is not None:
+            sql = sql.where(date >= start.to_pydatetime())
+        if end is not None:
+            sql = sql.where(date <= end.to_pydatetime())
+        df = self.read_sql(sql)
+        df["<DTYYYYMMDD>"] = pd.to_datetime(df["<DTYYYYMMDD>"])
+        return df.set_index(["<DTYYYYMMDD>", "ticker_id"]).sort_index()
+
+    def snapshot(self, date=None, columns=None):
+        """
+        Returns one row per ticker: its last stored session, or its session of date. Reads the latest_bars table
+        maintained by the scrapper in the first case, and the history store's rows of that single date otherwise,
+        so it costs O(tickers) rather than O(history).
+
+        :param date: <DTYYYYMMDD> of the cross-section, None for the latest bar of every ticker. Tickers that had no
+            session on date are left out.
+        :param columns: history columns to return, e.g. ["<CLOSE>", "<VOL>"], defaults to all of them
+        :return: DataFrame indexed by ticker_id, joinable with tickers.set_index("id"), with a <DTYYYYMMDD> column
+        """
+        columns = self.history_store.check_columns(columns)
+        date = None if date is None else pd.Timestamp(date)
+        return self.cached(("snapshot", date, tuple(columns)), lambda: self._snapshot(date, columns))
+
+    def _snapshot(self, date, columns):
+        self.logger.info("Fetching market snapshot...")
+        if date is None:
+            table = LatestBarModel.__table__
+            table.create(bind=self.engine, checkfirst=True)
+            snapshot = self.read_sql(select(table.c.ticker_id, table.c["<DTYYYYMMDD>"],
+                                            *[table.c[c] for c in columns]))
+            snapshot["<DTYYYYMMDD>"] = pd.to_datetime(snapshot["<DTYYYYMMDD>"])
+        else:
+            snapshot = self.history_store.read(start=date, end=date, columns=columns)
+        if self.compact:
+            snapshot = compact_history(snapshot)
+        return snapshot.set_index("ticker_id").sort_index()
+
+    def resolve_ids(self, tickers):
+        """
+        Maps ticker ids, ticker symbols or Ticker instances to ticker ids.
+        """
+        ids = []
+        for ticker in tickers:
+            ticker = str(getattr(ticker, "id", ticker))
+            if ticker in self.symbol_index:
+                ids.append(ticker)
+            else:
+                ids.append(self.symbol_index.lookup(ticker=ticker)["id"])
+        return ids
 
     @property
     def tickers(self):
-        return self.__tickers
+        self.check_generation()
+        with self._lock:
+            if self.__tickers is None:
+                self.__tickers = self.fetch_tickers()
+            return self.__tickers
+
+    @property
+    def symbol_index(self):
+        self.check_generation()
+        with self._lock:
+            if self.__symbol_index is None:
+                self.__symbol_index = SymbolIndex(self.tickers)
+            return self.__symbol_index
 
     @property
     def sectors(self):
-        return self.__sectors
+        self.check_generation()
+        with self._lock:
+            if self.__sectors is None:
+                self.__sectors = self.fetch_sectors()
+            return self.__sectors
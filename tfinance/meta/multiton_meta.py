@@ -0,0 +1,47 @@
+import inspect
+import threading
+
+
+class MultitonMeta(type):
+    """
+    Metaclass keeping one instance per value of the constructor argument named by the class' KEY_ARGUMENT, so that
+    e.g. Market("sqlite:///a.db") and Market("sqlite:///b.db") are independent while every Market("sqlite:///a.db")
+    is the same instance. The other arguments of later calls are ignored. Creation is thread-safe, and instances of
+    different keys are created concurrently.
+    """
+
+    _instances = {}
+    _creating = {}
+    _lock = threading.Lock()
+
+    def __call__(cls, *args, **kwargs):
+        arguments = inspect.signature(cls.__init__).bind(None, *args, **kwargs)
+        arguments.apply_defaults()
+        key = (cls, arguments.arguments[cls.KEY_ARGUMENT])
+        with MultitonMeta._lock:
+            if key in MultitonMeta._instances:
+                return MultitonMeta._instances[key]
+            lock = MultitonMeta._creating.setdefault(key, threading.Lock())
+        with lock:
+            if key not in MultitonMeta._instances:
+                instance = super().__call__(*args, **kwargs)
+                with MultitonMeta._lock:
+                    MultitonMeta._instances[key] = instance
+                    MultitonMeta._creating.pop(key, None)
+        return MultitonMeta._instances[key]
+
+    def forget(cls, instance):
+        """
+        Drops instance from the registry, the next call with its key creates a new one.
+        """
+        with MultitonMeta._lock:
+            for key, value in list(MultitonMeta._instances.items()):
+                if value is instance:
+                    del MultitonMeta._instances[key]
+
+    def instances(cls):
+        """
+        Returns the live instances of cls by key.
+        """
+        with MultitonMeta._lock:
+            return {key[1]: value for key, value in MultitonMeta._instances.items() if key[0] is cls}
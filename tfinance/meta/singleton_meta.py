@@ -1,12 +0,0 @@
-class SingletonMeta(type):
-    """
-    Singleton metaclass
-    """
-
-    _instances = {}
-
-    def __call__(cls, *args, **kwargs):
-        if cls not in cls._instances:
-            instance = super().__call__(*args, **kwargs)
-            cls._instances[cls] = instance
-        return cls._instances[cls]
\ No newline at end of file
@@ -0,0 +1,174 @@
+"""
+Counters and histograms describing what syncs and reads spend their time on.
+
+TSEScrapper, Fetcher and Market record into a Metrics instance, Market's one being shared with its scrapper:
+
+    market = tfin.Market(offline=True)
+    market.metrics.add_hook(lambda kind, name, value, labels: print(kind, name, value, labels))
+    market.refresh()
+    market.metrics.snapshot()["histograms"]["phase_seconds"]
+    print(market.metrics.expose())  # Prometheus text format
+
+Recorded metrics:
+    phase_seconds{phase}            histogram of sync and read phases: tickers, sectors and history (the
+                                    parts of an update), fetch (waiting for downloads), parse (per ticker),
+                                    write, adjustments and aggregates (per batch) and read
+    fetch_seconds                   histogram of per url (i.e. per ticker) download latency, retries included
+    fetch_requests_total            HTTP requests sent
+    fetch_retries_total             requests retried after a timeout, connection error or retryable status
+    fetch_errors_total              urls given up on
+    fetch_bytes_total               bytes downloaded
+    rows_written_total              history rows written
+    tickers_unchanged_total         tickers skipped by an incremental sync because their csv didn't change
+    tickers_failed_total            tickers whose download or parsing failed
+    cache_hits_total, cache_misses_total
+    refresh_failures_total          failed auto-refreshes (see Market.start_auto_refresh)
+    server_requests_total{route, status}    requests answered by a server.MarketServer of the Market
+"""
+import bisect
+import contextlib
+import threading
+import time
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 300.0)
+
+
+class Histogram:
+    """
+    Cumulative-bucket histogram of observed values.
+    """
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def snapshot(self):
+        cumulative, total = {}, 0
+        for bound, count in zip(self.buckets + (float("inf"),), self.counts):
+            total += count
+            cumulative[bound] = total
+        return {"count": self.count, "sum": self.sum, "buckets": cumulative}
+
+
+class Metrics:
+    """
+    Thread-safe registry of labeled counters and histograms, calling hooks on every record.
+
+    :param buckets: upper bounds, in seconds, of the histogram buckets
+    """
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self.hooks = []
+        self._lock = threading.Lock()
+        self._counters = {}
+        self._histograms = {}
+
+    def add_hook(self, hook):
+        """
+        Registers hook(kind, name, value, labels), kind being "counter" or "histogram", to be called on every
+        record, e.g. to forward them to a monitoring system.
+        """
+        self.hooks = self.hooks + [hook]
+
+    def inc(self, name, value=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+        for hook in self.hooks:
+            hook("counter", name, value, labels)
+
+    def observe(self, name, value, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            if key not in self._histograms:
+                self._histograms[key] = Histogram(self.buckets)
+            self._histograms[key].observe(value)
+        for hook in self.hooks:
+            hook("histogram", name, value, labels)
+
+    @contextlib.contextmanager
+    def phase(self, phase):
+        """
+        Context manager recording the time spent in its block into phase_seconds{phase}.
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe("phase_seconds", time.perf_counter() - start, phase=phase)
+
+    def counter(self, name, **labels):
+        return self._counters.get((name, tuple(sorted(labels.items()))), 0)
+
+    def histogram(self, name, **labels):
+        """
+        Returns the snapshot of a histogram, None if nothing was observed.
+        """
+        with self._lock:
+            histogram = self._histograms.get((name, tuple(sorted(labels.items()))))
+            return None if histogram is None else histogram.snapshot()
+
+    def snapshot(self):
+        """
+        Returns {"counters": {name: {labels: value}}, "histograms": {name: {labels: histogram snapshot}}}, labels
+        being tuples of (label, value) pairs.
+        """
+        snapshot = {"counters": {}, "histograms": {}}
+        with self._lock:
+            for (name, labels), value in self._counters.items():
+                snapshot["counters"].setdefault(name, {})[labels] = value
+            for (name, labels), histogram in self._histograms.items():
+                snapshot["histograms"].setdefault(name, {})[labels] = histogram.snapshot()
+        return snapshot
+
+    def reset(self):
+        with self._lock:
+            self._counters.clear()
+            self._histograms.clear()
+
+    def expose(self):
+        """
+        Returns the metrics in the Prometheus text exposition format, prefixed with tfinance_.
+        """
+        lines = []
+        snapshot = self.snapshot()
+        for name, series in sorted(snapshot["counters"].items()):
+            lines.append("# TYPE tfinance_{} counter".format(name))
+            for labels, value in sorted(series.items()):
+                lines.append("tfinance_{}{} {}".format(name, format_labels(labels), value))
+        for name, series in sorted(snapshot["histograms"].items()):
+            lines.append("# TYPE tfinance_{} histogram".format(name))
+            for labels, histogram in sorted(series.items()):
+                for bound, count in histogram["buckets"].items():
+                    le = "+Inf" if bound == float("inf") else repr(bound)
+                    lines.append("tfinance_{}_bucket{} {}".format(name, format_labels(labels + (("le", le),)), count))
+                lines.append("tfinance_{}_sum{} {}".format(name, format_labels(labels), histogram["sum"]))
+                lines.append("tfinance_{}_count{} {}".format(name, format_labels(labels), histogram["count"]))
+        return "\n".join(lines) + "\n"
+
+
+def format_labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join('{}="{}"'.format(k, v) for k, v in labels) + "}"
+
+
+def progress(iterable, enabled, **kwargs):
+    """
+    Wraps iterable in a tqdm progress bar when enabled and tqdm is installed.
+    """
+    if not enabled:
+        return iterable
+    try:
+        from tqdm import tqdm
+    except ImportError:
+        return iterable
+    return tqdm(iterable, **kwargs)
@@ -2,10 +2,31 @@ from .meta import Base, Session
 from .ticker_model import TickerModel
 from .sector_model import SectorModel
 from .ticker_history_mixin import TickerHistoryMixin
+from .ticker_history_model import TickerHistoryModel
+from .adjustment_model import AdjustmentModel
+from .bar_model import BarModel
+from .indicator_model import IndicatorModel
+from .fetch_meta_model import FetchMetaModel
+from .latest_bar_model import LatestBarModel
+from .sector_aggregate_model import SectorAggregateModel
+from .generation_model import GenerationModel, bump_generation, read_generation
+from .upsert import upsert
+
+from sqlalchemy import inspect
 
 
 def create_ticker_history_model(id):
+    """
+    Creates the model of a legacy per ticker history table, only used for migrating to TickerHistoryModel.
+    """
     name = "TickerHistoryModel_{}".format(id)
     cls = type(name, (TickerHistoryMixin, Base),
                {"__tablename__": id, "__table_args__" : {'extend_existing': True}})
     return cls
+
+
+def legacy_history_tables(bind):
+    """
+    Returns the names of the legacy per ticker history tables, named after their ticker id, found in bind's database.
+    """
+    return [name for name in inspect(bind).get_table_names() if name.isdigit()]
@@ -0,0 +1,14 @@
+from .meta import Base
+from sqlalchemy import Column, String, DATETIME, FLOAT
+
+
+class AdjustmentModel(Base):
+    __tablename__ = 'adjustments'
+
+    ticker_id = Column(String, primary_key=True)
+    DATETIME = Column("<DTYYYYMMDD>", DATETIME, primary_key=True)
+    factor = Column(FLOAT)
+
+    def __repr__(self):
+        fmt = '<AdjustmentModel(ticker_id="{}", DATETIME="{}", factor="{}")>'
+        return fmt.format(self.ticker_id, self.DATETIME, self.factor)
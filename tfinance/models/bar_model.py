@@ -0,0 +1,24 @@
+from .meta import Base
+from sqlalchemy import Column, String, Integer, DATETIME, FLOAT
+
+
+class BarModel(Base):
+    __tablename__ = 'ticker_bars'
+
+    ticker_id = Column(String, primary_key=True)
+    period = Column(String, primary_key=True)
+    DATETIME = Column("<DTYYYYMMDD>", DATETIME, primary_key=True)
+    FIRST = Column("<FIRST>", FLOAT)
+    HIGH = Column("<HIGH>", FLOAT)
+    LOW = Column("<LOW>", FLOAT)
+    CLOSE = Column("<CLOSE>", FLOAT)
+    VALUE = Column("<VALUE>", Integer)
+    VOL = Column("<VOL>", Integer)
+    OPENINT = Column("<OPENINT>", Integer)
+    SESSIONS = Column("<SESSIONS>", Integer)
+
+    def __repr__(self):
+        fmt = '<BarModel(ticker_id="{}", period="{}", DATETIME="{}", FIRST="{}", HIGH="{}", LOW="{}", CLOSE="{}", ' \
+              'VALUE="{}", VOL="{}", OPENINT="{}", SESSIONS="{}")>'
+        return fmt.format(self.ticker_id, self.period, self.DATETIME, self.FIRST, self.HIGH, self.LOW, self.CLOSE,
+                          self.VALUE, self.VOL, self.OPENINT, self.SESSIONS)
@@ -0,0 +1,16 @@
+from .meta import Base
+from sqlalchemy import Column, String, DATETIME
+
+
+class FetchMetaModel(Base):
+    __tablename__ = 'fetch_meta'
+
+    url = Column(String, primary_key=True)
+    etag = Column(String)
+    last_modified = Column(String)
+    content_hash = Column(String)
+    last_success = Column(DATETIME)
+
+    def __repr__(self):
+        fmt = '<FetchMetaModel(url="{}", etag="{}", last_modified="{}", content_hash="{}", last_success="{}")>'
+        return fmt.format(self.url, self.etag, self.last_modified, self.content_hash, self.last_success)
@@ -0,0 +1,37 @@
+from .meta import Base
+from sqlalchemy import Column, Integer, DATETIME, select
+
+
+class GenerationModel(Base):
+    """
+    Single row counting the writes published to the database, so that Markets of other processes notice them.
+    """
+    __tablename__ = 'generation'
+
+    id = Column(Integer, primary_key=True)
+    generation = Column(Integer, nullable=False)
+    published = Column(DATETIME)
+
+    def __repr__(self):
+        fmt = '<GenerationModel(generation="{}", published="{}")>'
+        return fmt.format(self.generation, self.published)
+
+
+def read_generation(connection):
+    """
+    Returns the generation of the database, 0 if nothing was published yet.
+    """
+    table = GenerationModel.__table__
+    return connection.execute(select(table.c.generation).where(table.c.id == 1)).scalar() or 0
+
+
+def bump_generation(connection, published=None):
+    """
+    Increments the generation of the database in the transaction of connection, and returns the new one.
+    """
+    table = GenerationModel.__table__
+    table.create(bind=connection, checkfirst=True)
+    values = {"generation": table.c.generation + 1, "published": published}
+    if not connection.execute(table.update().where(table.c.id == 1).values(**values)).rowcount:
+        connection.execute(table.insert().values(id=1, generation=1, published=published))
+    return read_generation(connection)
@@ -0,0 +1,20 @@
+from .meta import Base
+from sqlalchemy import Column, String, DATETIME, FLOAT
+
+
+class IndicatorModel(Base):
+    __tablename__ = 'ticker_indicators'
+
+    ticker_id = Column(String, primary_key=True)
+    DATETIME = Column("<DTYYYYMMDD>", DATETIME, primary_key=True)
+    RETURN = Column("<RETURN>", FLOAT)
+    SMA5 = Column("<SMA5>", FLOAT)
+    SMA20 = Column("<SMA20>", FLOAT)
+    SMA60 = Column("<SMA60>", FLOAT)
+    VOLATILITY20 = Column("<VOLATILITY20>", FLOAT)
+
+    def __repr__(self):
+        fmt = '<IndicatorModel(ticker_id="{}", DATETIME="{}", RETURN="{}", SMA5="{}", SMA20="{}", SMA60="{}", ' \
+              'VOLATILITY20="{}")>'
+        return fmt.format(self.ticker_id, self.DATETIME, self.RETURN, self.SMA5, self.SMA20, self.SMA60,
+                          self.VOLATILITY20)
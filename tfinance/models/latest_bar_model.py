@@ -0,0 +1,13 @@
+from .meta import Base
+from .ticker_history_mixin import TickerHistoryMixin
+from sqlalchemy import Column, String, DATETIME
+
+
+class LatestBarModel(TickerHistoryMixin, Base):
+    """
+    Last stored session of every ticker, maintained along the history store for cross-sectional queries.
+    """
+    __tablename__ = 'latest_bars'
+
+    ticker_id = Column(String, primary_key=True)
+    DATETIME = Column("<DTYYYYMMDD>", DATETIME)
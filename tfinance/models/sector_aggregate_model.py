@@ -0,0 +1,23 @@
+from .meta import Base
+from sqlalchemy import Column, String, Integer, DATETIME, FLOAT
+
+
+class SectorAggregateModel(Base):
+    __tablename__ = 'sector_aggregates'
+
+    sector = Column(String, primary_key=True)
+    DATETIME = Column("<DTYYYYMMDD>", DATETIME, primary_key=True)
+    VALUE = Column("<VALUE>", Integer)
+    VOL = Column("<VOL>", Integer)
+    TICKERS = Column("<TICKERS>", Integer)
+    ADVANCES = Column("<ADVANCES>", Integer)
+    DECLINES = Column("<DECLINES>", Integer)
+    UNCHANGED = Column("<UNCHANGED>", Integer)
+    RETURN_EW = Column("<RETURN_EW>", FLOAT)
+    RETURN_VW = Column("<RETURN_VW>", FLOAT)
+
+    def __repr__(self):
+        fmt = '<SectorAggregateModel(sector="{}", DATETIME="{}", VALUE="{}", VOL="{}", TICKERS="{}", ' \
+              'ADVANCES="{}", DECLINES="{}", UNCHANGED="{}", RETURN_EW="{}", RETURN_VW="{}")>'
+        return fmt.format(self.sector, self.DATETIME, self.VALUE, self.VOL, self.TICKERS, self.ADVANCES,
+                          self.DECLINES, self.UNCHANGED, self.RETURN_EW, self.RETURN_VW)
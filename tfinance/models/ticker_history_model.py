@@ -0,0 +1,12 @@
+from .meta import Base
+from .ticker_history_mixin import TickerHistoryMixin
+from sqlalchemy import Column, String, Index
+
+
+class TickerHistoryModel(TickerHistoryMixin, Base):
+    __tablename__ = 'ticker_history'
+
+    ticker_id = Column(String, primary_key=True)
+
+    # The (ticker_id, <DTYYYYMMDD>) primary key serves per ticker range scans, this one serves cross-sectional queries
+    __table_args__ = (Index("ix_ticker_history_date_ticker_id", "<DTYYYYMMDD>", "ticker_id"),)
@@ -0,0 +1,29 @@
+from sqlalchemy import tuple_
+
+
+def upsert(connection, table, records):
+    """
+    Inserts records into table replacing the rows that share their primary key.
+    """
+    if not records:
+        return
+    keys = [c.name for c in table.primary_key.columns]
+    dialect = connection.dialect.name
+    if dialect in ("sqlite", "postgresql"):
+        if dialect == "sqlite":
+            from sqlalchemy.dialects.sqlite import insert
+        else:
+            from sqlalchemy.dialects.postgresql import insert
+        stmt = insert(table)
+        updates = {c.name: stmt.excluded[c.name] for c in table.columns if c.name not in keys}
+        if updates:
+            stmt = stmt.on_conflict_do_update(index_elements=keys, set_=updates)
+        else:
+            stmt = stmt.on_conflict_do_nothing(index_elements=keys)
+        connection.execute(stmt, records)
+    else:
+        # Generic fallback: delete the conflicting keys then insert
+        values = list({tuple(r[k] for k in keys) for r in records})
+        key_columns = tuple_(*[table.c[k] for k in keys])
+        connection.execute(table.delete().where(key_columns.in_(values)))
+        connection.execute(table.insert(), records)
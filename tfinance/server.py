@@ -0,0 +1,216 @@
+"""
+Read-only HTTP service sharing one warm Market with many processes, see client.MarketClient for its client:
+
+    $ tfinance serve --db sqlite:///tse.db --port 8350 [--refresh-interval 3600]
+
+Routes (GET), answering frames in the format given by the format parameter: "arrow" (Arrow IPC stream), "parquet"
+or "csv" (gzip compressed). Index levels are sent as regular columns. List parameters are comma separated.
+
+    /tickers
+    /sectors
+    /history?tickers=&start=&end=&columns=&adjusted=        Market.fetch_histories
+    /ticker_history?id=&adjusted=                           Market.fetch_history or fetch_adjusted_history
+    /snapshot?date=&columns=                                Market.snapshot
+    /adjustments?tickers=                                   Market.fetch_adjustments
+    /info                                                   generation and last refresh of the Market, as JSON
+
+Encoded responses are cached on top of the Market's own cache, both being dropped when writes are published to the
+database, by the Market or by another process (see Market.check_generation), and carry an ETag so that clients can
+revalidate them with If-None-Match. Unknown tickers are answered with 404 and invalid parameters with 400.
+"""
+import gzip
+import hashlib
+import io
+import json
+import logging
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+import pandas as pd
+
+from . import __version__
+from .cache import LRUCache
+
+CONTENT_TYPES = {"arrow": "application/vnd.apache.arrow.stream", "parquet": "application/vnd.apache.parquet",
+                 "csv": "text/csv; charset=utf-8"}
+# String columns of the served frames, kept as strings when reading csv even if they look like numbers
+STRING_COLUMNS = {column: str for column in ["ticker_id", "<TICKER>", "<PER>", "id", "name", "ticker", "latin_name",
+                                             "latin_ticker", "sector", "market", "sub_market", "ticker_code",
+                                             "code"]}
+
+
+def encode_frame(df, format):
+    """
+    Serializes df, with its index levels as regular columns, to format "arrow", "parquet" or "csv".
+    """
+    if any(name is not None for name in df.index.names):
+        df = df.reset_index()
+    if format == "csv":
+        return gzip.compress(df.to_csv(index=False).encode("utf-8"), compresslevel=5)
+    import pyarrow as pa
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    sink = pa.BufferOutputStream()
+    if format == "parquet":
+        import pyarrow.parquet as pq
+        pq.write_table(table, sink)
+    else:
+        with pa.ipc.new_stream(sink, table.schema) as writer:
+            writer.write_table(table)
+    return sink.getvalue().to_pybytes()
+
+
+def decode_frame(body, format):
+    """
+    Inverse of encode_frame, csv bodies being already decompressed.
+    """
+    if format == "csv":
+        df = pd.read_csv(io.BytesIO(body), dtype=STRING_COLUMNS)
+        if "<DTYYYYMMDD>" in df.columns:
+            df["<DTYYYYMMDD>"] = pd.to_datetime(df["<DTYYYYMMDD>"])
+        return df
+    import pyarrow as pa
+    if format == "parquet":
+        import pyarrow.parquet as pq
+        return pq.read_table(pa.BufferReader(body)).to_pandas()
+    return pa.ipc.open_stream(pa.BufferReader(body)).read_all().to_pandas()
+
+
+def split(value):
+    return None if value is None else [item for item in value.split(",") if item]
+
+
+def flag(value):
+    return value is not None and value.lower() in ("1", "true", "yes")
+
+
+class MarketRequestHandler(BaseHTTPRequestHandler):
+
+    server_version = "tfinance/{}".format(__version__)
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        params = {name: values[-1] for name, values in parse_qs(url.query).items()}
+        status, body, headers = self.server.respond(url.path, params, self.headers)
+        self.send_response(status)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        self.server.logger.debug(format % args)
+
+
+class MarketServer(ThreadingHTTPServer):
+    """
+    HTTP server answering the routes of this module from market, one thread per connection.
+
+        server = MarketServer(market, ("127.0.0.1", 8350))
+        server.serve_forever()
+
+    :param market: Market served, its cache and auto-refresh (see Market.start_auto_refresh) keep working as usual
+    :param address: (host, port) to listen on, port 0 picks a free one
+    :param default_format: format of requests not giving one, defaults to "arrow" if pyarrow is installed
+    :param cache_size: maximum number of encoded responses kept, 0 disables the cache
+    :param cache_bytes: maximum total size of the encoded responses kept
+    """
+
+    daemon_threads = True
+    ROUTES = {"/tickers": "get_tickers", "/sectors": "get_sectors", "/history": "get_history",
+              "/ticker_history": "get_ticker_history", "/snapshot": "get_snapshot", "/adjustments": "get_adjustments"}
+
+    def __init__(self, market, address=("127.0.0.1", 8350), default_format=None, cache_size=256,
+                 cache_bytes=256 * 2 ** 20):
+        super().__init__(address, MarketRequestHandler)
+        self.logger = logging.getLogger(__name__)
+        self.market = market
+        if default_format is None:
+            try:
+                import pyarrow  # noqa: F401
+                default_format = "arrow"
+            except ImportError:
+                default_format = "csv"
+        self.default_format = default_format
+        self.cache = LRUCache(maxsize=cache_size, maxbytes=cache_bytes)
+        # Part of the ETags, generations starting over when the server restarts
+        self.instance = uuid.uuid4().hex
+
+    @property
+    def url(self):
+        host, port = self.server_address[:2]
+        return "http://{}:{}".format(host, port)
+
+    def respond(self, path, params, request_headers):
+        """
+        Returns the (status, body, headers) of a request of path.
+        """
+        self.market.check_generation()
+        if path == "/info":
+            info = {"version": __version__, "generation": self.market.generation,
+                    "last_refresh": None if self.market.last_refresh is None else
+                    self.market.last_refresh.isoformat()}
+            return self.count(path, 200, json.dumps(info).encode("utf-8"), {"Content-Type": "application/json"})
+        if path not in self.ROUTES:
+            return self.error(path, 404, "Unknown route {}".format(path))
+        format = params.pop("format", self.default_format)
+        if format not in CONTENT_TYPES:
+            return self.error(path, 400, "Unknown format {!r}, expected one of {}".format(format, list(CONTENT_TYPES)))
+        generation = self.market.generation
+        key = (generation, path, tuple(sorted(params.items())), format)
+        headers = {"Content-Type": CONTENT_TYPES[format],
+                   "ETag": '"{}"'.format(hashlib.sha1(repr((self.instance, key)).encode("utf-8")).hexdigest())}
+        if format == "csv":
+            headers["Content-Encoding"] = "gzip"
+        if request_headers.get("If-None-Match") == headers["ETag"]:
+            return self.count(path, 304, b"", headers)
+        body = self.cache.get(key)
+        if body is None:
+            try:
+                df = getattr(self, self.ROUTES[path])(params)
+            except KeyError as e:
+                return self.error(path, 404, "Not found: {}".format(e))
+            except ValueError as e:
+                return self.error(path, 400, str(e))
+            except Exception:
+                self.logger.exception("Answering {} {} failed".format(path, params))
+                return self.error(path, 500, "Internal server error")
+            body = encode_frame(df, format)
+            # A write published meanwhile may have made it stale
+            if generation == self.market.generation:
+                self.cache.put(key, body)
+        return self.count(path, 200, body, headers)
+
+    def error(self, path, status, message):
+        return self.count(path, status, message.encode("utf-8"), {"Content-Type": "text/plain; charset=utf-8"})
+
+    def count(self, path, status, body, headers):
+        self.market.metrics.inc("server_requests_total", route=path, status=status)
+        return status, body, headers
+
+    def get_tickers(self, params):
+        return self.market.tickers
+
+    def get_sectors(self, params):
+        return self.market.sectors
+
+    def get_history(self, params):
+        if not params.get("tickers"):
+            raise ValueError("Missing tickers parameter")
+        return self.market.fetch_histories(split(params["tickers"]), start=params.get("start"),
+                                           end=params.get("end"), columns=split(params.get("columns")),
+                                           adjusted=flag(params.get("adjusted")))
+
+    def get_ticker_history(self, params):
+        if not params.get("id"):
+            raise ValueError("Missing id parameter")
+        if flag(params.get("adjusted")):
+            return self.market.fetch_adjusted_history(id=params["id"])
+        return self.market.fetch_history(id=params["id"])
+
+    def get_snapshot(self, params):
+        return self.market.snapshot(params.get("date"), columns=split(params.get("columns")))
+
+    def get_adjustments(self, params):
+        return self.market.fetch_adjustments(split(params.get("tickers")))
@@ -0,0 +1,9 @@
+from .sql_history_store import SQLHistoryStore
+
+
+def __getattr__(name):
+    # ArrowHistoryStore imports pyarrow, so it's only imported on first access
+    if name == "ArrowHistoryStore":
+        from .arrow_history_store import ArrowHistoryStore
+        return ArrowHistoryStore
+    raise AttributeError("module {!r} has no attribute {!r}".format(__name__, name))
@@ -0,0 +1,209 @@
+import contextlib
+import os
+import tempfile
+import threading
+
+import pandas as pd
+
+try:
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    import pyarrow.parquet as pq
+except ImportError:  # pragma: no cover
+    pa = None
+
+from ..abc.base_history_store import BaseHistoryStore
+from ..dtypes import typed_history
+
+
+class ArrowHistoryStore(BaseHistoryStore):
+    """
+    Stores histories as one columnar file per ticker, under root/ticker_id=<id>/, sorted by <DTYYYYMMDD>.
+
+    With format="parquet" files are compressed and reads prune row groups by date. With format="ipc" files are
+    uncompressed Arrow IPC files which are memory-mapped on read, so read_table() is zero-copy.
+
+    Requires pyarrow (pip install tfinance[arrow]).
+    """
+
+    FORMATS = {"parquet": "history.parquet", "ipc": "history.arrow"}
+
+    def __init__(self, root, format="parquet"):
+        if pa is None:
+            raise ImportError("ArrowHistoryStore requires pyarrow, install it with `pip install tfinance[arrow]`")
+        if format not in self.FORMATS:
+            raise ValueError("format must be one of {}".format(sorted(self.FORMATS)))
+        self.root = root
+        self.format = format
+        os.makedirs(self.root, exist_ok=True)
+        # {path: staged file} of the transaction of each thread, see transaction
+        self._local = threading.local()
+
+    @contextlib.contextmanager
+    def transaction(self, connection=None):
+        """
+        Partitions written in the block are staged in temporary files next to the published ones, and renamed over
+        them when it exits. Each partition is replaced atomically, but a reader of many tickers running during the
+        renames may see some tickers of the transaction published and others not yet.
+        """
+        staged = self._local.staged = {}
+        try:
+            yield
+        except BaseException:
+            for staged_path in staged.values():
+                os.remove(staged_path)
+            raise
+        else:
+            for path, staged_path in staged.items():
+                os.replace(staged_path, path)
+        finally:
+            self._local.staged = None
+
+    def path(self, ticker_id):
+        return os.path.join(self.root, "ticker_id={}".format(ticker_id), self.FORMATS[self.format])
+
+    def visible_path(self, ticker_id):
+        """
+        Path of the partition of ticker_id as the current thread sees it, its staged file within a transaction.
+        """
+        path = self.path(ticker_id)
+        staged = getattr(self._local, "staged", None)
+        return staged.get(path, path) if staged else path
+
+    def ticker_ids(self):
+        prefix = "ticker_id="
+        return sorted(name[len(prefix):] for name in os.listdir(self.root)
+                      if name.startswith(prefix) and os.path.exists(self.visible_path(name[len(prefix):])))
+
+    def write(self, df):
+        for ticker_id, group in df.groupby("ticker_id", sort=False):
+            group = group.drop(columns="ticker_id")
+            existing = self.read_partition(ticker_id)
+            if existing is not None:
+                existing = existing.to_pandas()
+                existing = existing.loc[~existing["<DTYYYYMMDD>"].isin(group["<DTYYYYMMDD>"])]
+                group = pd.concat([existing, group], ignore_index=True)
+            group = group.sort_values("<DTYYYYMMDD>", ignore_index=True)
+            group["<DTYYYYMMDD>"] = group["<DTYYYYMMDD>"].astype("datetime64[us]")
+            self.write_partition(ticker_id, pa.Table.from_pandas(group, preserve_index=False))
+
+    def read_table(self, ids=None, start=None, end=None, columns=None):
+        """
+        Same as read() but returns a pyarrow Table, without converting it to pandas.
+        """
+        columns = self.check_columns(columns)
+        ids = self.ticker_ids() if ids is None else list(ids)
+        tables = []
+        for ticker_id in ids:
+            table = self.read_partition(ticker_id, ["<DTYYYYMMDD>"] + columns, start, end)
+            if table is None:
+                continue
+            ticker_ids = pa.array([ticker_id] * table.num_rows, pa.string())
+            tables.append(table.add_column(0, "ticker_id", ticker_ids))
+        if not tables:
+            return pa.table({"ticker_id": pa.array([], pa.string()),
+                             "<DTYYYYMMDD>": pa.array([], pa.timestamp("us")),
+                             **{c: pa.array([], pa.null()) for c in columns}})
+        return pa.concat_tables(tables, promote_options="permissive")
+
+    def read(self, ids=None, start=None, end=None, columns=None):
+        return self.read_table(ids, start, end, columns).to_pandas()
+
+    def iter_read(self, ids=None, start=None, end=None, columns=None, chunksize=100000):
+        """
+        Streams the partitions one at a time, memory is bounded by chunksize and the largest partition.
+        """
+        columns = self.check_columns(columns)
+        ids = self.ticker_ids() if ids is None else list(ids)
+        pending, pending_rows = [], 0
+        for ticker_id in ids:
+            table = self.read_partition(ticker_id, ["<DTYYYYMMDD>"] + columns, start, end)
+            if table is None or table.num_rows == 0:
+                continue
+            ticker_ids = pa.array([ticker_id] * table.num_rows, pa.string())
+            pending.append(table.add_column(0, "ticker_id", ticker_ids))
+            pending_rows += table.num_rows
+            while pending_rows >= chunksize:
+                buffered = pa.concat_tables(pending, promote_options="permissive")
+                yield typed_history(buffered.slice(0, chunksize).to_pandas())
+                pending = [buffered.slice(chunksize)]
+                pending_rows -= chunksize
+        if pending_rows:
+            yield typed_history(pa.concat_tables(pending, promote_options="permissive").to_pandas())
+
+    def read_latest(self, columns=None):
+        """
+        Reads the last row of each partition only: the last row group of parquet files, the last record batch of
+        memory-mapped ipc files.
+        """
+        columns = self.check_columns(columns)
+        tables = []
+        for ticker_id in self.ticker_ids():
+            table = self.read_partition_tail(ticker_id, ["<DTYYYYMMDD>"] + columns)
+            if table.num_rows:
+                tables.append(table.add_column(0, "ticker_id", pa.array([ticker_id], pa.string())))
+        if not tables:
+            return self.read(ids=[], columns=columns)
+        return pa.concat_tables(tables, promote_options="permissive").to_pandas()
+
+    def read_partition_tail(self, ticker_id, columns):
+        """
+        Returns the last row of the partition of ticker_id, or an empty table if it has none.
+        """
+        path = self.visible_path(ticker_id)
+        if self.format == "parquet":
+            reader = pq.ParquetFile(path, memory_map=True)
+            groups = [i for i in range(reader.num_row_groups) if reader.metadata.row_group(i).num_rows]
+            table = reader.read_row_group(groups[-1], columns=columns) if groups else reader.schema_arrow.empty_table()
+        else:
+            reader = pa.ipc.open_file(pa.memory_map(path))
+            batches = [reader.get_batch(i) for i in range(reader.num_record_batches)]
+            batches = [batch for batch in batches if batch.num_rows]
+            table = pa.Table.from_batches(batches[-1:], schema=reader.schema)
+        return table.select(columns).slice(max(table.num_rows - 1, 0))
+
+    def last_dates(self):
+        last_dates = {}
+        for ticker_id in self.ticker_ids():
+            dates = self.read_partition(ticker_id, ["<DTYYYYMMDD>"]).column(0)
+            if len(dates):
+                last_dates[ticker_id] = dates[-1].as_py()
+        return last_dates
+
+    def read_partition(self, ticker_id, columns=None, start=None, end=None):
+        path = self.visible_path(ticker_id)
+        if not os.path.exists(path):
+            return None
+        filters = []
+        if start is not None:
+            filters.append(("<DTYYYYMMDD>", ">=", pd.Timestamp(start)))
+        if end is not None:
+            filters.append(("<DTYYYYMMDD>", "<=", pd.Timestamp(end)))
+        if self.format == "parquet":
+            return pq.read_table(path, columns=columns, filters=filters or None, memory_map=True)
+        table = pa.ipc.open_file(pa.memory_map(path)).read_all()
+        if columns is not None:
+            table = table.select(columns)
+        for column, op, value in filters:
+            compare = pc.greater_equal if op == ">=" else pc.less_equal
+            table = table.filter(compare(table[column], pa.scalar(value, table.schema.field(column).type)))
+        return table
+
+    def write_partition(self, ticker_id, table):
+        path = self.path(ticker_id)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Writing to a temporary file then renaming it, so readers never see a partially written file
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+        os.close(fd)
+        if self.format == "parquet":
+            pq.write_table(table, tmp_path)
+        else:
+            with pa.OSFile(tmp_path, "wb") as sink, pa.ipc.new_file(sink, table.schema) as writer:
+                writer.write_table(table)
+        staged = getattr(self._local, "staged", None)
+        if staged is None:
+            os.replace(tmp_path, path)
+            return
+        if path in staged:
+            os.remove(staged[path])
+        staged[path] = tmp_path
@@ -0,0 +1,148 @@
+import contextlib
+import threading
+
+import pandas as pd
+from sqlalchemy import and_, event, select, func
+
+from ..abc.base_history_store import BaseHistoryStore
+from ..dtypes import typed_history
+from ..models import TickerHistoryModel, upsert
+
+
+class SQLHistoryStore(BaseHistoryStore):
+    """
+    Stores histories in the ticker_history table of a SQLAlchemy database.
+    """
+
+    table = TickerHistoryModel.__table__
+
+    def __init__(self, engine):
+        self.engine = engine
+        if engine.dialect.name == "sqlite":
+            configure_sqlite(engine)
+        self.table.create(bind=self.engine, checkfirst=True)
+        # Connection of the transaction of each thread, see transaction
+        self._local = threading.local()
+
+    @contextlib.contextmanager
+    def transaction(self, connection=None):
+        if connection is not None and connection.engine is self.engine:
+            self._local.connection = connection
+            try:
+                yield
+            finally:
+                self._local.connection = None
+            return
+        with self.engine.connect() as connection:
+            begin_transaction(connection)
+            self._local.connection = connection
+            try:
+                yield
+                connection.commit()
+            finally:
+                self._local.connection = None
+
+    @contextlib.contextmanager
+    def connect(self):
+        """
+        Yields the connection of the current thread's transaction if any, or a new connection committed on exit.
+        """
+        connection = getattr(self._local, "connection", None)
+        if connection is not None:
+            yield connection
+        else:
+            with self.engine.begin() as connection:
+                yield connection
+
+    def write(self, df):
+        if df.empty:
+            return
+        with self.connect() as connection:
+            upsert(connection, self.table, df.to_dict("records"))
+
+    def read(self, ids=None, start=None, end=None, columns=None):
+        with self.connect() as connection:
+            result = connection.execute(self.select(ids, start, end, columns))
+            df = pd.DataFrame(result.all(), columns=list(result.keys()))
+        df["<DTYYYYMMDD>"] = pd.to_datetime(df["<DTYYYYMMDD>"])
+        return df
+
+    def iter_read(self, ids=None, start=None, end=None, columns=None, chunksize=100000):
+        """
+        Streams the rows from the cursor, chunksize rows at a time (server side cursors where the database has them).
+        The connection is held until the iteration ends, the rows all come from the same snapshot of the table.
+        """
+        sql = self.select(ids, start, end, columns)
+        with self.connect() as connection:
+            result = connection.execution_options(yield_per=chunksize).execute(sql)
+            keys = list(result.keys())
+            for rows in result.partitions():
+                df = pd.DataFrame(rows, columns=keys)
+                df["<DTYYYYMMDD>"] = pd.to_datetime(df["<DTYYYYMMDD>"])
+                yield typed_history(df)
+
+    def read_latest(self, columns=None):
+        """
+        Joins the rows with the last <DTYYYYMMDD> of their ticker, so that the database returns one row per ticker.
+        """
+        columns = self.check_columns(columns)
+        date = self.table.c["<DTYYYYMMDD>"]
+        last = select(self.table.c.ticker_id, func.max(date).label("last_date")).group_by(self.table.c.ticker_id)
+        last = last.subquery()
+        latest = self.table.join(last, and_(self.table.c.ticker_id == last.c.ticker_id, date == last.c.last_date))
+        sql = select(self.table.c.ticker_id, date, *[self.table.c[c] for c in columns]).select_from(latest)
+        with self.connect() as connection:
+            result = connection.execute(sql.order_by(self.table.c.ticker_id))
+            df = pd.DataFrame(result.all(), columns=list(result.keys()))
+        df["<DTYYYYMMDD>"] = pd.to_datetime(df["<DTYYYYMMDD>"])
+        return df
+
+    def select(self, ids=None, start=None, end=None, columns=None):
+        """
+        Returns the select statement of read().
+        """
+        columns = self.check_columns(columns)
+        date = self.table.c["<DTYYYYMMDD>"]
+        sql = select(self.table.c.ticker_id, date, *[self.table.c[c] for c in columns])
+        if ids is not None:
+            sql = sql.where(self.table.c.ticker_id.in_(list(ids)))
+        if start is not None:
+            sql = sql.where(date >= pd.Timestamp(start).to_pydatetime())
+        if end is not None:
+            sql = sql.where(date <= pd.Timestamp(end).to_pydatetime())
+        return sql.order_by(self.table.c.ticker_id, date)
+
+    def last_dates(self):
+        sql = select(self.table.c.ticker_id, func.max(self.table.c["<DTYYYYMMDD>"])).group_by(self.table.c.ticker_id)
+        with self.connect() as connection:
+            return dict(connection.execute(sql).all())
+
+
+def configure_sqlite(engine):
+    """
+    Switches a SQLite database to write-ahead logging, so that readers aren't blocked while a batch is written and
+    each batch commit costs one sync of the log instead of the whole journal dance.
+    """
+    if not event.contains(engine, "connect", set_sqlite_pragmas):
+        event.listen(engine, "connect", set_sqlite_pragmas)
+        # Pooled connections missed the listener, journal_mode=WAL persists in the file so setting it once is enough
+        with engine.connect() as connection:
+            connection.exec_driver_sql("PRAGMA journal_mode=WAL")
+
+
+def begin_transaction(connection):
+    """
+    Begins a transaction on connection. pysqlite only begins one before DML statements, leaving earlier DDL (e.g.
+    to_sql's replace) autocommitted, so on SQLite it's begun explicitly, taking the write lock up front.
+    """
+    transaction = connection.begin()
+    if connection.dialect.name == "sqlite":
+        connection.exec_driver_sql("BEGIN IMMEDIATE")
+    return transaction
+
+
+def set_sqlite_pragmas(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.close()
@@ -0,0 +1,43 @@
+class SymbolIndex:
+    """
+    In-memory lookup of tickers' metadata, built once from Market.tickers.
+
+    Lookups by id, ticker, latin_ticker and ticker_code are hash map hits, lookups by any other column of the
+    tickers table scan the records.
+    """
+
+    KEYS = ("id", "ticker", "latin_ticker", "ticker_code")
+
+    def __init__(self, tickers):
+        self.records = tickers.to_dict("records")
+        self.maps = {key: {} for key in self.KEYS}
+        self.sectors = {}
+        for record in self.records:
+            for key, mapping in self.maps.items():
+                mapping.setdefault(record.get(key), []).append(record)
+            self.sectors.setdefault(record.get("sector"), []).append(record["id"])
+
+    def lookup(self, **kwargs):
+        """
+        Returns the metadata dict of the first ticker matching every keyword, raising KeyError if there's none.
+        """
+        if not kwargs:
+            raise TypeError("lookup() requires at least one keyword")
+        indexed = [key for key in kwargs if key in self.maps]
+        if indexed:
+            candidates = self.maps[indexed[0]].get(kwargs[indexed[0]], [])
+        else:
+            candidates = self.records
+        for record in candidates:
+            if all(record.get(key) == value for key, value in kwargs.items()):
+                return dict(record)
+        raise KeyError("No ticker matches {}".format(kwargs))
+
+    def ids_in_sector(self, sector):
+        return list(self.sectors.get(sector, []))
+
+    def __contains__(self, id):
+        return id in self.maps["id"]
+
+    def __len__(self):
+        return len(self.records)
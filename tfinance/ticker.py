@@ -5,12 +5,22 @@ from .market import Market
 
 class Ticker:
 
-    def __init__(self, **kwargs):
+    def __init__(self, source=None, **kwargs):
+        """
+        :param source: Market or client.MarketClient the ticker is read from, defaults to Market() i.e. the one of
+            sqlite:///tse.db
+        :param kwargs: columns of the tickers table identifying the ticker, e.g. ticker="فولاد"
+        """
         self.logger = logging.getLogger(__name__)
-        market = Market()
-        df = market.fetch_tickers_filter_by(**kwargs)
-        self._info = df.iloc[0].to_dict()
-        self._history = market.fetch_history(**kwargs)
+        self._source = source if source is not None else Market()
+        self._info = self._source.symbol_index.lookup(**kwargs)
+        # Histories are loaded on first access
+        self._history = None
+        self._adjusted_history = None
+
+    @property
+    def id(self):
+        return self._info["id"]
 
     @property
     def name(self):
@@ -46,4 +56,15 @@ class Ticker:
 
     @property
     def history(self):
-        return self._history
\ No newline at end of file
+        if self._history is None:
+            self._history = self._source.fetch_history(id=self.id)
+        return self._history
+
+    @property
+    def adjusted_history(self):
+        """
+        History with prices adjusted for corporate actions, see adjustment.adjust_history.
+        """
+        if self._adjusted_history is None:
+            self._adjusted_history = self._source.fetch_adjusted_history(id=self.id)
+        return self._adjusted_history
@@ -1,18 +1,33 @@
 import concurrent.futures
+import contextlib
+import datetime
 import errno
+import hashlib
+import io
+import itertools
 import logging
+import multiprocessing
 import os
 import re
+import time
 from collections import namedtuple
 
+import lxml.html
+import numpy as np
 import pandas as pd
-import requests
-from bs4 import BeautifulSoup
-from sqlalchemy import inspect
-from sqlalchemy.types import Integer, Float, String, DateTime
-from tqdm import tqdm
+from sqlalchemy import inspect, select
+from sqlalchemy.types import String
 
 from .abc.base_scrapper import BaseScrapper
+from .adjustment import EVENT_COLUMNS, detect_adjustments
+from .aggregates import BAR_COLUMNS, INDICATOR_COLUMNS, INDICATOR_LOOKBACK, PERIODS, SECTOR_COLUMNS, \
+    SECTOR_SOURCE_COLUMNS, aggregate_sector_sums, resample_bars, rolling_indicators, sector_aggregates, sector_sums, \
+    tail_start
+from .fetcher import FetchError, Fetcher
+from .metrics import Metrics, progress
+from .stores import SQLHistoryStore
+from .stores.sql_history_store import begin_transaction
+from . import models
 from .models import TickerModel
 
 
@@ -24,149 +39,710 @@ class TSEScrapper(BaseScrapper):
     TEMP_DIR = "csv"
     TickerHistoryFile = namedtuple("TickerHistory", "ticker_id, file_name, response")
 
-    def __init__(self, session):
+    # Columns the aggregates are computed from
+    AGGREGATE_SOURCE_COLUMNS = ["<FIRST>", "<HIGH>", "<LOW>", "<CLOSE>", "<VALUE>", "<VOL>", "<OPENINT>", "<OPEN>"]
+
+    def __init__(self, session, fetcher=None, archive_dir=None, batch_size=50000, store=None, materialize=False,
+                 parse_workers=None, metrics=None, progress=False):
+        """
+        :param session: SQLAlchemy session of the local database
+        :param fetcher: BaseFetcher used for downloads, defaults to a Fetcher
+        :param store: BaseHistoryStore histories are written to, defaults to a SQLHistoryStore on session's database
+        :param archive_dir: if set, the streaming pipeline also keeps every downloaded csv in this directory
+        :param batch_size: number of history rows the streaming pipeline buffers before writing them at once
+        :param materialize: if True, weekly/monthly bars, rolling indicators and daily sector aggregates (see
+            aggregates) are kept up to date in the ticker_bars, ticker_indicators and sector_aggregates tables as
+            histories are written
+        :param parse_workers: number of processes parsing csv files, defaults to the number of CPUs, 0 parses them
+            in the calling thread. Incremental syncs of a populated store always parse in the calling thread, their
+            few new rows aren't worth starting processes. Writes always happen in the calling thread, one batch at a
+            time.
+        :param metrics: metrics.Metrics recording phase timings, rows written and failures, also used by the
+            default fetcher
+        :param progress: if True, downloads and parsing show tqdm progress bars
+        """
+        super().__init__(session, store=store if store is not None else SQLHistoryStore(session.bind),
+                         materialize=materialize, metrics=metrics if metrics is not None else Metrics(),
+                         progress=progress)
         self.logger = logging.getLogger(__name__)
-        self.session = session
+        self.fetcher = fetcher if fetcher is not None else Fetcher(metrics=self.metrics)
+        self.archive_dir = archive_dir
+        self.batch_size = batch_size
+        self.parse_workers = os.cpu_count() if parse_workers is None else parse_workers
         self.tickers = None
         self.sectors = None
-        # Creating ticker_history_set by checking TEMP_DIR
+        # Ticker ids whose history couldn't be downloaded or parsed during the last update, mapped to the error
+        self.failures = {}
+        # Ticker ids having a csv in TEMP_DIR, filled when the staged pipeline runs
         self.ticker_history_set = set()
-        self.logger.info("Creating ./{} directory...".format(self.TEMP_DIR))
-        try:
-            os.makedirs(self.TEMP_DIR)
-        except OSError as e:
-            if e.errno != errno.EEXIST:
-                raise
-        files_list = os.listdir("./{}".format(self.TEMP_DIR))
-        self.ticker_history_set = {re.findall("(\d+)\|.*", f)[0] for f in files_list}
+        # fetch_meta records of downloads whose rows aren't written yet, by ticker id (by url for the pages)
+        self.pending_fetch_meta = {}
+        # Ticker ids whose history was unchanged during the last incremental sync
+        self.unchanged = set()
+        # Earliest <DTYYYYMMDD> written since the sector aggregates were last materialized
+        self.sectors_stale_since = None
+        # Connection of the running transaction, and the write notifications it holds back (see transaction)
+        self.connection = None
+        self.held_notifications = None
+
+    def update(self, incremental=False, streaming=False, atomic=False):
+        """
+        :param incremental: see update_history
+        :param streaming: see update_history
+        :param atomic: if True, the whole update is written in one transaction that readers see at once when it
+            commits, see transaction
+        """
+        with self.transaction() if atomic else contextlib.nullcontext():
+            with self.metrics.phase("tickers"):
+                self.update_tickers()
+            with self.metrics.phase("sectors"):
+                self.update_sectors()
+            with self.metrics.phase("history"):
+                self.update_history(incremental=incremental, streaming=streaming)
 
-    def update(self):
-        self.update_tickers()
-        self.update_sectors()
-        self.update_history()
+    @contextlib.contextmanager
+    def transaction(self):
+        """
+        Runs the writes of its block as a unit that readers see all at once when the block exits, or not at all if
+        it raises: tables are written on a single connection in a single transaction, and the history store stages
+        its writes until then (see BaseHistoryStore.transaction). The generation of the database is bumped in the
+        same transaction, and write notifications are held back until the commit.
+
+        Readers keep seeing the previous state meanwhile without waiting, SQLite databases being in WAL mode.
+        """
+        self.create_tables()
+        held = []
+        with self.session.bind.connect() as connection:
+            begin_transaction(connection)
+            self.connection, self.held_notifications = connection, held
+            try:
+                with self.store.transaction(connection):
+                    yield
+                if held:
+                    self.publish_generation()
+                connection.commit()
+            finally:
+                self.connection, self.held_notifications = None, None
+        for kind, ticker_ids in held:
+            self.call_write_listeners(kind, ticker_ids)
+
+    @contextlib.contextmanager
+    def connect(self):
+        """
+        Yields the connection of the running transaction if any, or a new connection committed on exit.
+        """
+        if self.connection is not None:
+            yield self.connection
+        else:
+            with self.session.bind.begin() as connection:
+                yield connection
+
+    def notify_write(self, kind, ticker_ids=None):
+        if self.held_notifications is not None:
+            self.held_notifications.append((kind, ticker_ids))
+        else:
+            super().notify_write(kind, ticker_ids)
+
+    def publish_generation(self):
+        with self.connect() as connection:
+            self.generation = models.bump_generation(connection, datetime.datetime.now())
+
+    def has_table(self, name) -> bool:
+        with self.connect() as connection:
+            return inspect(connection).has_table(name)
+
+    def create_tables(self) -> None:
+        """
+        Creates the tables maintained along the histories if they don't exist yet.
+        """
+        tables = [model.__table__ for model in (models.AdjustmentModel, models.LatestBarModel, models.FetchMetaModel,
+                                                models.BarModel, models.IndicatorModel, models.SectorAggregateModel,
+                                                models.GenerationModel)]
+        models.Base.metadata.create_all(bind=self.session.bind, tables=tables)
 
     def update_tickers(self):
         self.logger.info("Updating tickers ...")
-        self.logger.info("Checking whether stocks list table exist or not")
-        if inspect(self.session.bind).has_table("tickers"):
-            self.logger.info("Loading tickers_list table as a dataframe")
+        content = self.fetch_page(self.URL_BAZAR_ADDI, "tickers")
+        if content is None:
+            self.logger.info("Tickers page unchanged, loading tickers table as a dataframe")
             self.tickers = self.fetch_tickers()
         else:
-            self.logger.info("tickers_list table doesn't exits.")
-            self.get_tickers()
+            self.get_tickers(content)
             self.save_tickers()
+            self.write_fetch_meta([self.URL_BAZAR_ADDI])
         self.logger.info("Updating tickers finished.")
 
     def update_sectors(self):
         self.logger.info("Updating sectors ...")
-        self.logger.info("Checking whether sectors list table exist or not")
-        if inspect(self.session.bind).has_table("sectors_list"):
-            self.logger.info("Loading sectors list table as a dataframe")
-            pass
+        content = self.fetch_page(self.URL_SECTORS_LIST, "sectors")
+        if content is None:
+            self.logger.info("Sectors page unchanged.")
         else:
-            self.logger.info("Sectors list table doesn't exits.")
-            self.get_sectors()
+            self.get_sectors(content)
             self.save_sectors()
+            self.write_fetch_meta([self.URL_SECTORS_LIST])
         self.logger.info("Updating sectors finished.")
 
-    def update_history(self):
+    def fetch_page(self, url, table):
+        """
+        Downloads the page at url whose rows are stored in table, conditionally on the fetch_meta record of its last
+        stored download: returns None if it's unchanged since (answered 304, or hashing the same), its content
+        otherwise. The new record is pending until write_fetch_meta([url]), once the page's rows are stored.
+
+        A failed download raises, unless the table is stored: its rows are kept as they are then, and None returned.
+        """
+        stored = self.has_table(table)
+        meta = self.load_fetch_meta([url]).get(url) if stored else None
+        try:
+            response = self.fetcher.get(url, headers=conditional_headers(meta) if meta is not None else None)
+        except FetchError as e:
+            if not stored:
+                raise
+            self.logger.warning("Getting {} failed, keeping the stored {}: {}".format(url, table, e))
+            return None
+        if response.status_code == 304 and meta is not None:
+            self.pending_fetch_meta[url] = dict(meta, last_success=datetime.datetime.now())
+            self.write_fetch_meta([url])
+            return None
+        record = self.pending_fetch_meta[url] = fetch_record(url, response)
+        if meta is not None and meta["content_hash"] == record["content_hash"]:
+            self.write_fetch_meta([url])
+            return None
+        return response.content
+
+    def update_history(self, incremental=False, streaming=False):
+        """
+        :param incremental: only write the sessions newer than the stored ones, implies streaming
+        :param streaming: parse downloads as they arrive and write them in batches instead of staging them in TEMP_DIR
+        """
         self.logger.info("Updating histories ...")
-        self.logger.info("Checking stocks history tables' existence")
-        self.get_history()
-        self.save_history()
+        self.failures = {}
+        self.migrate_history()
+        if self.latest_bars_missing():
+            # Databases synced before the latest_bars table existed
+            self.rebuild_latest_bars()
+        if self.materialize and self.aggregates_missing():
+            # Databases synced without materialize, only the sessions written from now on would be materialized
+            self.rebuild_aggregates()
+        if incremental or streaming:
+            self.sync_history(incremental=incremental)
+        else:
+            self.logger.info("Checking stocks history tables' existence")
+            self.get_history()
+            self.save_history()
         self.logger.info("Updating histories ended.")
 
-    def get_tickers(self):
-        self.logger.info("Getting URL_BAZAR_ADDI...")
-        r = requests.get(self.URL_BAZAR_ADDI)
-        self.logger.info("Creating bazar_adi empty dataframe...")
-        bazar_adi_columns = ["id", "name", "ticker", "latin_name", "latin_ticker", "sector", "market", "sub_market",
-                             "ticker_code"]
-        df_bazar_adi = pd.DataFrame(columns=bazar_adi_columns)
+    def sync_history(self, incremental=True):
+        """
+        Streams ticker histories into the history store: every csv is handed to the parse workers as soon as it's
+        downloaded and the parsed rows are written in batches of batch_size, so memory is bounded by the fetcher's
+        concurrency and the batch size rather than by the size of the market. When incremental, only the sessions
+        newer than the last stored <DTYYYYMMDD> of each ticker are written.
+        """
+        last_dates = {}
+        if incremental:
+            self.logger.info("Fetching last stored dates...")
+            last_dates = self.fetch_last_dates()
+        if self.archive_dir is not None:
+            os.makedirs(self.archive_dir, exist_ok=True)
+        self.pending_fetch_meta = {}
+        self.logger.info("Fetching csv files...")
+        tasks = self.iter_sync_tasks(last_dates)
+        self.write_histories(self.iter_parsed_histories(tasks, workers=0 if last_dates else None))
+        self.logger.info("Syncing histories finished.")
+
+    def iter_sync_tasks(self, last_dates):
+        """
+        Downloads the tickers' histories and yields a parse_history task for each of them.
+
+        Histories of stored tickers are requested conditionally with the ETag/Last-Modified of their last download,
+        and a payload hashing the same as the stored one is skipped as well, so an unchanged (e.g. halted) ticker
+        costs one request and no parsing or writing. The fetch_meta of a download is written along with its rows.
+        """
+        fetch_meta = self.load_fetch_meta() if last_dates else {}
+        headers = {}
+        for ticker_id in last_dates:
+            meta = fetch_meta.get(self.URL_TICKER_CSV_TEMPLATE + ticker_id)
+            if meta is not None:
+                headers[ticker_id] = conditional_headers(meta)
+        self.unchanged = set()
+        for result in self.iter_ticker_histories(self.tickers["id"], headers):
+            url = self.URL_TICKER_CSV_TEMPLATE + result.ticker_id
+            meta = fetch_meta.get(url)
+            now = datetime.datetime.now()
+            if result.response.status_code == 304 and meta is None:
+                # Not modified since a download of which nothing is stored, next sync requests it unconditionally
+                self.record_failure(result.ticker_id, FetchError(url, "HTTP 304 to an unconditional request", 1))
+                continue
+            if result.response.status_code == 304:
+                self.unchanged.add(result.ticker_id)
+                self.metrics.inc("tickers_unchanged_total")
+                self.pending_fetch_meta[result.ticker_id] = dict(meta, last_success=now)
+                continue
+            content = result.response.content
+            record = fetch_record(url, result.response, now)
+            self.pending_fetch_meta[result.ticker_id] = record
+            if result.ticker_id in last_dates and meta is not None and meta["content_hash"] == record["content_hash"]:
+                self.unchanged.add(result.ticker_id)
+                self.metrics.inc("tickers_unchanged_total")
+                continue
+            if self.archive_dir is not None:
+                with open(os.path.join(self.archive_dir, result.file_name), "wb") as f:
+                    f.write(content)
+            yield parse_history, result.ticker_id, content, last_dates.get(result.ticker_id)
+        if self.unchanged:
+            self.logger.info("History of {} ticker(s) unchanged since last sync.".format(len(self.unchanged)))
+
+    def load_fetch_meta(self, urls=None) -> dict:
+        """
+        Returns the fetch_meta records of urls, or the whole table, as a {url: record} mapping.
+        """
+        table = models.FetchMetaModel.__table__
+        sql = select(table) if urls is None else select(table).where(table.c.url.in_(list(urls)))
+        with self.connect() as connection:
+            table.create(bind=connection, checkfirst=True)
+            return {row["url"]: dict(row) for row in connection.execute(sql).mappings()}
+
+    def write_fetch_meta(self, ticker_ids=None) -> None:
+        """
+        Writes the pending fetch_meta records of ticker_ids (or page urls), or all of them, once their rows are
+        stored.
+        """
+        ticker_ids = list(self.pending_fetch_meta) if ticker_ids is None else ticker_ids
+        records = [self.pending_fetch_meta.pop(t) for t in ticker_ids if t in self.pending_fetch_meta]
+        if not records:
+            return
+        table = models.FetchMetaModel.__table__
+        with self.connect() as connection:
+            table.create(bind=connection, checkfirst=True)
+            models.upsert(connection, table, records)
+
+    def iter_parsed_histories(self, tasks, workers=None):
+        """
+        Runs parse tasks, (function, ticker_id, *args) tuples, in parse_workers processes and yields the
+        (ticker_id, df, events) they return in completion order. Tasks are submitted as the workers free up so
+        that pending csv contents don't pile up, and a failing task is recorded as a failure of its ticker.
+
+        Workers are started with forkserver (spawn where it's unavailable) rather than fork: the process runs the
+        fetcher's threads meanwhile, and possibly those of an auto-refresh or a server, and forking a multi-threaded
+        process can deadlock the child.
+
+        :param workers: number of processes overriding parse_workers, 0 runs the tasks in the calling thread
+        """
+        workers = self.parse_workers if workers is None else workers
+        if not workers:
+            for function, ticker_id, *args in tasks:
+                try:
+                    seconds, parsed = timed(function, ticker_id, *args)
+                except Exception as e:
+                    self.record_failure(ticker_id, e)
+                    continue
+                self.metrics.observe("phase_seconds", seconds, phase="parse")
+                yield parsed
+            return
+        start_method = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+        with concurrent.futures.ProcessPoolExecutor(max_workers=workers,
+                                                    mp_context=multiprocessing.get_context(start_method)) as executor:
+            pending = {}
+            tasks = iter(tasks)
+            while True:
+                for function, ticker_id, *args in itertools.islice(tasks, 2 * workers - len(pending)):
+                    pending[executor.submit(timed, function, ticker_id, *args)] = ticker_id
+                if not pending:
+                    return
+                done, _ = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+                for future in done:
+                    ticker_id = pending.pop(future)
+                    try:
+                        seconds, parsed = future.result()
+                    except Exception as e:
+                        self.record_failure(ticker_id, e)
+                        continue
+                    self.metrics.observe("phase_seconds", seconds, phase="parse")
+                    yield parsed
+
+    def write_histories(self, parsed) -> None:
+        """
+        Single writer of the ingestion pipeline: buffers parsed (ticker_id, df, events) until batch_size rows are
+        pending and writes them with write_history_batch.
+        """
+        batch, batch_events, batch_rows, batch_ids = [], [], 0, []
+        for ticker_id, df, events in parsed:
+            batch_ids.append(ticker_id)
+            if df.empty:
+                continue
+            batch.append(df)
+            batch_events.append(events)
+            batch_rows += len(df)
+            if batch_rows >= self.batch_size:
+                self.write_history_batch(batch, batch_events)
+                self.write_fetch_meta(batch_ids)
+                batch, batch_events, batch_rows, batch_ids = [], [], 0, []
+        self.write_history_batch(batch, batch_events)
+        self.write_fetch_meta()
+        self.materialize_sector_aggregates()
+
+    def write_history_batch(self, frames, events=()) -> None:
+        """
+        Upserts a list of history frames having a ticker_id column into the history store at once, along with the
+        adjustment events found in them.
+        """
+        if not frames:
+            return
+        df = pd.concat(frames, ignore_index=True)
+        with self.metrics.phase("write"):
+            self.store.write(df)
+        self.metrics.inc("rows_written_total", len(df))
+        self.write_latest_bars(df)
+        with self.metrics.phase("adjustments"):
+            self.write_adjustments(pd.concat(events, ignore_index=True) if len(events) else None)
+        if self.materialize:
+            with self.metrics.phase("aggregates"):
+                self.materialize_aggregates(df.groupby("ticker_id")["<DTYYYYMMDD>"].min())
+            # Sector aggregates depend on every ticker of the written dates, they're recomputed once all are written
+            first_date = df["<DTYYYYMMDD>"].min()
+            if self.sectors_stale_since is None or first_date < self.sectors_stale_since:
+                self.sectors_stale_since = first_date
+        self.notify_write("history", set(df["ticker_id"]))
+
+    def write_adjustments(self, events, replace=False) -> None:
+        """
+        Upserts adjustment events (see adjustment.detect_adjustments) into the adjustments table.
+
+        :param replace: if True, the stored events are all deleted first
+        """
+        table = models.AdjustmentModel.__table__
+        with self.connect() as connection:
+            table.create(bind=connection, checkfirst=True)
+            if replace:
+                connection.execute(table.delete())
+            if events is not None and not events.empty:
+                models.upsert(connection, table, events[EVENT_COLUMNS].to_dict("records"))
+
+    def write_latest_bars(self, df, replace=False) -> None:
+        """
+        Keeps the latest_bars table holding the last session of every ticker up to date with the rows of df, rows
+        older than the stored latest bar of their ticker being ignored.
+
+        :param replace: if True, the stored bars are all deleted first
+        """
+        table = models.LatestBarModel.__table__
+        columns = [c.name for c in table.columns]
+        latest = df.loc[df.groupby("ticker_id", observed=True)["<DTYYYYMMDD>"].idxmax()]
+        with self.connect() as connection:
+            table.create(bind=connection, checkfirst=True)
+            if replace:
+                connection.execute(table.delete())
+            else:
+                date = table.c["<DTYYYYMMDD>"]
+                sql = select(table.c.ticker_id, date).where(table.c.ticker_id.in_(list(latest["ticker_id"])))
+                stored = dict(connection.execute(sql).all())
+                stored_dates = pd.to_datetime(latest["ticker_id"].map(stored))
+                latest = latest.loc[stored_dates.isna() | (latest["<DTYYYYMMDD>"] >= stored_dates)]
+            latest = latest.reindex(columns=columns)
+            models.upsert(connection, table, latest.astype(object).where(latest.notna(), None).to_dict("records"))
+
+    def table_empty(self, table) -> bool:
+        """
+        Whether table is missing or empty.
+        """
+        with self.connect() as connection:
+            if not inspect(connection).has_table(table.name):
+                return True
+            return connection.execute(select(*table.primary_key.columns).limit(1)).first() is None
+
+    def latest_bars_missing(self) -> bool:
+        """
+        Whether the latest_bars table is missing or empty.
+        """
+        return self.table_empty(models.LatestBarModel.__table__)
+
+    def aggregates_missing(self) -> bool:
+        """
+        Whether histories are stored while the ticker_bars, ticker_indicators or sector_aggregates table is missing
+        or empty. Histories are looked up in latest_bars, which holds a row per stored ticker.
+        """
+        if self.latest_bars_missing():
+            return False
+        return any(self.table_empty(model.__table__)
+                   for model in (models.BarModel, models.IndicatorModel, models.SectorAggregateModel))
+
+    def rebuild_latest_bars(self) -> None:
+        """
+        Recomputes the latest_bars table from the last stored row of every ticker (see
+        BaseHistoryStore.read_latest).
+        """
+        self.logger.info("Rebuilding latest bars...")
+        latest = self.store.read_latest()
+        self.write_latest_bars(latest, replace=True)
+        self.notify_write("history", set(latest["ticker_id"]))
+
+    def rebuild_adjustments(self) -> None:
+        """
+        Recomputes the adjustment events of every stored ticker in one streamed pass over the history store, see
+        iter_stored_histories.
+        """
+        self.logger.info("Rebuilding adjustments...")
+        events, ticker_ids = [], set()
+        for history in self.iter_stored_histories(columns=["<CLOSE>", "<OPEN>"]):
+            events.append(detect_adjustments(history))
+            ticker_ids.update(history["ticker_id"])
+        events = pd.concat(events, ignore_index=True) if events else None
+        self.write_adjustments(events, replace=True)
+        self.notify_write("history", ticker_ids)
+        self.logger.info("Rebuilding adjustments finished, {} events found.".format(0 if events is None else
+                                                                                      len(events)))
+
+    def iter_stored_histories(self, columns=None):
+        """
+        Streams the history store in frames of whole ticker histories: chunks of batch_size rows, a ticker whose
+        rows span two chunks being moved to the later one.
+        """
+        pending = None
+        for chunk in self.store.iter_read(columns=columns, chunksize=self.batch_size):
+            if pending is not None:
+                chunk = pd.concat([pending, chunk], ignore_index=True)
+            last = chunk["ticker_id"] == chunk["ticker_id"].iloc[-1]
+            pending = chunk.loc[last]
+            if not last.all():
+                yield chunk.loc[~last]
+        if pending is not None:
+            yield pending
+
+    def materialize_aggregates(self, first_dates) -> None:
+        """
+        Recomputes the bars and indicators affected by newly written sessions, reading only the tail of the
+        histories they depend on.
+
+        :param first_dates: Series mapping ticker ids to the earliest <DTYYYYMMDD> written for them
+        """
+        first_dates = pd.to_datetime(first_dates)
+        # Whole periods are needed for the bars, and about INDICATOR_LOOKBACK sessions for the indicators. Each
+        # ticker is read from its own start, tickers sharing one being read together
+        bar_start = pd.concat([tail_start(first_dates, period) for period in PERIODS], axis=1).min(axis=1)
+        lookback_start = first_dates - pd.Timedelta(days=2 * INDICATOR_LOOKBACK)
+        starts = pd.concat([bar_start, lookback_start], axis=1).min(axis=1)
+        histories = []
+        for start, group in starts.groupby(starts):
+            ids = list(group.index)
+            history = self.store.read(ids, start=start, columns=self.AGGREGATE_SOURCE_COLUMNS)
+            # Tickers that weren't traded for a while need older sessions for their indicators
+            before = history["<DTYYYYMMDD>"] < history["ticker_id"].map(first_dates)
+            sessions_before = before.groupby(history["ticker_id"]).sum().reindex(ids, fill_value=0)
+            short = sessions_before.index[sessions_before < INDICATOR_LOOKBACK]
+            if len(short):
+                older = self.store.read(short, end=start, columns=self.AGGREGATE_SOURCE_COLUMNS)
+                older = older.loc[older["<DTYYYYMMDD>"] < start].groupby("ticker_id").tail(INDICATOR_LOOKBACK)
+                history = pd.concat([older, history], ignore_index=True)
+            histories.append(history)
+        history = pd.concat(histories, ignore_index=True)
+        bars = pd.concat([resample_bars(history, period) for period in PERIODS], ignore_index=True)
+        bars = bars.loc[bars["<DTYYYYMMDD>"] >= bars["ticker_id"].map(first_dates)]
+        indicators = rolling_indicators(history)
+        indicators = indicators.loc[indicators["<DTYYYYMMDD>"] >= indicators["ticker_id"].map(first_dates)]
+        self.write_aggregates(bars, indicators)
+
+    def materialize_sector_aggregates(self) -> None:
+        """
+        Recomputes the sector aggregates of the dates written since they were last materialized, from the rows of
+        every ticker on those dates.
+        """
+        if self.sectors_stale_since is None:
+            return
+        with self.metrics.phase("aggregates"):
+            history = self.store.read(start=self.sectors_stale_since, columns=SECTOR_SOURCE_COLUMNS)
+            self.write_sector_aggregates(sector_aggregates(history, self.ticker_sectors()))
+        self.sectors_stale_since = None
+        self.notify_write("history", set())
+
+    def write_sector_aggregates(self, aggregates, replace=False) -> None:
+        """
+        Upserts sector aggregates into the sector_aggregates table.
+
+        :param replace: if True, the stored aggregates are all deleted first
+        """
+        table = models.SectorAggregateModel.__table__
+        df = aggregates[SECTOR_COLUMNS]
+        with self.connect() as connection:
+            table.create(bind=connection, checkfirst=True)
+            if replace:
+                connection.execute(table.delete())
+            if not df.empty:
+                models.upsert(connection, table, df.astype(object).where(df.notna(), None).to_dict("records"))
+
+    def ticker_sectors(self) -> pd.Series:
+        """
+        Returns the sector of every ticker, indexed by ticker id.
+        """
+        tickers = self.tickers if self.tickers is not None else self.fetch_tickers()
+        return tickers.set_index("id")["sector"]
+
+    def write_aggregates(self, bars, indicators, replace=False) -> None:
+        """
+        Upserts bars and indicators into the ticker_bars and ticker_indicators tables in one transaction.
+
+        :param replace: if True, the stored aggregates are all deleted first
+        """
+        tables = [(models.BarModel.__table__, bars[BAR_COLUMNS]),
+                  (models.IndicatorModel.__table__, indicators[INDICATOR_COLUMNS])]
+        with self.connect() as connection:
+            for table, df in tables:
+                table.create(bind=connection, checkfirst=True)
+                if replace:
+                    connection.execute(table.delete())
+                if not df.empty:
+                    models.upsert(connection, table, df.astype(object).where(df.notna(), None).to_dict("records"))
+
+    def rebuild_aggregates(self) -> None:
+        """
+        Recomputes the bars, indicators and sector aggregates of every stored ticker in one streamed pass over the
+        history store, see iter_stored_histories. Bars and indicators are written a chunk of tickers at a time, the
+        sector sums of the chunks are accumulated per sector and date.
+        """
+        self.logger.info("Rebuilding aggregates...")
+        sectors = self.ticker_sectors()
+        sums, ticker_ids = None, set()
+        for history in self.iter_stored_histories(columns=self.AGGREGATE_SOURCE_COLUMNS):
+            bars = pd.concat([resample_bars(history, period) for period in PERIODS], ignore_index=True)
+            self.write_aggregates(bars, rolling_indicators(history), replace=not ticker_ids)
+            ticker_ids.update(history["ticker_id"])
+            chunk_sums = sector_sums(history, sectors)
+            if sums is not None:
+                chunk_sums = pd.concat([sums, chunk_sums], ignore_index=True)
+                chunk_sums = chunk_sums.groupby(["sector", "<DTYYYYMMDD>"], as_index=False, sort=False).sum()
+            sums = chunk_sums
+        if sums is None:
+            self.write_aggregates(pd.DataFrame(columns=BAR_COLUMNS), pd.DataFrame(columns=INDICATOR_COLUMNS),
+                                  replace=True)
+            aggregates = pd.DataFrame(columns=SECTOR_COLUMNS)
+        else:
+            aggregates = aggregate_sector_sums(sums)
+        self.write_sector_aggregates(aggregates, replace=True)
+        self.sectors_stale_since = None
+        self.notify_write("history", ticker_ids)
+        self.logger.info("Rebuilding aggregates finished.")
+
+    def fetch_last_dates(self) -> dict:
+        self.logger.info("Getting last stored dates from history store...")
+        return self.store.last_dates()
+
+    def upsert_ticker_history(self, ticker_id, df) -> None:
+        """
+        Writes df into the history store replacing rows of ticker_id that share a <DTYYYYMMDD> with it.
+        """
+        df = df.assign(ticker_id=ticker_id)
+        self.write_history_batch([df], [detect_adjustments(df)])
+        self.materialize_sector_aggregates()
+
+    def migrate_history(self) -> None:
+        """
+        Moves histories stored in the legacy one-table-per-ticker layout into the history store.
+        """
+        with self.connect() as connection:
+            inspector = inspect(connection)
+            legacy_tables = models.legacy_history_tables(connection)
+            legacy_columns = {name: {c["name"] for c in inspector.get_columns(name)} for name in legacy_tables}
+        if not legacy_tables:
+            return
+        self.logger.info("Migrating {} legacy history tables to the history store...".format(len(legacy_tables)))
+        columns = ["ticker_id", "<DTYYYYMMDD>"] + self.store.COLUMNS
+        for ticker_id in legacy_tables:
+            legacy = models.create_ticker_history_model(ticker_id).__table__
+            sql = select(*[c for c in legacy.columns if c.name in legacy_columns[ticker_id]])
+            with self.connect() as connection:
+                result = connection.execute(sql)
+                df = pd.DataFrame(result.all(), columns=list(result.keys()))
+            df["ticker_id"] = ticker_id
+            self.store.write(df.reindex(columns=columns))
+            with self.connect() as connection:
+                legacy.drop(bind=connection)
+            self.notify_write("history", {ticker_id})
+        self.logger.info("Migrating legacy history tables finished.")
+        self.rebuild_latest_bars()
+        self.rebuild_adjustments()
+        if self.materialize:
+            self.rebuild_aggregates()
+
+    def get_tickers(self, content=None):
+        """
+        :param content: the URL_BAZAR_ADDI page, downloaded if None
+        """
+        if content is None:
+            self.logger.info("Getting URL_BAZAR_ADDI...")
+            content = self.fetcher.get(self.URL_BAZAR_ADDI).content
         self.logger.info("Parsing table data into dataframe...")
-        html_doc = r.content
-        soup = BeautifulSoup(markup=html_doc, features='lxml')
-        table = soup.select("table#tblToGrid")[0]
-        ID_PATTERN = re.compile(".+code=(.+)")
-        for tr in table.find_all(name="tr")[1:]:
-            data_row = {}
-            for i, td in enumerate(tr.find_all(name="td"), start=1):
-                if i == 1:  # ticker_code
-                    data_row[bazar_adi_columns[8]] = td.text
-                elif i == 2:  # market
-                    data_row[bazar_adi_columns[6]] = td.text
-                elif i == 3:  # sector
-                    data_row[bazar_adi_columns[5]] = td.text
-                elif i == 4:  # sub_market
-                    data_row[bazar_adi_columns[7]] = td.text
-                elif i == 5:  # latin_ticker
-                    data_row[bazar_adi_columns[4]] = td.text
-                elif i == 6:  # latin_name
-                    data_row[bazar_adi_columns[3]] = td.text
-                elif i == 7:  # ticker
-                    data_row[bazar_adi_columns[2]] = td.text
-                elif i == 8:  # name & id
-                    data_row[bazar_adi_columns[1]] = td.text
-                    m = td.a['href']
-                    ticker_id = ID_PATTERN.search(m).groups()[0]
-                    data_row[bazar_adi_columns[0]] = ticker_id
-            df_bazar_adi = df_bazar_adi.append(data_row, ignore_index=True)
-        self.tickers = df_bazar_adi
+        self.tickers = self.parse_tickers(content)
         self.__filter_tickers()
 
+    def parse_tickers(self, html) -> pd.DataFrame:
+        """
+        Builds the tickers dataframe from the URL_BAZAR_ADDI page in one pass.
+        """
+        columns = ["ticker_code", "market", "sector", "sub_market", "latin_ticker", "latin_name", "ticker", "name"]
+        cells = read_grid(html, len(columns))
+        tickers = pd.DataFrame(grid_text(cells), columns=columns)
+        hrefs = pd.Series([(td.xpath("./a/@href") or [""])[0] if td is not None else "" for td in cells[:, 7]],
+                          dtype=object)
+        tickers["id"] = hrefs.str.extract("code=([^&]+)", expand=False)
+        bazar_adi_columns = ["id", "name", "ticker", "latin_name", "latin_ticker", "sector", "market", "sub_market",
+                             "ticker_code"]
+        return tickers[bazar_adi_columns]
+
     def __filter_tickers(self):
         self.r = self.tickers.loc[self.tickers["latin_name"].str.endswith("-R"), :]
         self.tickers = self.tickers.loc[~self.tickers["latin_name"].str.endswith("-R"), :]
         self.d = self.tickers.loc[self.tickers["latin_name"].str.endswith("-D"), :]
         self.tickers = self.tickers.loc[~self.tickers["latin_name"].str.endswith("-D"), :]
-        self.tickers.reset_index()
+        self.tickers = self.tickers.reset_index(drop=True)
 
     def fetch_tickers(self):
         self.logger.info("Getting tickers from database...")
-        sql = self.session.query(TickerModel).statement
-        tickers = pd.DataFrame(self.session.bind.connect().execute(sql))
+        with self.connect() as connection:
+            result = connection.execute(select(TickerModel.__table__))
+            tickers = pd.DataFrame(result.all(), columns=list(result.keys()))
         return tickers
 
     def save_tickers(self):
         self.logger.info("Writing df_stock_list to database...")
-        self.tickers.to_sql(name="tickers", con=self.session.bind, if_exists="replace",
-                                    index=False, chunksize=500,
-                                    dtype={"id": String,
-                                           "name": String,
-                                           "ticker": String,
-                                           "latin_name": String,
-                                           "latin_ticker": String,
-                                           "sector": String,
-                                           "market": String,
-                                           "sub_market": String,
-                                           "ticker_code": String})
-
-    def get_sectors(self):
-        self.logger.info("Getting URL_SECTORS_LIST...")
-        r = requests.get(self.URL_SECTORS_LIST)
-        self.logger.info("Creating sectors_list empty dataframe...")
-        sectors_list_columns = ["code", "name"]
-        sectors = pd.DataFrame(columns=sectors_list_columns)
+        with self.connect() as connection:
+            self.tickers.to_sql(name="tickers", con=connection, if_exists="replace",
+                                index=False, chunksize=500,
+                                dtype={"id": String,
+                                       "name": String,
+                                       "ticker": String,
+                                       "latin_name": String,
+                                       "latin_ticker": String,
+                                       "sector": String,
+                                       "market": String,
+                                       "sub_market": String,
+                                       "ticker_code": String})
+        self.notify_write("tickers")
+
+    def get_sectors(self, content=None):
+        """
+        :param content: the URL_SECTORS_LIST page, downloaded if None
+        """
+        if content is None:
+            self.logger.info("Getting URL_SECTORS_LIST...")
+            content = self.fetcher.get(self.URL_SECTORS_LIST).content
         self.logger.info("Parsing table data into dataframe...")
-        html_doc = r.content
-        soup = BeautifulSoup(markup=html_doc, features="lxml")
-        table = soup.select("table#tblToGrid")[0]
-        for tr in table.find_all(name="tr")[1:]:
-            data_row = {}
-            for i, td in enumerate(tr.find_all(name="td"), start=1):
-                if i == 1:
-                    data_row[sectors_list_columns[0]] = td.text
-                elif i == 2:
-                    data_row[sectors_list_columns[1]] = td.text
-            sectors = sectors.append(data_row, ignore_index=True)
-        self.sectors = sectors
+        self.sectors = self.parse_sectors(content)
+
+    def parse_sectors(self, html) -> pd.DataFrame:
+        """
+        Builds the sectors dataframe from the URL_SECTORS_LIST page in one pass.
+        """
+        columns = ["code", "name"]
+        return pd.DataFrame(grid_text(read_grid(html, len(columns))), columns=columns)
 
     def save_sectors(self):
         self.logger.info("Writing sectors to database...")
-        self.sectors.to_sql(name="sectors", con=self.session.bind, if_exists="replace",
-                                    index=False, chunksize=500,
-                                    dtype={"code": String,
-                                           "name": String})
+        with self.connect() as connection:
+            self.sectors.to_sql(name="sectors", con=connection, if_exists="replace",
+                                index=False, chunksize=500,
+                                dtype={"code": String,
+                                       "name": String})
+        self.notify_write("sectors")
 
     def get_history(self):
         # Trying to create TEMP_DIR
@@ -176,90 +752,153 @@ class TSEScrapper(BaseScrapper):
         except OSError as e:
             if e.errno != errno.EEXIST:
                 raise
+        files_list = os.listdir("./{}".format(self.TEMP_DIR))
+        self.ticker_history_set = {self.get_id_from_history_file(f) for f in files_list}
         self.logger.info("Fetching csv files...")
-        with concurrent.futures.ThreadPoolExecutor() as executor:
-            futures = []
-            for ticker_id in self.tickers["id"]:
-                if not self.does_ticker_history_exist(ticker_id):
-                    futures.append(executor.submit(self.get_ticker_history, ticker_id=ticker_id))
-            for future in concurrent.futures.as_completed(futures):
-                result = future.result()
-                with open("{}/{}".format(self.TEMP_DIR, result.file_name), "wb") as f:
-                    f.write(result.response.content)
-            self.logger.info("Downloading csv files finished.")
+        ticker_ids = [ticker_id for ticker_id in self.tickers["id"] if not self.does_ticker_history_exist(ticker_id)]
+        for result in self.iter_ticker_histories(ticker_ids):
+            with open("{}/{}".format(self.TEMP_DIR, result.file_name), "wb") as f:
+                f.write(result.response.content)
+        self.logger.info("Downloading csv files finished.")
 
     def save_history(self):
         files_list = os.listdir("./{}".format(self.TEMP_DIR))
         files_id = [re.findall("(\d+)\|.*", f)[0] for f in files_list]
         files = dict(zip(files_id, files_list))
-        self.logger.info("Loading csv files as dataframe to memory...")
-        tickers_history = {}
-        with concurrent.futures.ThreadPoolExecutor() as executor:
-            futures = []
-            for k, file_name in files.items():  # k=ticker_id & v=file_name
-                if not inspect(self.session.bind).has_table(k):
-                    futures.append(executor.submit(self.read_ticker_history, file_name))
-            for future in concurrent.futures.as_completed(futures):
-                ticker_id, df = future.result()
-                tickers_history[ticker_id] = df
-
-        self.logger.info("Writing  stocks data to database...")
-        with concurrent.futures.ThreadPoolExecutor() as executor:
-            futures = []
-            for k, df in tickers_history.items():
-                kwargs = dict(name=k, con=self.session.bind, if_exists="replace",
-                              index=False, chunksize=500,
-                              dtype={"<TICKER>": String,
-                                     "<DTYYYYMMDD>": DateTime,
-                                     "<FIRST>": Float,
-                                     "<HIGH> ": Float,
-                                     "<LOW>": Float,
-                                     "<CLOSE>": Float,
-                                     "<VALUE>": Integer,
-                                     "<VOL>": Integer,
-                                     "<OPENINT>": Integer,
-                                     "<PER>": String,
-                                     "<OPEN>": Float,
-                                     "<LAST>": Float})
-                futures.append(executor.submit(df.to_sql, **kwargs))
-
-    def get_ticker_history(self, ticker_id: int) -> TickerHistoryFile:
-        self.logger.info("Getting history for ticker with id={}...".format(ticker_id))
-        url = self.URL_TICKER_CSV_TEMPLATE + ticker_id
-        response = requests.get(url)
-        disposition = response.headers['content-disposition']
-        file_name = re.findall("filename=(.+)", disposition)[0]
+        stored_ids = set(self.fetch_last_dates())
+        self.logger.info("Parsing csv files and writing them to the history store...")
+        tasks = [(parse_history_file, k, os.path.join(self.TEMP_DIR, file_name))
+                 for k, file_name in files.items() if k not in stored_ids]  # k=ticker_id
+        parsed = progress(self.iter_parsed_histories(tasks), self.progress, total=len(tasks),
+                          desc="Parsing histories", unit="ticker")
+        self.write_histories(parsed)
+
+    def iter_ticker_histories(self, ticker_ids, headers=None):
+        """
+        Downloads the csv of every ticker concurrently through the fetcher, yielding a TickerHistoryFile as each one
+        arrives. Failed downloads are recorded in self.failures instead of aborting the others.
+
+        :param headers: {ticker_id: headers} of extra request headers
+        """
+        urls = {ticker_id: self.URL_TICKER_CSV_TEMPLATE + ticker_id for ticker_id in ticker_ids}
+        results = iter(progress(self.fetcher.iter_fetch(urls, headers), self.progress, total=len(urls),
+                                desc="Downloading histories", unit="ticker"))
+        # Time this thread waits for downloads, the rest of the pipeline runs while they're in flight
+        waited = 0.0
+        while True:
+            start = time.perf_counter()
+            result = next(results, None)
+            waited += time.perf_counter() - start
+            if result is None:
+                break
+            if result.error is not None:
+                self.record_failure(result.key, result.error)
+                continue
+            yield self.make_ticker_history_file(result.key, result.response)
+        self.metrics.observe("phase_seconds", waited, phase="fetch")
+        if self.failures:
+            self.logger.warning("Updating history of {} ticker(s) failed.".format(len(self.failures)))
+
+    def make_ticker_history_file(self, ticker_id, response) -> TickerHistoryFile:
+        disposition = response.headers.get('content-disposition', '')
+        file_name = (re.findall("filename=(.+)", disposition) or ["{}.csv".format(ticker_id)])[0]
         file_name = ticker_id + '|' + file_name
         return self.TickerHistoryFile(ticker_id, file_name, response)
 
-    def save_ticker_history(self, ticker_history_file: TickerHistoryFile) -> None:
-        file_name = ticker_history_file.file_name
-        df = pd.read_csv(self.TEMP_DIR + "/" + file_name)
-        df['<DTYYYYMMDD>'] = pd.to_datetime(df['<DTYYYYMMDD>'], format='%Y%m%d')
-        df.to_sql(name=ticker_history_file.ticker_id, con=self.session.bind, if_exists="replace",
-                  index=False, chunksize=500,
-                  dtype={"<TICKER>": String,
-                         "<DTYYYYMMDD>": DateTime,
-                         "<FIRST>": Float,
-                         "<HIGH> ": Float,
-                         "<LOW>": Float,
-                         "<CLOSE>": Float,
-                         "<VALUE>": Integer,
-                         "<VOL>": Integer,
-                         "<OPENINT>": Integer,
-                         "<PER>": String,
-                         "<OPEN>": Float,
-                         "<LAST>": Float})
-        return None
-
-    def read_ticker_history(self, file_name):
-        df = pd.read_csv(self.TEMP_DIR + "/" + file_name)
-        df['<DTYYYYMMDD>'] = pd.to_datetime(df['<DTYYYYMMDD>'], format='%Y%m%d')
-        ticker_id = self.get_id_from_history_file(file_name)
-        return ticker_id, df
+    def record_failure(self, ticker_id, error) -> None:
+        self.logger.warning("Updating history for ticker with id={} failed: {}".format(ticker_id, error))
+        self.failures[ticker_id] = error
+        self.metrics.inc("tickers_failed_total")
+        # The download must be repeated next time, so its validators aren't kept
+        self.pending_fetch_meta.pop(ticker_id, None)
 
     def does_ticker_history_exist(self, id):
         return str(id) in self.ticker_history_set
 
     def get_id_from_history_file(self, file_name) -> str:
         return re.findall("(\d+)\|.*", file_name)[0]
+
+
+def conditional_headers(meta):
+    """
+    Returns the headers making a request conditional on the validators of a fetch_meta record.
+    """
+    headers = {}
+    if meta.get("etag"):
+        headers["If-None-Match"] = meta["etag"]
+    if meta.get("last_modified"):
+        headers["If-Modified-Since"] = meta["last_modified"]
+    return headers
+
+
+def fetch_record(url, response, now=None):
+    """
+    Returns the fetch_meta record of a successful download of url: its validators and content hash.
+    """
+    return {"url": url, "etag": response.headers.get("ETag"), "last_modified": response.headers.get("Last-Modified"),
+            "content_hash": hashlib.sha256(response.content).hexdigest(),
+            "last_success": now if now is not None else datetime.datetime.now()}
+
+
+def timed(function, *args):
+    """
+    Returns (seconds, function(*args)), so that a worker process can report how long its task took.
+    """
+    start = time.perf_counter()
+    result = function(*args)
+    return time.perf_counter() - start, result
+
+
+def parse_history(ticker_id, content, last_date=None):
+    """
+    Parses an Export-txt csv and detects its adjustment events, keeping only the sessions after last_date.
+    Module level so that it can run in a worker process.
+
+    :return: (ticker_id, history frame with a ticker_id column, adjustment events)
+    """
+    df = pd.read_csv(io.BytesIO(content))
+    df['<DTYYYYMMDD>'] = pd.to_datetime(df['<DTYYYYMMDD>'], format='%Y%m%d')
+    df["ticker_id"] = ticker_id
+    # Detecting adjustments on the full csv, so that an event on the first new session isn't missed
+    events = detect_adjustments(df)
+    if last_date is not None:
+        df = df.loc[df["<DTYYYYMMDD>"] > last_date]
+        events = events.loc[events["<DTYYYYMMDD>"] > last_date]
+    return ticker_id, df, events
+
+
+def parse_history_file(ticker_id, path):
+    """
+    parse_history reading the csv from path, so that only the path is sent to the worker process.
+    """
+    with open(path, "rb") as f:
+        return parse_history(ticker_id, f.read())
+
+
+def read_grid(html, width) -> np.ndarray:
+    """
+    Returns the <td> elements of the data rows of tsetmc's table#tblToGrid as a rows x width array, missing cells of
+    short rows being None and extra cells of long rows left out.
+    """
+    document = lxml.html.fromstring(html, parser=lxml.html.HTMLParser(encoding="utf-8"))
+    tables = document.xpath('//table[@id="tblToGrid"]')
+    if not tables:
+        raise ValueError("table#tblToGrid not found")
+    header, *rows = tables[0].xpath(".//tr") or [None]
+    cells = tables[0].xpath(".//tr/td")[len(header.xpath("./td")):] if rows else []
+    if rows and not len(cells) % len(rows) and len(cells) // len(rows) >= width:
+        grid = np.empty(len(cells), dtype=object)
+        grid[:] = cells
+        return grid.reshape(len(rows), -1)[:, :width]
+    # Irregular or short rows, aligning them one by one
+    grid = np.empty((len(rows), width), dtype=object)
+    for i, row in enumerate(rows):
+        for j, td in enumerate(row.xpath("./td")[:width]):
+            grid[i, j] = td
+    return grid
+
+
+def grid_text(cells) -> np.ndarray:
+    texts = np.empty(cells.size, dtype=object)
+    texts[:] = [td.text_content() if td is not None else None for td in cells.ravel()]
+    return texts.reshape(cells.shape)